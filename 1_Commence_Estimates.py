@@ -1,8 +1,8 @@
 import streamlit as st
-from snowflake.snowpark.context import get_active_session
-from snowflake.snowpark import Session
 import warnings
 
+from helpers.utils import Utils
+
 warnings.filterwarnings("ignore")
 
 st.set_page_config(page_title=":bar_chart: Commence Estimates", page_icon="📈", layout="wide")
@@ -30,34 +30,14 @@ st.info(
     icon="ℹ️"
 )
 
-def create_session():
-    # Snowflake session
-    try:
-        return get_active_session()
-    except Exception as e:
-        None
-    # Use local session
-    if 'snowflake' in st.secrets:
-        return Session.builder.configs(st.secrets.snowflake).create()
-    # Current connection method
-    elif 'connection' in dir(st):
-        return st.connection("snowflake").session()
-    # 1.22
-    elif 'experimental_connection' in dir(st):
-        return st.experimental_connection("snowpark").session()
-    else:
-        raise 'Session not detected'
-
-
-if 'session' not in st.session_state:
-    session = create_session()
-    st.session_state['session'] = session
-else:
-    session = st.session_state.session
-
-current_role = session.get_current_role().replace('"', '')
-
-st.sidebar.warning(f"Login Role **{current_role}**")
+# connect, resume the warehouse and look up the role once for the session
+session = Utils.get_session()
+Utils.begin_page(__file__)
+
+current_role = Utils.get_session_role()
+
+with st.sidebar:
+    Utils.show_login_role()
 
 st.session_state['current_role'] = current_role
 
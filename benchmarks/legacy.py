@@ -0,0 +1,37 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+KEYS = ['COURSE', 'PERIOD', 'COMMENCING_STUDY_PERIOD', 'OWNING_FACULTY', 'COURSE_LEVEL_NAME', 'FEE_LIABILITY_GROUP']
+
+
+def legacy_project(base_df: pd.DataFrame, rules: list, default_increase: float, periods: list) -> pd.DataFrame:
+    """
+    The projection as the Generate Scenario handler used to run it: every rule
+    expanded into the cartesian product of its lists and merged into the rows,
+    once per period. Kept as the reference for project().
+    """
+    estimate_df = base_df.copy()
+    estimate_df['INCREASE_BY'] = float(default_increase)
+    df = estimate_df.copy()
+    estimate_all_df = estimate_df
+    for period in periods:
+        df['PERIOD'] = period
+        for rule in rules:
+            x = {
+                'COURSE': rule.get('courses'),
+                'PERIOD': rule.get('periods'),
+                'COMMENCING_STUDY_PERIOD': rule.get('commencing_study_periods'),
+                'OWNING_FACULTY': rule.get('owning_faculties'),
+                'COURSE_LEVEL_NAME': rule.get('course_level_names'),
+                'FEE_LIABILITY_GROUP': rule.get('fee_liability_groups'),
+                'INCREASE_BY': [rule.get('increase_by')],
+            }
+            rule_df = pd.DataFrame(list(itertools.product(*x.values())), columns=x.keys())
+            df = pd.merge(df, rule_df, how='left', on=KEYS, suffixes=('_OLD', ''))
+            df['INCREASE_BY'] = df['INCREASE_BY'].fillna(df['INCREASE_BY_OLD'])
+            df = df.drop(columns=['INCREASE_BY_OLD'])
+        df['COURSE_ENROLMENT_COUNT'] = np.ceil(df['COURSE_ENROLMENT_COUNT'] * (1 + df['INCREASE_BY']))
+        estimate_all_df = pd.concat([estimate_all_df, df], sort=False)
+    return estimate_all_df.reset_index(drop=True)
@@ -0,0 +1,307 @@
+"""
+Benchmarks over synthetic data, run from the repository root:
+
+    python -m benchmarks.run [--scale small|medium|large] [--courses N] [--legacy] [--output results.json]
+
+Nothing connects to Snowflake: generation and the dashboard run on pandas
+frames, the compare view on a Snowpark local testing session. Peak memory
+of reading a result at once or in batches is measured on an Arrow table
+standing in for the connector's result. The results are written as JSON
+with the commit they were measured on, so two runs can be diffed between
+commits.
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from benchmarks.legacy import legacy_project
+from benchmarks.synthetic import ACTUAL_NAME, PERIODS, SCALES, SCENARIO_NAME, generate
+from helpers import streaming
+from helpers.bitmap_filter import BitmapIndex
+from models.batch import LocalBackend
+from models.compare import ROLLUP_NAMES, filter_selections, rollup_df, rollup_grain, series_df
+from models.dashboard_cube import CUBE_DIMENSIONS, CUBE_FILTERS, CUBE_MEASURE
+from models.estimate import BASE_COLUMNS, ROUNDS, project, projection_periods, recompute
+from models.rule_coverage import CoverageIndex
+from models.rule_engine import CELL_DIMENSIONS, RuleEngine, migrate_rule
+from models.scenario_store import DIMENSIONS, ROLLUP_COLUMNS, ROLLUP_GRAINS, ROLLUP_TABLE, decode, lookup, read_decoded
+
+DEFAULT_INCREASE = 0.03
+# rows per Arrow record batch of the streamed reads
+STREAM_CHUNK = 8192
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def timed(fn, repeat: int) -> dict:
+    """ best and median wall time of fn over repeat runs; fn returns the rows it produced """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = fn()
+        seconds.append(time.perf_counter() - start)
+    return {'best': round(min(seconds), 6), 'median': round(statistics.median(seconds), 6), 'rows': int(rows)}
+
+
+def _local_session():
+    from snowflake.snowpark import Session
+
+    return Session.builder.config('local_testing', True).create()
+
+
+def migrated_rules(data: dict) -> list:
+    """ the synthetic rules in the current format, the catalogue taken from the scenario cells """
+    cells_df = data['scenario_data']
+    catalogue = {column: set(cells_df[column].unique()) for column in CELL_DIMENSIONS}
+    catalogue['PERIOD'] = set(PERIODS[1:])
+    course_faculty = dict(zip(cells_df['COURSE'], cells_df['OWNING_FACULTY']))
+    return [
+        migrate_rule(json.loads(content), catalogue, course_faculty) for content in data['rule']['RULE_CONTENT']
+    ]
+
+
+def encoded(df: pd.DataFrame) -> tuple:
+    """ the frame as the facts store it, an id column per dimension, and the lookups to decode it """
+    codes_df = df.drop(columns=[column.upper() for column in DIMENSIONS])
+    lookups = {}
+    for column, (_, _, fact) in DIMENSIONS.items():
+        codes, names = pd.factorize(df[column.upper()])
+        lookups[column] = lookup(np.arange(1, len(names) + 1), names)
+        codes_df[fact.upper()] = np.where(codes >= 0, codes + 1, np.nan)
+    return codes_df, lookups
+
+
+def rollup_rows(codes_df: pd.DataFrame) -> pd.DataFrame:
+    """ scenario_rollup of the encoded cells, each grain summed as the grouping sets of rollup_sql() do """
+    grains = []
+    for grain, columns in ROLLUP_GRAINS.items():
+        keys = ['SCENARIO_ID', 'PERIOD_ID', *(DIMENSIONS[column][2].upper() for column in columns)]
+        grains.append(
+            codes_df.groupby(keys).agg(
+                COURSE_ENROLMENT_COUNT=('COURSE_ENROLMENT_COUNT', 'sum'), CELLS=('COURSE_ENROLMENT_COUNT', 'size')
+            ).reset_index().assign(GRAIN=grain)
+        )
+    rows = pd.concat(grains, ignore_index=True)
+    return rows[['SCENARIO_ID', 'GRAIN', *(column.upper() for column in ROLLUP_COLUMNS), 'COURSE_ENROLMENT_COUNT', 'CELLS']]
+
+
+def save_rollup(session, scenario: pd.DataFrame, codes_df: pd.DataFrame, lookups: dict):
+    """ scenario_rollup and the tables rollup_df() joins it with, saved to the local session """
+    tables = {
+        ROLLUP_TABLE: rollup_rows(codes_df),
+        'scenario': scenario[['ID', 'SCENARIO_NAME', 'VERSION_NAME']],
+    }
+    for column in ROLLUP_NAMES:
+        table, name, _ = DIMENSIONS[column]
+        tables[table] = pd.DataFrame({'ID': lookups[column].index, name.upper(): lookups[column].to_numpy()})
+    for table, df in tables.items():
+        session.create_dataframe(df).write.save_as_table(table, mode='overwrite')
+
+
+def peak_bytes(fn) -> int:
+    """ peak of the Python allocations of fn, numpy and pandas buffers included; Arrow buffers are not traced """
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def memory(data: dict) -> dict:
+    """
+    Client memory of the scenario rows read as text and as decoded ids, and
+    the peak of aggregating, exporting and decoding one result read with
+    to_pandas() against reading it in batches through helpers.streaming,
+    the ids of the batches decoded by scenario_store.read_decoded().
+    """
+    codes_df, lookups = encoded(data['scenario_data'])
+    text = pa.Table.from_pandas(data['scenario_data'], preserve_index=False)
+    codes = pa.Table.from_pandas(codes_df, preserve_index=False)
+
+    def batches(table: pa.Table):
+        return (batch.to_pandas() for batch in table.to_batches(max_chunksize=STREAM_CHUNK))
+
+    by = ['SCENARIO_ID', 'PERIOD']
+    return {
+        'scenario_data.text_bytes': int(data['scenario_data'].memory_usage(deep=True).sum()),
+        'scenario_data.decoded_bytes': int(decode(codes_df, lookups).memory_usage(deep=True).sum()),
+        'aggregate.to_pandas_peak_bytes': peak_bytes(
+            lambda: text.to_pandas().groupby(by)['COURSE_ENROLMENT_COUNT'].sum()
+        ),
+        'aggregate.streaming_peak_bytes': peak_bytes(
+            lambda: streaming.aggregate(batches(text), by, ['COURSE_ENROLMENT_COUNT'])
+        ),
+        'export.to_pandas_peak_bytes': peak_bytes(lambda: text.to_pandas().to_csv(index=False).encode('utf-8')),
+        'export.streaming_peak_bytes': peak_bytes(lambda: streaming.to_csv(batches(text))),
+        'read.to_pandas_peak_bytes': peak_bytes(lambda: decode(codes.to_pandas(), lookups)),
+        'read.streaming_peak_bytes': peak_bytes(
+            lambda: read_decoded(batches(codes), lookups)
+        ),
+    }
+
+
+def cases(data: dict, legacy: bool = False) -> dict:
+    """ benchmark name -> function returning the rows it produced """
+    scenario = data['scenario'].assign(SCENARIO=lambda df: df['SCENARIO_NAME'] + ' (' + df['VERSION_NAME'] + ')')
+    scenario_df = data['scenario_data'].merge(
+        scenario[['ID', 'SCENARIO']].rename(columns={'ID': 'SCENARIO_ID'}), on='SCENARIO_ID'
+    )
+    backend = LocalBackend(data['commence_actual'], scenario_df, data['rule'])
+    rules = [json.loads(content) for content in data['rule']['RULE_CONTENT']]
+    rules_v2 = migrated_rules(data)
+    contents_v2 = [json.dumps(rule) for rule in rules_v2]
+    observed = ROUNDS['March Round']['observed_study_periods']
+    periods = projection_periods(horizon=ROUNDS['March Round']['horizon'])
+    base_scenario = f'{SCENARIO_NAME} (init)'
+    base_df = backend.calibration(ACTUAL_NAME, base_scenario, observed).base_df
+
+    cells_df = base_df[CELL_DIMENSIONS]
+    named_rules = {f'Rule {i + 1}': rule for i, rule in enumerate(rules_v2)}
+    coverage = CoverageIndex(cells_df, named_rules)
+
+    def coverage_query():
+        coverage.summary()
+        coverage.overlap()
+        return len(coverage.overridden(coverage.names))
+
+    # one course edited in the first projected period, against the whole projection
+    projected_df = project(base_df, rules, DEFAULT_INCREASE, periods)[BASE_COLUMNS]
+    course_df = projected_df[projected_df['COURSE'] == projected_df['COURSE'].iloc[0]]
+    course_edits = course_df[course_df['PERIOD'] == periods[0]]
+    course_df = course_df.assign(COURSE_ENROLMENT_COUNT=course_df['COURSE_ENROLMENT_COUNT'].where(
+        course_df['PERIOD'] != periods[0], course_df['COURSE_ENROLMENT_COUNT'] + 10
+    ))
+
+    session = _local_session()
+    compare_source = session.create_dataframe(scenario_df.drop(columns=['ID', 'SCENARIO_ID', 'IS_DELETED']))
+    compare_selections = {
+        'SCENARIO': scenario['SCENARIO'].tolist()[:2],
+        'OWNING_FACULTY': sorted(scenario_df['OWNING_FACULTY'].unique())[:1],
+    }
+    codes_df, lookups = encoded(data['scenario_data'])
+    # the chart's read of scenario_rollup, joined to the names as on the warehouse
+    save_rollup(session, data['scenario'], codes_df, lookups)
+    grain = rollup_grain(compare_selections)
+
+    source = data['draft_lp_ce_estimates_2024']
+    cube = source.groupby(CUBE_DIMENSIONS, as_index=False)[CUBE_MEASURE].sum()
+    index = BitmapIndex(cube, CUBE_FILTERS)
+    dashboard_selections = {
+        'OWNING_FACULTY': index.options('OWNING_FACULTY')[:2],
+        'FEE_LIABILITY_GROUP': index.options('FEE_LIABILITY_GROUP')[:1],
+    }
+
+    def dashboard_aggregate():
+        filtered = index.filter(dashboard_selections)
+        return len(filtered.groupby(['SCENARIO_TYPE', 'PERIOD_NAME'])[CUBE_MEASURE].sum())
+
+    result = {
+        'generation.calibrate': lambda: len(backend.calibration(ACTUAL_NAME, base_scenario, observed).base_df),
+        'generation.project': lambda: len(project(base_df, rules, DEFAULT_INCREASE, periods)),
+        'generation.recompute_course': lambda: len(
+            recompute(course_df, rules, DEFAULT_INCREASE, periods, edits=course_edits)
+        ),
+        'rules.resolve': lambda: RuleEngine(base_df).resolve(rules, DEFAULT_INCREASE, periods).size,
+        'rules.resolve_v2': lambda: RuleEngine(base_df).resolve(rules_v2, DEFAULT_INCREASE, periods).size,
+        'rules.load': lambda: len([json.loads(content) for content in data['rule']['RULE_CONTENT']]),
+        'rules.load_v2': lambda: len([json.loads(content) for content in contents_v2]),
+        'rules.coverage_build': lambda: CoverageIndex(cells_df, named_rules).size,
+        'rules.coverage_query': coverage_query,
+        'storage.decode': lambda: len(decode(codes_df, lookups)),
+        'compare.filter_series': lambda: len(series_df(filter_selections(compare_source, compare_selections)).to_pandas()),
+        'compare.rollup_series': lambda: len(series_df(rollup_df(session, grain, compare_selections)).to_pandas()),
+        'dashboard.cube': lambda: len(source.groupby(CUBE_DIMENSIONS, as_index=False)[CUBE_MEASURE].sum()),
+        'dashboard.index': lambda: BitmapIndex(cube, CUBE_FILTERS).size,
+        'dashboard.filter_aggregate': dashboard_aggregate,
+    }
+    if legacy:
+        result['rules.legacy_merge'] = lambda: len(legacy_project(base_df, rules, DEFAULT_INCREASE, periods))
+    return result
+
+
+def parity(data: dict) -> dict:
+    """ project() against the legacy merge projection, and the rules against their migrated form """
+    scenario_df = data['scenario_data'].assign(SCENARIO=f'{SCENARIO_NAME} (init)')
+    scenario_df = scenario_df[scenario_df['SCENARIO_ID'] == 1]
+    base_df = LocalBackend(data['commence_actual'], scenario_df).calibration(
+        ACTUAL_NAME, f'{SCENARIO_NAME} (init)', ROUNDS['March Round']['observed_study_periods']
+    ).base_df
+    rules = [json.loads(content) for content in data['rule']['RULE_CONTENT']]
+    periods = projection_periods(horizon=ROUNDS['March Round']['horizon'])
+    expected = legacy_project(base_df, rules, DEFAULT_INCREASE, periods)
+    actual = project(base_df, rules, DEFAULT_INCREASE, periods)
+    engine = RuleEngine(base_df)
+    return {
+        'rules_vs_migrated': bool(np.array_equal(
+            engine.resolve(rules, DEFAULT_INCREASE, periods),
+            engine.resolve(migrated_rules(data), DEFAULT_INCREASE, periods),
+            equal_nan=True
+        )),
+        'project_vs_legacy': bool(
+            len(expected) == len(actual)
+            and np.array_equal(expected['COURSE_ENROLMENT_COUNT'].to_numpy(), actual['COURSE_ENROLMENT_COUNT'].to_numpy())
+            and np.allclose(expected['INCREASE_BY'].to_numpy(dtype=float), actual['INCREASE_BY'].to_numpy(dtype=float))
+        ),
+    }
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run')
+    parser.add_argument('--scale', choices=list(SCALES), default='small')
+    for name in SCALES['small']:
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=None, help=f'override {name} of the scale')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--legacy', action='store_true', help='time the legacy merge projection and check parity')
+    parser.add_argument('--output', default=None, help='JSON file, printed when omitted')
+    args = parser.parse_args(argv)
+
+    scale = {name: getattr(args, name) or value for name, value in SCALES[args.scale].items()}
+    start = time.perf_counter()
+    data = generate(
+        scale['courses'], scale['study_periods'], scale['fee_groups'], scale['versions'], scale['rules'], args.seed
+    )
+    generate_seconds = time.perf_counter() - start
+
+    report = {
+        'commit': _commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'scale': {'name': args.scale, **scale, 'seed': args.seed},
+        'rows': {table: len(df) for table, df in data.items()},
+        'generate_seconds': round(generate_seconds, 3),
+        'memory': memory(data),
+        'results': {name: timed(fn, args.repeat) for name, fn in cases(data, args.legacy).items()},
+    }
+    if args.legacy:
+        report['parity'] = parity(data)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
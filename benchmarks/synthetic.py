@@ -0,0 +1,158 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from models.dashboard_cube import SCENARIO_TYPES
+from models.estimate import BASE_PERIOD
+
+SCALES = {
+    'small': dict(courses=200, study_periods=3, fee_groups=3, versions=3, rules=10),
+    'medium': dict(courses=1000, study_periods=4, fee_groups=4, versions=5, rules=25),
+    'large': dict(courses=4000, study_periods=6, fee_groups=6, versions=8, rules=50),
+}
+
+FACULTIES = [
+    'Faculty of Arts',
+    'Faculty of Science and Engineering',
+    'Macquarie Business School',
+    'Faculty of Medicine, Health and Human Sciences',
+]
+COURSE_LEVELS = ['Undergraduate', 'Postgraduate', 'Higher Degree Research']
+PERIODS = [str(int(BASE_PERIOD) + i) for i in range(0, 5)]
+ACTUAL_NAME = f'{BASE_PERIOD}.03'
+SCENARIO_NAME = 'Synthetic Plan'
+
+
+def _labels(prefix: str, n: int) -> list:
+    return [f'{prefix} {i + 1}' for i in range(n)]
+
+
+def cells(courses: int, study_periods: int, fee_groups: int, rng) -> pd.DataFrame:
+    """ every course in every study period and fee group, one level and faculty per course """
+    course = np.array([f'C{i:05d}' for i in range(courses)], dtype=object)
+    faculty = np.array(FACULTIES, dtype=object)[rng.integers(0, len(FACULTIES), courses)]
+    level = np.array(COURSE_LEVELS, dtype=object)[rng.integers(0, len(COURSE_LEVELS), courses)]
+    study_period = np.array(_labels('Session', study_periods), dtype=object)
+    fee_group = np.array(_labels('Fee Group', fee_groups), dtype=object)
+    n = courses * study_periods * fee_groups
+    c = np.repeat(np.arange(courses), study_periods * fee_groups)
+    return pd.DataFrame({
+        'COURSE': course[c],
+        'COMMENCING_STUDY_PERIOD': np.tile(np.repeat(study_period, fee_groups), courses),
+        'OWNING_FACULTY': faculty[c],
+        'COURSE_LEVEL_NAME': level[c],
+        'FEE_LIABILITY_GROUP': np.tile(fee_group, courses * study_periods),
+        'COURSE_ENROLMENT_COUNT': rng.integers(0, 120, n),
+    })
+
+
+def rules(cells_df: pd.DataFrame, n: int, rng) -> pd.DataFrame:
+    """
+    Rules in the stored format, every list spelled out. Every other rule
+    covers all the courses, as the rules saved from Rule Settings do.
+    """
+    courses = sorted(cells_df['COURSE'].unique())
+    dimensions = {
+        'commencing_study_periods': sorted(cells_df['COMMENCING_STUDY_PERIOD'].unique()),
+        'owning_faculties': sorted(cells_df['OWNING_FACULTY'].unique()),
+        'course_level_names': sorted(cells_df['COURSE_LEVEL_NAME'].unique()),
+        'fee_liability_groups': sorted(cells_df['FEE_LIABILITY_GROUP'].unique()),
+    }
+    rows = []
+    for i in range(n):
+        if i % 2 == 0:
+            rule_courses = courses
+        else:
+            size = int(rng.integers(1, max(2, len(courses) // 10)))
+            rule_courses = sorted(rng.choice(courses, size, replace=False).tolist())
+        content = {
+            'courses': rule_courses,
+            'periods': sorted(rng.choice(PERIODS[1:], int(rng.integers(1, len(PERIODS))), replace=False).tolist()),
+            'increase_by': round(float(rng.uniform(-0.05, 0.1)), 3),
+        }
+        for key, values in dimensions.items():
+            # one dimension narrowed, the others left at all values
+            content[key] = values if i % len(dimensions) != list(dimensions).index(key) else values[:1]
+        rows.append({
+            'ID': i + 1,
+            'RULE_NAME': f'Rule {i + 1}',
+            'DESCRIPTION': f'Synthetic rule {i + 1}',
+            'RULE_CONTENT': json.dumps(content),
+            'RULE_OWNER': 'G1_ADMIN',
+        })
+    return pd.DataFrame(rows)
+
+
+def generate(courses: int, study_periods: int, fee_groups: int, versions: int, rules_count: int,
+             seed: int = 0) -> dict:
+    """ Synthetic tables keyed by table name, with the upper case column names of to_pandas() """
+    rng = np.random.default_rng(seed)
+    cells_df = cells(courses, study_periods, fee_groups, rng)
+    n = len(cells_df)
+
+    scenario = pd.DataFrame({
+        'ID': np.arange(1, versions + 1),
+        'SCENARIO_NAME': SCENARIO_NAME,
+        'VERSION_NAME': ['init', *_labels('version', versions - 1)],
+        'IS_FINAL': 'N',
+        'PARENT_SCENARIO_ID': None,
+    })
+    # every version holds all its cells over all the periods
+    growth = np.cumprod(1 + rng.uniform(0, 0.05, (versions, len(PERIODS))), axis=1)
+    counts = np.ceil(cells_df['COURSE_ENROLMENT_COUNT'].to_numpy()[None, None, :] * growth[:, :, None])
+    scenario_data = pd.DataFrame({
+        'SCENARIO_ID': np.repeat(scenario['ID'].to_numpy(), len(PERIODS) * n),
+        'PERIOD': np.tile(np.repeat(np.array(PERIODS, dtype=object), n), versions),
+        **{c: np.tile(cells_df[c].to_numpy(), versions * len(PERIODS)) for c in cells_df.columns[:-1]},
+        'COURSE_ENROLMENT_COUNT': counts.ravel(),
+        'IS_DELETED': 'N',
+    })
+    scenario_data.insert(0, 'ID', np.arange(1, len(scenario_data) + 1))
+
+    observed = cells_df['COMMENCING_STUDY_PERIOD'] == 'Session 1'
+    commence_actual = cells_df[observed].assign(
+        ACTUAL_NAME=ACTUAL_NAME,
+        PERIOD=BASE_PERIOD,
+        COURSE_ENROLMENT_COUNT=np.ceil(cells_df.loc[observed, 'COURSE_ENROLMENT_COUNT'] * rng.uniform(0.8, 1.2, observed.sum())),
+    )
+
+    # dashboard source, one row per scenario type, period and cell
+    source_periods = [str(int(BASE_PERIOD) - 1), *PERIODS]
+    source = pd.DataFrame({
+        'SCENARIO_TYPE': np.repeat(np.array(SCENARIO_TYPES, dtype=object), len(source_periods) * n),
+        'PERIOD_NAME': np.tile(np.repeat(np.array(source_periods, dtype=object), n), len(SCENARIO_TYPES)),
+        'COURSE_NAME': np.tile(cells_df['COURSE'].to_numpy(), len(SCENARIO_TYPES) * len(source_periods)),
+        **{
+            c: np.tile(cells_df[c].to_numpy(), len(SCENARIO_TYPES) * len(source_periods))
+            for c in ['OWNING_FACULTY', 'COMMENCING_STUDY_PERIOD', 'COURSE_LEVEL_NAME', 'FEE_LIABILITY_GROUP']
+        },
+        'COURSE_ENROLMENT_COUNT': rng.integers(0, 120, len(SCENARIO_TYPES) * len(source_periods) * n),
+    })
+
+    faculty_id = {f: i + 1 for i, f in enumerate(FACULTIES)}
+    course_faculty = cells_df.drop_duplicates('COURSE')
+    return {
+        'scenario': scenario,
+        'scenario_data': scenario_data,
+        'commence_actual': commence_actual,
+        'rule': rules(cells_df, rules_count, rng),
+        'rule_annual_increase': pd.DataFrame({'ID': [1], 'DEFAULT_ANNUAL_INCREASE': [0.03]}),
+        'draft_lp_ce_estimates_2024': source,
+        'ref_course': pd.DataFrame({
+            'ID': np.arange(1, len(course_faculty) + 1),
+            'COURSE_NAME': course_faculty['COURSE'].to_numpy(),
+            'OWNING_FACULTY_ID': course_faculty['OWNING_FACULTY'].map(faculty_id).to_numpy(),
+        }),
+        'ref_owning_faculty': pd.DataFrame({'ID': list(faculty_id.values()), 'FACULTY_NAME': list(faculty_id)}),
+        'ref_period': pd.DataFrame({'ID': range(1, len(source_periods) + 1), 'PERIOD_NAME': source_periods}),
+        'ref_course_level': pd.DataFrame({'ID': range(1, len(COURSE_LEVELS) + 1), 'COURSE_LEVEL_NAME': COURSE_LEVELS}),
+        'ref_fee_liability_group': pd.DataFrame({
+            'ID': range(1, fee_groups + 1),
+            'FEE_LIABILITY_GROUP': _labels('Fee Group', fee_groups),
+        }),
+        'ref_commencing_study_period': pd.DataFrame({
+            'ID': range(1, study_periods + 1),
+            'COMMENCING_STUDY_PERIOD': _labels('Session', study_periods),
+        }),
+    }
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+
+class BitmapIndex:
+    """
+    In-memory filter over a frame for sidebar multiselects.
+
+    Every dimension is stored as categorical codes with a packed bitmap per
+    value. A selection ORs the bitmaps of its values, the dimensions are
+    combined with a bitwise AND, and only the final slice is materialized.
+    """
+
+    def __init__(self, df: pd.DataFrame, dimensions: list):
+        self.df = df.reset_index(drop=True)
+        self.size = len(self.df)
+        self.values = {}
+        self.bitmaps = {}
+        for dimension in dimensions:
+            codes, uniques = pd.factorize(self.df[dimension], sort=True)
+            self.values[dimension] = pd.Index(uniques)
+            self.bitmaps[dimension] = self._bitmaps(codes, len(uniques))
+
+    def _bitmaps(self, codes: np.ndarray, cardinality: int) -> np.ndarray:
+        # one packed row of bits per value, built from the rows grouped by code
+        bitmaps = np.zeros((cardinality, (self.size + 7) // 8), dtype=np.uint8)
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(cardinality + 1))
+        row = np.zeros(self.size, dtype=bool)
+        for code in range(cardinality):
+            rows = order[bounds[code]:bounds[code + 1]]
+            row[rows] = True
+            bitmaps[code] = np.packbits(row)
+            row[rows] = False
+        return bitmaps
+
+    def options(self, dimension: str) -> list:
+        return self.values[dimension].tolist()
+
+    def bits(self, selections: dict) -> np.ndarray:
+        """ packed bits of the rows matching every non-empty selection """
+        bits = None
+        for dimension, selected in selections.items():
+            if not selected:
+                continue
+            codes = self.values[dimension].get_indexer(list(selected))
+            codes = codes[codes >= 0]
+            dimension_bits = (
+                np.bitwise_or.reduce(self.bitmaps[dimension][codes], axis=0)
+                if len(codes) else np.zeros(self.bitmaps[dimension].shape[1], dtype=np.uint8)
+            )
+            bits = dimension_bits if bits is None else bits & dimension_bits
+        return bits
+
+    def mask(self, selections: dict) -> np.ndarray:
+        bits = self.bits(selections)
+        if bits is None:
+            return np.ones(self.size, dtype=bool)
+        return np.unpackbits(bits, count=self.size).astype(bool)
+
+    def filter(self, selections: dict) -> pd.DataFrame:
+        return self.df[self.mask(selections)]
+
+    def aggregate(self, selections: dict, by: list, measure: str) -> pd.DataFrame:
+        return self.filter(selections).groupby(by)[measure].sum().reset_index()
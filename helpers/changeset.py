@@ -0,0 +1,54 @@
+import pandas as pd
+
+OP_COLUMN = 'OP'
+INSERT = 'I'
+UPDATE = 'U'
+DELETE = 'D'
+
+
+def _same(before: pd.DataFrame, after: pd.DataFrame) -> pd.Series:
+    # null on both sides counts as unchanged
+    return ((before == after) | (before.isna() & after.isna())).all(axis=1)
+
+
+def diff(snapshot: pd.DataFrame, edited: pd.DataFrame, key: str = 'ID', columns: list = None) -> pd.DataFrame:
+    """
+    Rows of an edited frame that differ from the snapshot it was loaded from,
+    with an OP column: I for rows added in the editor (no key), U for rows
+    whose columns changed and D for snapshot rows removed from the editor.
+    Deleted rows carry their snapshot values.
+    """
+    columns = columns or [c for c in snapshot.columns if c != key]
+    inserted = edited[edited[key].isna()]
+    kept = edited[edited[key].notna() & edited[key].isin(snapshot[key])]
+    deleted = snapshot[~snapshot[key].isin(kept[key])]
+
+    after = kept.set_index(key)[columns]
+    before = snapshot.set_index(key)[columns].loc[after.index]
+    updated = after[~_same(before, after)].reset_index()
+
+    return pd.concat([
+        deleted[[key, *columns]].assign(**{OP_COLUMN: DELETE}),
+        updated[[key, *columns]].assign(**{OP_COLUMN: UPDATE}),
+        inserted[[key, *columns]].assign(**{OP_COLUMN: INSERT}),
+    ], ignore_index=True)
+
+
+def moved(snapshot: pd.DataFrame, changes: pd.DataFrame, keys: list, key: str = 'ID') -> pd.DataFrame:
+    """
+    Rewrite the updates that change any of the natural keys as a delete of the
+    snapshot row followed by an insert, for targets merged on those keys.
+    """
+    updates = changes[OP_COLUMN] == UPDATE
+    before = snapshot.set_index(key).loc[changes.loc[updates, key], keys]
+    after = changes.loc[updates].set_index(key)[keys]
+    moving = changes.loc[updates, key][~_same(before, after).values]
+    if moving.empty:
+        return changes
+    is_moving = changes[key].isin(moving) & updates
+    removed = snapshot[snapshot[key].isin(moving)][changes.columns.drop(OP_COLUMN)].assign(**{OP_COLUMN: DELETE})
+    return pd.concat([
+        removed,
+        changes[~is_moving],
+        changes[is_moving].assign(**{OP_COLUMN: INSERT}),
+    ], ignore_index=True)
@@ -0,0 +1,25 @@
+"""
+Snowflake connection of the command line tools: the [connections.snowflake]
+table of .streamlit/secrets.toml, as the README sets it up for the app.
+"""
+import os
+
+try:
+    import tomllib
+except ModuleNotFoundError:
+    # before Python 3.11
+    import tomli as tomllib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRETS_FILE = os.path.join(ROOT, '.streamlit', 'secrets.toml')
+
+
+def connection_config(path: str = SECRETS_FILE) -> dict:
+    with open(path, 'rb') as f:
+        return tomllib.load(f)['connections']['snowflake']
+
+
+def create_session(config: dict = None):
+    from snowflake.snowpark import Session
+
+    return Session.builder.configs(config or connection_config()).create()
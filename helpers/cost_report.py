@@ -0,0 +1,134 @@
+"""
+Warehouse cost of the app per page and operation, from the QUERY_TAG every
+query of the app carries (see helpers.utils.query_tag):
+
+    python -m helpers.cost_report [--days 7] [--by PAGE OPERATION] [--fixture query_history.csv]
+
+With --fixture the query history is read from a CSV export instead of
+Snowflake, so the report runs offline.
+"""
+import argparse
+import json
+import os
+
+import pandas as pd
+
+from helpers import streaming
+
+QUERY_TAG_APP = 'hack-g1'
+TAG_COLUMNS = ['PAGE', 'OPERATION', 'SCENARIO_ID', 'JOB_ID']
+HISTORY_COLUMNS = [
+    'QUERY_ID', 'QUERY_TAG', 'START_TIME', 'EXECUTION_STATUS', 'WAREHOUSE_NAME',
+    'TOTAL_ELAPSED_TIME', 'BYTES_SCANNED', 'ROWS_PRODUCED',
+]
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE = os.path.join(ROOT, 'benchmarks', 'fixtures', 'query_history.csv')
+
+
+def query_tag_text(tag: dict) -> str:
+    """ the QUERY_TAG of the app for the given attributes """
+    return json.dumps({'app': QUERY_TAG_APP, **tag}, default=str)
+
+
+def history_sql(source: str = 'account_usage') -> str:
+    """
+    Query history of the app. account_usage keeps a year of history but lags
+    by up to 45 minutes; information_schema is current but only sees 7 days
+    and the queries the role can monitor.
+    """
+    columns = ', '.join(HISTORY_COLUMNS)
+    if source == 'account_usage':
+        return f"""select {columns}
+            from snowflake.account_usage.query_history
+            where start_time >= dateadd(day, -?, current_timestamp())
+            and query_tag like ?"""
+    return f"""select {columns}
+        from table(information_schema.query_history(
+            end_time_range_start => dateadd(day, -?, current_timestamp()),
+            result_limit => 10000
+        ))
+        where query_tag like ?"""
+
+
+def load_history(session, days: int = 7, source: str = 'account_usage'):
+    """ the query history in pandas chunks, a year of it does not fit in memory at once """
+    return streaming.chunks(session.sql(
+        # the app is the first key of every tag
+        history_sql(source), params=[int(days), query_tag_text({})[:-1] + '%']
+    ))
+
+
+def load_fixture(path: str = FIXTURE) -> pd.DataFrame:
+    """ query history exported as CSV, the columns as Snowflake returns them """
+    return pd.read_csv(path, dtype={'QUERY_TAG': str, 'QUERY_ID': str})
+
+
+def parse_tags(history_df: pd.DataFrame) -> pd.DataFrame:
+    """ the queries of the app with their tag spread over TAG_COLUMNS """
+    def parse(text):
+        try:
+            tag = json.loads(text)
+        except (TypeError, ValueError):
+            return None
+        return tag if isinstance(tag, dict) and tag.get('app') == QUERY_TAG_APP else None
+
+    tags = history_df['QUERY_TAG'].map(parse)
+    df = history_df[tags.notna()].copy()
+    tags = tags[tags.notna()]
+    for column in TAG_COLUMNS:
+        df[column] = pd.Series([tag.get(column.lower()) for tag in tags], index=df.index, dtype=object)
+    return df
+
+
+def report(history, by: list = ('PAGE', 'OPERATION')) -> pd.DataFrame:
+    """
+    queries, elapsed time and bytes scanned per tag, the most expensive
+    first; history is the parsed history or an iterable of parsed chunks
+    """
+    by = list(by)
+
+    def prepare(df: pd.DataFrame) -> pd.DataFrame:
+        return df.assign(
+            **{column: df[column].fillna('(none)') for column in by},
+            FAILED=(df['EXECUTION_STATUS'] != 'SUCCESS').astype('int64'),
+        )
+
+    sums = streaming.aggregate(
+        [history] if isinstance(history, pd.DataFrame) else history,
+        by, ['FAILED', 'TOTAL_ELAPSED_TIME', 'BYTES_SCANNED'], prepare
+    ).set_index(by)
+    result = pd.DataFrame({
+        'QUERIES': sums['ROWS'],
+        'FAILED': sums['FAILED'],
+        'ELAPSED_S': sums['TOTAL_ELAPSED_TIME'] / 1000,
+        'MEAN_ELAPSED_S': sums['TOTAL_ELAPSED_TIME'] / sums['ROWS'] / 1000,
+        'BYTES_SCANNED': sums['BYTES_SCANNED'],
+    })
+    total = result['ELAPSED_S'].sum()
+    result['ELAPSED_SHARE'] = result['ELAPSED_S'] / total if total else 0.0
+    return result.sort_values('ELAPSED_S', ascending=False).round(3).reset_index()
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog='python -m helpers.cost_report')
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--by', nargs='+', choices=TAG_COLUMNS, default=['PAGE', 'OPERATION'])
+    parser.add_argument('--source', choices=['account_usage', 'information_schema'], default='account_usage')
+    parser.add_argument('--fixture', nargs='?', const=FIXTURE, default=None,
+                        help='read the query history from a CSV export, the bundled one when no path is given')
+    args = parser.parse_args(argv)
+
+    if args.fixture:
+        history = [load_fixture(args.fixture)]
+    else:
+        from helpers.connection import create_session
+
+        session = create_session()
+        history = load_history(session, args.days, args.source)
+
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(report(map(parse_tags, history), args.by).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+import streamlit as st
+
+try:
+    from snowflake.snowpark.query_history import QueryListener
+except ImportError:
+    # query listeners are not public API, a Snowpark without them records no queries
+    QueryListener = object
+
+INSTRUMENTATION_ROLES = ('ACCOUNTADMIN', 'G1_ADMIN')
+# reruns kept per viewer
+TRACE_HISTORY = 20
+SQL_PREVIEW = 300
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_local = threading.local()
+_recorders = {}
+_recorders_lock = threading.Lock()
+
+
+def sql_hash(sql: str) -> str:
+    # whitespace does not change the statement
+    return hashlib.sha1(' '.join((sql or '').split()).encode()).hexdigest()[:12]
+
+
+def call_site() -> str:
+    """ innermost frame of the app that led to the query """
+    for frame in reversed(traceback.extract_stack()[:-1]):
+        path = os.path.abspath(frame.filename)
+        if path.startswith(ROOT) and path != os.path.abspath(__file__):
+            return f'{os.path.relpath(path, ROOT)}:{frame.lineno} {frame.name}'
+    return None
+
+
+class Trace:
+    """ queries and sections of one rerun of a page """
+
+    def __init__(self, page: str):
+        self.id = uuid.uuid4().hex[:8]
+        self.page = page
+        self.started_at = time.time()
+        self.queries = []
+        self.sections = []
+
+    def offset(self) -> float:
+        return round(time.time() - self.started_at, 4)
+
+    def records(self) -> list:
+        common = {'trace': self.id, 'page': self.page, 'started_at': self.started_at}
+        return [
+            *({**common, 'kind': 'query', **q} for q in self.queries),
+            *({**common, 'kind': 'section', **s} for s in self.sections),
+        ]
+
+
+class QueryRecorder(QueryListener):
+    """ Snowpark query listener appending every query to the trace of the thread that issued it """
+
+    include_describe = False
+    include_thread_id = False
+    include_error = True
+
+    def _notify(self, query_record, **kwargs):
+        trace = getattr(_local, 'trace', None)
+        if trace is None or getattr(_local, 'paused', False):
+            return
+        sections = getattr(_local, 'sections', [])
+        trace.queries.append({
+            'query_id': query_record.query_id,
+            'sql_hash': sql_hash(query_record.sql_text),
+            'sql': (query_record.sql_text or '')[:SQL_PREVIEW],
+            'call_site': call_site(),
+            'section': sections[-1] if sections else None,
+            'at': trace.offset(),
+            'error': str(kwargs['exception']) if kwargs.get('exception') else None,
+        })
+
+
+def attach(session) -> QueryRecorder:
+    """
+    The query listener of the session, None when this Snowpark version has no
+    add_query_listener on its connection, a private API. The queries are then
+    only grouped by their QUERY_TAG in query_history, see helpers/cost_report.py.
+    """
+    # one listener per Snowpark session, which every rerun of the viewer shares
+    with _recorders_lock:
+        if id(session) in _recorders:
+            return _recorders[id(session)]
+        add_query_listener = getattr(getattr(session, '_conn', None), 'add_query_listener', None)
+        recorder = QueryRecorder() if add_query_listener is not None else None
+        if recorder is not None:
+            add_query_listener(recorder)
+        _recorders[id(session)] = recorder
+    return recorder
+
+
+@contextmanager
+def section(name: str):
+    """ time a named section of code; its queries are tagged with the name """
+    trace = getattr(_local, 'trace', None)
+    if not hasattr(_local, 'sections'):
+        _local.sections = []
+    _local.sections.append(name)
+    start = time.perf_counter()
+    at = trace.offset() if trace is not None else None
+    try:
+        yield
+    finally:
+        _local.sections.pop()
+        if trace is not None:
+            trace.sections.append({
+                'section': name,
+                'at': at,
+                'seconds': round(time.perf_counter() - start, 4),
+                'call_site': call_site(),
+            })
+
+
+@contextmanager
+def paused():
+    _local.paused = True
+    try:
+        yield
+    finally:
+        _local.paused = False
+
+
+class Instrumentation:
+    """
+    Records every Snowpark query of a rerun with its call site and SQL hash,
+    and the timings of the named sections. Warehouse elapsed time, rows and
+    bytes are looked up by query id on request.
+    """
+
+    @staticmethod
+    def begin(session, page: str):
+        """ start the trace of this rerun; call at the top of the page """
+        attach(session)
+        trace = Trace(os.path.basename(page))
+        _local.trace = trace
+        _local.sections = []
+        if 'instrumentation_traces' not in st.session_state:
+            st.session_state['instrumentation_traces'] = deque(maxlen=TRACE_HISTORY)
+        st.session_state.instrumentation_traces.append(trace)
+        return trace
+
+    @staticmethod
+    def traces() -> list:
+        return list(st.session_state.get('instrumentation_traces', []))
+
+    @staticmethod
+    def warehouse_stats(session, query_ids: list) -> pd.DataFrame:
+        """ elapsed time, rows and bytes of the queries from the query history of the session """
+        if not query_ids:
+            return pd.DataFrame(columns=['QUERY_ID', 'ELAPSED_MS', 'ROWS', 'BYTES_SCANNED', 'BYTES_TO_CLIENT'])
+        placeholders = ', '.join('?' for _ in query_ids)
+        with paused():
+            return session.sql(
+                f"""select query_id,
+                    total_elapsed_time as elapsed_ms,
+                    rows_produced as rows,
+                    bytes_scanned,
+                    bytes_written_to_result as bytes_to_client
+                from table(information_schema.query_history_by_session(result_limit => 10000))
+                where query_id in ({placeholders})""",
+                params=list(query_ids)
+            ).to_pandas()
+
+    @staticmethod
+    def export(traces: list) -> str:
+        """ traces as JSON lines, one query or section per line """
+        return '\n'.join(json.dumps(record, default=str) for trace in traces for record in trace.records())
+
+    @staticmethod
+    def show(session):
+        """ admin panel of the traces of this viewer, for the sidebar """
+        traces = [t for t in Instrumentation.traces() if t.queries or t.sections]
+        with st.expander('Query Instrumentation'):
+            if _recorders.get(id(session)) is None:
+                st.caption('This Snowpark version cannot record the queries, see their QUERY_TAG in query_history')
+            if not traces:
+                st.caption('No queries recorded yet')
+                return
+            labels = {
+                f"{time.strftime('%H:%M:%S', time.localtime(t.started_at))} {t.page} ({len(t.queries)} queries)": t
+                for t in reversed(traces)
+            }
+            trace = labels[st.selectbox('Rerun', list(labels), key='instrumentation_trace_select')]
+            queries_df = pd.DataFrame(trace.queries, columns=['query_id', 'sql_hash', 'sql', 'call_site', 'section', 'at', 'error'])
+            if st.checkbox('Warehouse time, rows and bytes', key='instrumentation_stats_checkbox'):
+                stats_df = Instrumentation.warehouse_stats(session, queries_df['query_id'].dropna().tolist())
+                stats_df.columns = stats_df.columns.str.lower()
+                queries_df = queries_df.merge(stats_df, on='query_id', how='left')
+                st.dataframe(
+                    queries_df.groupby('call_site', dropna=False).agg(
+                        queries=('query_id', 'count'),
+                        elapsed_ms=('elapsed_ms', 'sum'),
+                        rows=('rows', 'sum'),
+                        bytes_to_client=('bytes_to_client', 'sum'),
+                    ).sort_values('elapsed_ms', ascending=False)
+                )
+            else:
+                st.dataframe(queries_df.groupby('call_site', dropna=False).size().rename('queries').sort_values(ascending=False))
+            st.dataframe(queries_df)
+            if trace.sections:
+                st.dataframe(pd.DataFrame(trace.sections))
+            st.download_button(
+                'Export JSON Lines',
+                Instrumentation.export(traces),
+                file_name='instrumentation.jsonl',
+                mime='application/jsonl',
+                key='instrumentation_export_button'
+            )
@@ -0,0 +1,216 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import streamlit as st
+
+JOB_WORKERS = 4
+# finished jobs kept for the sessions that have not picked them up yet
+JOB_HISTORY = 100
+# seconds between polls of a warehouse query
+JOB_POLL = 0.5
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """
+    Unit of work run off the script thread. The work function reports its
+    stages through stage(), which records timings and is where a cancel
+    request takes effect; wait() does the same for Snowpark async jobs.
+    """
+
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.status = QUEUED
+        self.plan = []
+        self.stage_name = None
+        self.timings = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self._cancel = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    @property
+    def progress(self) -> float:
+        if self.status == DONE:
+            return 1.0
+        return len(self.timings) / len(self.plan) if self.plan else 0.0
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def stages(self, names: list):
+        """ planned stages, for progress """
+        self.plan = list(names)
+
+    @contextmanager
+    def stage(self, name: str):
+        self.check()
+        self.stage_name = name
+        start = time.perf_counter()
+        yield
+        self.timings[name] = time.perf_counter() - start
+
+    def check(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def wait(self, async_job):
+        """ block until a Snowpark async job is done, cancelling the query on request """
+        while not async_job.is_done():
+            if self._cancel.is_set():
+                async_job.cancel()
+                raise JobCancelled()
+            time.sleep(JOB_POLL)
+        return async_job.result()
+
+    def cancel(self):
+        self._cancel.set()
+        if self.future is not None and self.future.cancel():
+            self.status = CANCELLED
+            self.finished_at = time.time()
+
+
+class JobRunner:
+    """ Thread pool shared by every session of the app process """
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, name: str, fn, *args, background: bool = True, **kwargs) -> Job:
+        """ run fn in the pool, or in the calling thread and finished on return when not background """
+        job = Job(name)
+        with self.lock:
+            self._prune()
+            self.jobs[job.id] = job
+        if background:
+            job.future = self.executor.submit(self._run, job, fn, args, kwargs)
+        else:
+            self._run(job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id: str) -> Job:
+        return self.jobs.get(job_id)
+
+    def _run(self, job: Job, fn, args, kwargs):
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            job.check()
+            job.result = fn(*args, job=job, **kwargs)
+            job.status = DONE
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.error = e
+            job.status = FAILED
+        finally:
+            job.stage_name = None
+            job.finished_at = time.time()
+
+    def _prune(self):
+        finished = sorted((j for j in self.jobs.values() if j.finished), key=lambda j: j.finished_at)
+        for job in finished[:max(0, len(finished) - JOB_HISTORY)]:
+            del self.jobs[job.id]
+
+
+@st.cache_resource(show_spinner=False)
+def job_runner() -> JobRunner:
+    return JobRunner()
+
+
+class Jobs:
+    """
+    Jobs of the current session. The ids live in session state, so a rerun
+    or a widget interaction never loses track of the work; results are picked
+    up on the next rerun.
+    """
+
+    @staticmethod
+    def _ids() -> list:
+        if 'jobs' not in st.session_state:
+            st.session_state['jobs'] = []
+        return st.session_state.jobs
+
+    @staticmethod
+    def submit(name: str, fn, *args, background: bool = True, **kwargs) -> Job:
+        """ run fn(*args, job=job, **kwargs) in the background, or before returning when not background """
+        job = job_runner().submit(name, fn, *args, background=background, **kwargs)
+        Jobs._ids().append(job.id)
+        return job
+
+    @staticmethod
+    def mine() -> list:
+        runner = job_runner()
+        return [job for job in map(runner.get, Jobs._ids()) if job is not None]
+
+    @staticmethod
+    def running() -> bool:
+        return any(not job.finished for job in Jobs.mine())
+
+    @staticmethod
+    def collect() -> list:
+        """ jobs finished since the last call, each returned once """
+        if 'jobs_collected' not in st.session_state:
+            st.session_state['jobs_collected'] = set()
+        collected = st.session_state.jobs_collected
+        finished = [job for job in Jobs.mine() if job.finished and job.id not in collected]
+        collected.update(job.id for job in finished)
+        return finished
+
+    @staticmethod
+    def dismiss(job_id: str):
+        ids = Jobs._ids()
+        if job_id in ids:
+            ids.remove(job_id)
+
+    @staticmethod
+    def show():
+        """ progress, stage timings and cancel of the jobs of this session """
+        jobs = Jobs.mine()
+        if not jobs:
+            return
+        st.markdown('**Jobs**')
+        for job in jobs:
+            with st.container():
+                if job.status == DONE:
+                    st.success(f'**{job.name}** done in {job.elapsed:.1f}s')
+                elif job.status == FAILED:
+                    st.error(f'**{job.name}** failed: {job.error}')
+                elif job.status == CANCELLED:
+                    st.warning(f'**{job.name}** cancelled')
+                else:
+                    st.progress(job.progress, text=f'**{job.name}** {job.status} {job.stage_name or ""}')
+                if job.timings:
+                    st.caption(' · '.join(f'{stage} {seconds:.2f}s' for stage, seconds in job.timings.items()))
+                if job.finished:
+                    st.button('Dismiss', key=f'job_dismiss_{job.id}', on_click=Jobs.dismiss, args=(job.id,))
+                else:
+                    st.button('Cancel', key=f'job_cancel_{job.id}', on_click=job.cancel)
+        if Jobs.running():
+            st.button('Refresh', key='jobs_refresh')
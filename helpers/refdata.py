@@ -0,0 +1,143 @@
+import pandas as pd
+import streamlit as st
+
+from helpers import changeset
+from helpers.transaction import transaction
+from helpers.utils import Utils
+from models.scenario_store import ACTUAL_TABLE, DIMENSIONS, FACT_TABLE, lookup, on_stale_lookups
+
+REF_TABLES = [
+    'ref_course',
+    'ref_period',
+    'ref_owning_faculty',
+    'ref_course_level',
+    'ref_fee_liability_group',
+    'ref_commencing_study_period',
+]
+
+# reference data changes rarely and every edit goes through RefData.invalidate()
+REFDATA_TTL = 60 * 60
+CHANGES_TABLE = 'tmp_refdata_changes'
+
+# called by RefData.invalidate(), for the caches holding names of the reference tables
+_listeners = []
+
+
+def _encode(df: pd.DataFrame) -> pd.DataFrame:
+    # dictionary encode the text columns, ids stay numeric
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].astype('category')
+    return df
+
+
+@st.cache_data(ttl=REFDATA_TTL, show_spinner=False)
+def _load_table(_session, table: str) -> pd.DataFrame:
+    return _encode(_session.table(table).to_pandas())
+
+
+class RefData:
+    """
+    Reference tables cached in process, shared by every page and session.
+    Text columns are categorical; use decoded() where the values are edited.
+    """
+
+    @staticmethod
+    def table(table: str) -> pd.DataFrame:
+        if table not in REF_TABLES:
+            raise ValueError(f'Not a reference table: {table}')
+        return _load_table(Utils.get_session(), table)
+
+    @staticmethod
+    def decoded(table: str) -> pd.DataFrame:
+        df = RefData.table(table).copy()
+        for column in df.columns:
+            if isinstance(df[column].dtype, pd.CategoricalDtype):
+                df[column] = df[column].astype(object)
+        return df
+
+    @staticmethod
+    def course_faculty() -> pd.DataFrame:
+        course_df = RefData.table('ref_course')
+        owning_faculty_df = RefData.table('ref_owning_faculty')
+        return course_df.merge(
+            owning_faculty_df,
+            left_on='OWNING_FACULTY_ID',
+            right_on='ID'
+        )[['COURSE_NAME', 'FACULTY_NAME']]
+
+    @staticmethod
+    def lookups() -> dict:
+        """ scenario_data column -> id -> name, to decode the ids of the facts """
+        return {
+            column: lookup(RefData.table(table)['ID'], RefData.table(table)[name])
+            for column, (table, name, _) in DIMENSIONS.items()
+        }
+
+    @staticmethod
+    def apply(table: str, snapshot: pd.DataFrame, edited: pd.DataFrame) -> dict:
+        """
+        Merge the rows changed in the editor against the snapshot it was
+        loaded from into the reference table, in one MERGE keyed on ID in a
+        transaction. Returns the rows inserted, updated and deleted.
+        """
+        if table not in REF_TABLES:
+            raise ValueError(f'Not a reference table: {table}')
+        columns = [c for c in snapshot.columns if c != 'ID']
+        changes = changeset.diff(snapshot, edited, 'ID', columns)
+        counts = {
+            'inserted': int((changes[changeset.OP_COLUMN] == changeset.INSERT).sum()),
+            'updated': int((changes[changeset.OP_COLUMN] == changeset.UPDATE).sum()),
+            'deleted': int((changes[changeset.OP_COLUMN] == changeset.DELETE).sum()),
+        }
+        if changes.empty:
+            return counts
+
+        session = Utils.get_session()
+        session.write_pandas(
+            changes,
+            table_name=CHANGES_TABLE,
+            overwrite=True,
+            table_type='temp',
+            quote_identifiers=False,
+            auto_create_table=True
+        )
+        fact = {ref: column for ref, _, column in DIMENSIONS.values()}.get(table)
+
+        with transaction(session):
+            if fact and counts['deleted']:
+                # the facts keep the id, a deleted row would leave their cells without a name
+                in_use = session.sql(
+                    f"""select count(*) as n from {CHANGES_TABLE}
+                    where op = '{changeset.DELETE}'
+                        and (id in (select {fact} from {FACT_TABLE}) or id in (select {fact} from {ACTUAL_TABLE}))"""
+                ).collect()[0]['N']
+                if in_use:
+                    raise ValueError(f'{in_use} deleted rows of {table} are used by scenarios or actuals')
+            session.sql(
+                f"""merge into {table} as r
+                using {CHANGES_TABLE} as t
+                    on r.id = t.id
+                when matched and t.op = '{changeset.DELETE}' then delete
+                when matched then update set {', '.join(f'{c} = t.{c}' for c in columns)}
+                when not matched and t.op = '{changeset.INSERT}' then insert ({', '.join(columns)})
+                    values ({', '.join(f't.{c}' for c in columns)})"""
+            ).collect()
+        RefData.invalidate()
+        return counts
+
+    @staticmethod
+    def on_invalidate(listener):
+        """ call listener() whenever the reference data is invalidated """
+        if listener not in _listeners:
+            _listeners.append(listener)
+
+    @staticmethod
+    def invalidate():
+        _load_table.clear()
+        for listener in _listeners:
+            listener()
+
+
+# a read met a name added since the tables were cached, by a job or another session
+on_stale_lookups(RefData.invalidate)
@@ -0,0 +1,56 @@
+"""
+Chunked reads of Snowpark results.
+
+to_pandas() fetches the whole result as Arrow and converts it in one go, so
+the peak holds the result twice. These readers go through
+to_pandas_batches() instead, one Arrow record batch converted at a time. A
+path that reduces every chunk (sums, CSV text) holds one chunk at a time;
+a path that keeps the rows holds the converted chunks and one batch.
+
+Every reader takes a Snowpark frame or any iterable of pandas frames.
+"""
+import io
+
+import pandas as pd
+
+
+def chunks(source):
+    """ pandas chunks of a Snowpark frame, or the frames of an iterable as they are """
+    if hasattr(source, 'to_pandas_batches'):
+        return source.to_pandas_batches()
+    return iter(source)
+
+
+def read(source, transform=None, columns: list = None) -> pd.DataFrame:
+    """ the whole result, every chunk transformed before the next one is converted """
+    frames = [transform(chunk) if transform else chunk for chunk in chunks(source)]
+    if not frames:
+        return pd.DataFrame(columns=columns or [])
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+def aggregate(source, by: list, sums: list, transform=None) -> pd.DataFrame:
+    """
+    Sums of the columns and the number of rows (ROWS) per group, folded
+    chunk by chunk so that only one chunk and the groups are held.
+    """
+    total = None
+    for chunk in chunks(source):
+        chunk = transform(chunk) if transform else chunk
+        groups = chunk.groupby(by, dropna=False, observed=True)
+        partial = groups[sums].sum().assign(ROWS=groups.size())
+        total = partial if total is None else pd.concat([total, partial]).groupby(
+            level=list(range(len(by))), dropna=False
+        ).sum()
+    if total is None:
+        return pd.DataFrame(columns=[*by, *sums, 'ROWS'])
+    return total.reset_index()
+
+
+def to_csv(source, transform=None) -> bytes:
+    """ CSV of the result with one header, written chunk by chunk """
+    buffer = io.StringIO()
+    for i, chunk in enumerate(chunks(source)):
+        chunk = transform(chunk) if transform else chunk
+        chunk.to_csv(buffer, index=False, header=i == 0)
+    return buffer.getvalue().encode('utf-8')
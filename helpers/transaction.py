@@ -0,0 +1,34 @@
+"""
+Explicit transactions on a Snowpark session.
+
+A Snowflake transaction belongs to the session, not to the thread that
+opened it: a background job running on the session of the page would
+commit or roll back the page's statements with its own. Transactions go
+through transaction(), which runs those of a session one at a time.
+"""
+import threading
+import weakref
+from contextlib import contextmanager
+
+_locks = weakref.WeakKeyDictionary()
+_locks_lock = threading.Lock()
+
+
+def _lock(session) -> threading.RLock:
+    with _locks_lock:
+        if session not in _locks:
+            _locks[session] = threading.RLock()
+        return _locks[session]
+
+
+@contextmanager
+def transaction(session):
+    """ begin and commit around the block, rolled back when it raises """
+    with _lock(session):
+        session.sql('begin').collect()
+        try:
+            yield session
+        except Exception:
+            session.sql('rollback').collect()
+            raise
+        session.sql('commit').collect()
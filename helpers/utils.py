@@ -1,36 +1,206 @@
+import os
+import threading
+from contextlib import contextmanager
+
 import streamlit as st
 from snowflake.snowpark import Session
+from snowflake.snowpark.context import get_active_session
+
+from helpers.cost_report import query_tag_text
+from helpers.instrumentation import INSTRUMENTATION_ROLES, Instrumentation, paused
+
+_tags = threading.local()
+
+
+def _user_key():
+  # one session per viewer; local runs have a single user
+  user = getattr(st, 'experimental_user', None)
+  try:
+    return user.get('email') or user.get('user_name') or 'local'
+  except Exception:
+    return 'local'
+
+
+@st.cache_resource(show_spinner=False)
+def create_session(user_key: str) -> Session:
+  # Snowflake session
+  try:
+    session = get_active_session()
+  except Exception:
+    session = None
+  # Use local session
+  if session is not None:
+    pass
+  elif 'snowflake' in st.secrets:
+    session = Session.builder.configs(st.secrets.snowflake).create()
+  # Current connection method
+  elif 'connection' in dir(st):
+    session = st.connection("snowflake").session()
+  # 1.22
+  elif 'experimental_connection' in dir(st):
+    session = st.experimental_connection("snowpark").session()
+  else:
+    raise RuntimeError('Session not detected')
+
+  Utils.warm_up(session)
+  return session
+
+
+def _job_config():
+  # the connection a job opens its own session on, None where the app can only use the active session
+  try:
+    get_active_session()
+    return None
+  except Exception:
+    pass
+  try:
+    connections = st.secrets['connections'] if 'connections' in st.secrets else {}
+    if 'snowflake' in st.secrets:
+      return st.secrets.snowflake
+  except FileNotFoundError:
+    return None
+  return connections.get('snowflake') or connections.get('snowpark')
+
+
+def can_open_session() -> bool:
+  """
+  Whether a job gets a session of its own. A job on the session of the page
+  would share its transactions, and table writes commit them, so jobs run
+  in the background only when it does.
+  """
+  return _job_config() is not None
+
+
+def open_session():
+  """
+  A new session on the connection of the app, for work run off the script
+  thread; None where the app can only use the active session.
+  """
+  config = _job_config()
+  if config is None:
+    return None
+  session = Session.builder.configs(config).create()
+  Utils.warm_up(session)
+  return session
+
+
+def _set_query_tag(session: Session, tag: dict):
+  text = query_tag_text(tag) if tag else None
+  # the tag is a session parameter, only send it when it changes
+  if session.query_tag != text:
+    with paused():
+      session.query_tag = text
+
+
+@contextmanager
+def query_tag(session: Session, **attributes):
+  """
+  Tag the queries of the block with a JSON QUERY_TAG: page, operation,
+  scenario_id, job_id. A nested block adds to the tag of the enclosing one,
+  and the enclosing tag is restored on exit.
+  """
+  previous = getattr(_tags, 'tag', {})
+  tag = {**previous, **{k: v for k, v in attributes.items() if v is not None}}
+  _tags.tag = tag
+  _set_query_tag(session, tag)
+  try:
+    yield tag
+  finally:
+    _tags.tag = previous
+    _set_query_tag(session, previous)
+
+
+def tagged(fn, session: Session, **attributes):
+  """
+  fn(session, *args, job=job, **kwargs) run as a job under the tag of the
+  caller, with the attributes and the job_id added. The job gets a session
+  of its own, closed when it ends; where none can be opened it runs on the
+  given session, and is submitted with background=False (can_open_session()).
+  """
+  caller = dict(getattr(_tags, 'tag', {}))
+
+  def run(*args, job=None, **kwargs):
+    _tags.tag = caller
+    own = open_session()
+    job_session = own or session
+    try:
+      with query_tag(job_session, **attributes, job_id=job.id if job is not None else None):
+        return fn(job_session, *args, job=job, **kwargs)
+    finally:
+      if own is not None:
+        own.close()
+  return run
+
 
 class Utils:
   @staticmethod
-  def get_session():
-    def create_session():
-      # Snowflake session
+  def get_session() -> Session:
+    if 'session' not in st.session_state:
+      st.session_state['session'] = create_session(_user_key())
+    return st.session_state.session
+
+  @staticmethod
+  def begin_page(page: str):
+    """ start a rerun of a page: instrumentation trace and the page query tag """
+    session = Utils.get_session()
+    Instrumentation.begin(session, page)
+    page = os.path.splitext(os.path.basename(page))[0]
+    _tags.tag = {'page': page}
+    _set_query_tag(session, _tags.tag)
+
+  @staticmethod
+  def query_tag(operation: str, **attributes):
+    return query_tag(Utils.get_session(), operation=operation, **attributes)
+
+  @staticmethod
+  def flash(message: str):
+    """ success message shown by show_flash() on the next rerun, for a save followed by a rerun """
+    st.session_state['flash'] = message
+
+  @staticmethod
+  def show_flash():
+    if 'flash' in st.session_state:
+      st.success(st.session_state.pop('flash'))
+
+  @staticmethod
+  def warm_up(session: Session):
+    # resume the warehouse before the first page query needs it
+    warehouse = session.get_current_warehouse()
+    if warehouse:
       try:
-          return get_active_session()
-      except Exception as e:
-          None
-      # Use local session
-      if 'snowflake' in st.secrets:
-          return Session.builder.configs(st.secrets.snowflake).create()
-      # Current connection method
-      elif 'connection' in dir(st):
-          return st.connection("snowflake").session()
-      # 1.22
-      elif 'experimental_connection' in dir(st):
-          return st.experimental_connection("snowpark").session()
-      else:
-          raise 'Session not detected'
+        session.sql(f'alter warehouse {warehouse} resume if suspended').collect()
+      except Exception:
+        # the role may only have usage on the warehouse; auto resume still applies
+        None
+    context = st.secrets['context'] if 'context' in st.secrets else {}
+    if context.get('database'):
+      session.use_database(context['database'])
+    if context.get('schema'):
+      session.use_schema(context['schema'])
 
-    if 'session' not in st.session_state:
-        session = create_session()
-        st.session_state['session'] = session
-    else:
-        session = st.session_state.session
+  @staticmethod
+  def get_session_info() -> dict:
+    # role and user do not change for the lifetime of the session
+    if 'session_info' not in st.session_state:
+      row = Utils.get_session().sql(
+        'select current_role() as role, current_user() as user'
+      ).collect()[0]
+      st.session_state['session_info'] = {
+        'role': row['ROLE'].replace('"', ''),
+        'user': row['USER'].replace('"', ''),
+      }
+    return st.session_state.session_info
 
-    return session
+  @staticmethod
+  def get_session_role() -> str:
+    return Utils.get_session_info()['role']
 
   @staticmethod
-  def get_session_role():
-    session = Utils.get_session()
-    return session.get_current_role().replace('"', '')
+  def get_current_user() -> str:
+    return Utils.get_session_info()['user']
+
+  @staticmethod
+  def show_login_role():
+    st.warning(f"Login Role **{Utils.get_session_role()}**")
+    if Utils.get_session_role() in INSTRUMENTATION_ROLES:
+      Instrumentation.show(Utils.get_session())
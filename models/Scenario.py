@@ -1,5 +1,47 @@
+import json
+
+import pandas as pd
 from snowflake.snowpark import Row, Session
+from snowflake.snowpark.functions import col
+from helpers import changeset
+from helpers.refdata import RefData
+from helpers.transaction import transaction
 from helpers.utils import Utils
+from models import scenario_store
+from models.estimate import BASE_COLUMNS, FACT_DIMS, SCENARIO_DATA_COLUMNS, cell_predicate, changed_rules, recompute
+from models.rule_engine import CELL_DIMENSIONS
+from models.scenario_store import FACT_COLUMNS, FACT_TABLE, RESOLVED_VIEW
+
+# the cell of a version; an overlay row replaces the parent row of the same cell
+CELL_COLUMNS = SCENARIO_DATA_COLUMNS[:-1]
+CHANGES_TABLE = 'tmp_scenario_changes'
+RECOMPUTE_CELLS_TABLE = 'tmp_recompute_cells'
+
+
+def _write_changes(changes: pd.DataFrame):
+  Utils.get_session().write_pandas(
+    scenario_store.plain(changes),
+    table_name=CHANGES_TABLE,
+    overwrite=True,
+    table_type='temp',
+    quote_identifiers=False,
+    auto_create_table=True
+  )
+
+
+def stage_changes(snapshot: pd.DataFrame, edited: pd.DataFrame) -> pd.DataFrame:
+  """ Stage the cells changed in the editor into CHANGES_TABLE; returns the rows staged, with their OP """
+  keys = [c.upper() for c in CELL_COLUMNS]
+  columns = [c.upper() for c in SCENARIO_DATA_COLUMNS]
+  changes = changeset.diff(snapshot, edited, 'ID', columns)
+  changes = changeset.moved(snapshot, changes, keys)
+  # one row per cell, the last edit of a cell wins
+  changes = changes.drop_duplicates(keys, keep='last')[[changeset.OP_COLUMN, *columns]]
+  if not changes.empty:
+    _write_changes(changes)
+  return changes
+
+
 class Scenario:
 
   @staticmethod
@@ -18,6 +60,64 @@ class Scenario:
     row = session.sql("select * from scenario where SCENARIO_NAME||' - '||VERSION_NAME = ?", params=[scenario_text]).collect()[0].as_dict()
     return Scenario.find(row['ID'])
 
+  @staticmethod
+  def create_version(parent_id: int, version_name: str, notes: str, merge_changes: bool = False,
+                     recompute: pd.DataFrame = None):
+    """
+    New version overlaid on the parent, holding only the staged changes
+    when merge_changes is set. recompute, the staged changes, also brings
+    the later periods of the edited cells up to date. Written in one
+    transaction.
+    """
+    session = Utils.get_session()
+    parent = Scenario.find(parent_id)
+    if merge_changes and recompute is not None:
+      # the version resolves to its parent until the changes are merged
+      parent._stage_recomputed(recompute)
+    added = 0
+    with transaction(session):
+      session.sql(
+        'insert into scenario (scenario_name, version_name, notes, parent_scenario_id, generation_params) '
+        'values (?, ?, ?, ?, ?)',
+        params=[parent.scenario_name, version_name, notes, int(parent_id), parent.generation_params]
+      ).collect()
+      row = session.sql(
+        'select max(id) as id from scenario where parent_scenario_id = ? and version_name = ?',
+        params=[int(parent_id), version_name]
+      ).collect()[0]
+      if merge_changes:
+        added = Scenario._merge_changes(session, row['ID'])
+      Scenario._refresh_rollup(session, row['ID'])
+    if added:
+      RefData.invalidate()
+    return Scenario.find(row['ID'])
+
+  @staticmethod
+  def _merge_changes(session: Session, scenario_id: int) -> int:
+    """ number of names added to the reference tables, the caller invalidates RefData after commit when any """
+    added = 0
+    for statement in scenario_store.ensure_sql(CHANGES_TABLE):
+      added += session.sql(statement).collect()[0][0]
+    # deletes become tombstones so that a parent row of the cell stays hidden
+    session.sql(
+      f"""merge into {FACT_TABLE} as sd
+      using ({scenario_store.encoded_select(CHANGES_TABLE, 't.op')}) as t
+        on sd.scenario_id = ? and {' and '.join(f'equal_null(sd.{c}, t.{c})' for c in FACT_COLUMNS)}
+      when matched and t.op = '{changeset.DELETE}' then update set is_deleted = 'Y'
+      when matched then update set course_enrolment_count = t.course_enrolment_count, is_deleted = 'N'
+      when not matched then insert (scenario_id, {FACT_DIMS}, course_enrolment_count, is_deleted)
+        values (?, {', '.join(f't.{c}' for c in FACT_COLUMNS)}, t.course_enrolment_count,
+          iff(t.op = '{changeset.DELETE}', 'Y', 'N'))""",
+      params=[int(scenario_id), int(scenario_id)]
+    ).collect()
+    return added
+
+  @staticmethod
+  def _refresh_rollup(session: Session, scenario_id: int):
+    # the totals of the versions overlaid on this one change with it
+    for statement in scenario_store.rollup_sql('?'):
+      session.sql(statement, params=[int(scenario_id)]).collect()
+
   def __init__(self):
     self.id = None
     self.scenario_name = None
@@ -28,6 +128,8 @@ class Scenario:
     self.confirmed_by_sci = None
     self.confirmed_by_fmhhs = None
     self.notes = None
+    self.parent_scenario_id = None
+    self.generation_params = None
     self.created_by = None
     self.created_at = None
     self.updated_by = None
@@ -46,6 +148,191 @@ class Scenario:
     results = session.sql('select current_user').to_pandas().to_csv()
     return 'Test Fn text'
 
+  def data(self):
+    """ Snowpark frame of every cell of the version, resolved along its parent lineage """
+    session = Utils.get_session()
+    return session.table('scenario_data_resolved').filter(col('SCENARIO_ID') == int(self.id))
+
+  def frame(self) -> pd.DataFrame:
+    """ every cell of the version in pandas, read as ids and decoded into categoricals """
+    return scenario_store.read_frame(
+      Utils.get_session(),
+      f'select id, scenario_id, {FACT_DIMS}, course_enrolment_count from {RESOLVED_VIEW} where scenario_id = ?',
+      [int(self.id)],
+      RefData.lookups(),
+      columns=['ID', 'SCENARIO_ID', *BASE_COLUMNS]
+    )
+
+  def apply_changes(self, merge_changes: bool = True, recompute: pd.DataFrame = None, note: str = None,
+                    created_by: str = None):
+    """
+    Merge the staged changes into the overlay rows of this version in one
+    statement. Rows of the parent versions are never written, so the cost
+    follows the size of the edit; then rebuild the rollup of the version
+    and of the versions overlaid on it, unless merge_changes is unset.
+    recompute, the staged changes, also brings the later periods of the
+    edited cells up to date; the note goes to scenario_notes. Written in one
+    transaction.
+    """
+    session = Utils.get_session()
+    if merge_changes and recompute is not None:
+      self._stage_recomputed(recompute)
+    added = 0
+    with transaction(session):
+      if merge_changes:
+        added = Scenario._merge_changes(session, self.id)
+        Scenario._refresh_rollup(session, self.id)
+      if note is not None:
+        session.sql(
+          'insert into scenario_notes (scenario_id, notes, created_by, created_at) '
+          'values (?, ?, ?, current_timestamp())',
+          params=[int(self.id), note, created_by]
+        ).collect()
+    if added:
+      RefData.invalidate()
+
+  def _stage_recomputed(self, staged: pd.DataFrame) -> int:
+    """
+    Add the later periods the staged changes recompute to CHANGES_TABLE,
+    before the transaction merging them: writing a table commits. Returns
+    the number of rows added.
+    """
+    params = self.params()
+    if params is None or staged.empty:
+      return 0
+    changes = self._recomputed(params, staged, params['rules'], params['default_increase'])
+    if changes.empty:
+      return 0
+    _write_changes(pd.concat(
+      [staged, changes.assign(**{changeset.OP_COLUMN: changeset.UPDATE})[staged.columns]], ignore_index=True
+    ))
+    return len(changes)
+
+  def _recomputed(self, params: dict, edits: pd.DataFrame, new_rules: list, new_default: float) -> pd.DataFrame:
+    """ the rows of this version recompute() changes, with the edits as if merged """
+    session = Utils.get_session()
+    lookups = RefData.lookups()
+
+    frames = []
+    deleted = None
+    if edits is not None and changeset.OP_COLUMN in edits:
+      deleted = edits[edits[changeset.OP_COLUMN] == changeset.DELETE]
+      edits = edits[edits[changeset.OP_COLUMN] != changeset.DELETE]
+    if edits is not None and not edits.empty:
+      session.write_pandas(
+        edits[CELL_DIMENSIONS].drop_duplicates(),
+        table_name=RECOMPUTE_CELLS_TABLE,
+        overwrite=True,
+        table_type='temp',
+        quote_identifiers=False,
+        auto_create_table=True
+      )
+      cells = [c for c in FACT_COLUMNS if c != 'period_id']
+      frames.append(scenario_store.read_frame(
+        session,
+        f"""select {', '.join(f'r.{c}' for c in FACT_COLUMNS)}, r.course_enrolment_count
+        from {RESOLVED_VIEW} as r
+        inner join (
+          {scenario_store.encoded_select(RECOMPUTE_CELLS_TABLE, columns=[c.lower() for c in CELL_DIMENSIONS], measures=())}
+        ) as t
+          on {' and '.join(f'equal_null(r.{c}, t.{c})' for c in cells)}
+        where r.scenario_id = ?""",
+        [int(self.id)],
+        lookups,
+        columns=BASE_COLUMNS
+      ))
+    # only the cells a changed rule matches can change rate
+    if new_default != params['default_increase']:
+      predicate = 'true'
+    else:
+      predicate = ' or '.join(f'({cell_predicate(rule)})' for rule in changed_rules(params['rules'], new_rules))
+    if predicate:
+      frames.append(scenario_store.read_frame(
+        session,
+        f'select {FACT_DIMS}, course_enrolment_count from {RESOLVED_VIEW} where scenario_id = ? and ({predicate})',
+        [int(self.id)],
+        lookups,
+        columns=BASE_COLUMNS
+      ))
+    if not frames:
+      return pd.DataFrame(columns=BASE_COLUMNS)
+
+    keys = [c.upper() for c in CELL_COLUMNS]
+    rows_df = pd.concat(frames, ignore_index=True).drop_duplicates(keys)
+    if edits is not None and not edits.empty:
+      # the rows as they are once the edits are merged, which they may not be yet
+      rows_df = pd.concat([scenario_store.plain(rows_df), edits[BASE_COLUMNS]], ignore_index=True).drop_duplicates(keys, keep='last')
+    if deleted is not None and not deleted.empty:
+      gone = pd.MultiIndex.from_frame(deleted[keys].astype(object))
+      rows_df = rows_df[~pd.MultiIndex.from_frame(rows_df[keys].astype(object)).isin(gone)]
+    return recompute(
+      rows_df, new_rules, new_default, params['periods'],
+      edits=edits,
+      old_rules=params['rules'],
+      old_default_increase=params['default_increase'],
+      base_period=params['base_period']
+    )
+
+  def params(self) -> dict:
+    """ inputs the scenario was generated with, None when it was not generated by the app """
+    return json.loads(self.generation_params) if self.generation_params else None
+
+  def recompute(self, edits: pd.DataFrame = None, rules: list = None, default_increase: float = None) -> int:
+    """
+    Bring the later periods up to date after an edit or a rule change,
+    without regenerating the scenario. edits are the cells and PERIOD
+    edited, as staged; rules and default_increase replace the ones the
+    scenario was generated with. Only the rows of the affected cells are
+    read, recomputed through the compounding chain and merged into this
+    version. Returns the number of rows written.
+    """
+    params = self.params()
+    if params is None:
+      return 0
+    session = Utils.get_session()
+    new_rules = params['rules'] if rules is None else rules
+    new_default = params['default_increase'] if default_increase is None else float(default_increase)
+    changes = self._recomputed(params, edits, new_rules, new_default)
+    if not changes.empty:
+      _write_changes(changes.assign(**{changeset.OP_COLUMN: changeset.UPDATE}))
+    added = 0
+    with transaction(session):
+      if not changes.empty:
+        added = Scenario._merge_changes(session, self.id)
+        Scenario._refresh_rollup(session, self.id)
+      if rules is not None or default_increase is not None:
+        self.generation_params = json.dumps({**params, 'rules': new_rules, 'default_increase': new_default})
+        session.sql(
+          'update scenario set generation_params = ? where id = ?',
+          params=[self.generation_params, int(self.id)]
+        ).collect()
+    if added:
+      RefData.invalidate()
+    return len(changes)
+
+  def materialize(self):
+    """ Copy the inherited cells into the version and drop its parent pointer """
+    if self.parent_scenario_id is None:
+      return
+    session = Utils.get_session()
+    with transaction(session):
+      session.sql(
+        f"""insert into {FACT_TABLE} (scenario_id, {FACT_DIMS}, course_enrolment_count)
+        select ?, {FACT_DIMS}, course_enrolment_count
+        from {RESOLVED_VIEW}
+        where scenario_id = ?
+          and id not in (select id from {FACT_TABLE} where scenario_id = ?)""",
+        params=[int(self.id), int(self.id), int(self.id)]
+      ).collect()
+      session.sql(
+        f"delete from {FACT_TABLE} where scenario_id = ? and is_deleted = 'Y'",
+        params=[int(self.id)]
+      ).collect()
+      session.sql(
+        'update scenario set parent_scenario_id = null where id = ?',
+        params=[int(self.id)]
+      ).collect()
+    self.parent_scenario_id = None
 
   def approve(self):
     role = Utils.get_session_role()
@@ -60,6 +347,8 @@ class Scenario:
     elif role in ('ACCOUNTADMIN', 'G1_ADMIN'):
         self.is_final = 'Y'
         self.version_name = f"{self.version_name} - Final"
+        # final versions are read by every later comparison, store them whole
+        self.materialize()
     else:
         raise f"No role match: {role}"
 
@@ -94,6 +383,8 @@ class Scenario:
         'CONFIRMED_BY_SCI': self.confirmed_by_sci,
         'CONFIRMED_BY_FMHHS': self.confirmed_by_fmhhs,
         'NOTES': self.notes,
+        'PARENT_SCENARIO_ID': self.parent_scenario_id,
+        'GENERATION_PARAMS': self.generation_params,
         'CREATED_BY': self.created_by,
         'CREATED_AT': self.created_at,
         'UPDATED_BY': self.updated_by,
@@ -0,0 +1,276 @@
+"""
+Batch generation of scenario variants, run from the command line:
+
+    python -m models.estimate batch spec.yaml [--workers N] [--dry-run]
+
+The spec lists the variants to generate; every key of `defaults` applies to
+the variants that do not set it. Rules are rule names or inline rule
+contents and are applied in order; an inline rule is in the current rule
+format, so a dimension it leaves out matches every value.
+
+    backend: snowflake            # or local
+    connection: {...}             # snowflake, defaults to [connections.snowflake] in .streamlit/secrets.toml
+    local:                        # local, CSV files
+      actuals: commence_actual.csv
+      scenario_data: scenario_data.csv   # with a SCENARIO column, 'NAME (VERSION)'
+      rules: rule.csv                    # RULE_NAME, RULE_CONTENT
+      output: batch_scenario_data.csv
+    defaults:
+      actual_name: '2024.03'
+      base_scenario: 2024 Load Plan 2.0 (final version)
+      round: March Round
+      default_increase: 0.03
+    variants:
+      - name: What-if 2%
+        default_increase: 0.02
+      - name: What-if 4% with rules
+        default_increase: 0.04
+        rules: [Science growth, {periods: ['2026'], increase_by: 0.1, owning_faculties: [...]}]
+
+Calibration runs once per actual, base scenario and round in this process;
+the projections run across a process pool and all the results are written
+in one load.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from helpers.connection import create_session
+from helpers.cost_report import query_tag_text
+from models import scenario_store
+from models.estimate import (
+    BASE_COLUMNS,
+    BASE_PERIOD,
+    ROUNDS,
+    SCENARIO_DATA_COLUMNS,
+    calibrate,
+    calibration_from_rows,
+    project,
+    projection_periods,
+)
+from models.rule_engine import RULE_VERSION
+
+BATCH_TABLE = 'tmp_batch_estimate'
+RESULT_COLUMNS = ['SCENARIO_NAME', 'NOTES', *[c.upper() for c in SCENARIO_DATA_COLUMNS]]
+
+
+def variants(spec: dict) -> list:
+    """ variants of the spec with the defaults applied and the periods resolved """
+    defaults = spec.get('defaults', {})
+    result = []
+    for variant in spec.get('variants', []):
+        variant = {**defaults, **variant}
+        if 'name' not in variant:
+            raise ValueError(f'Variant without a name: {variant}')
+        round_ = ROUNDS[variant.get('round', 'March Round')]
+        variant.setdefault('observed_study_periods', round_['observed_study_periods'])
+        variant.setdefault('periods', projection_periods(horizon=variant.get('horizon', round_['horizon'])))
+        variant.setdefault('rules', [])
+        variant.setdefault('notes', '')
+        variant['default_increase'] = float(variant['default_increase'])
+        result.append(variant)
+    return result
+
+
+def _read_csv(path: str) -> pd.DataFrame:
+    df = pd.read_csv(path, dtype=str)
+    df.columns = df.columns.str.upper()
+    if 'COURSE_ENROLMENT_COUNT' in df.columns:
+        df['COURSE_ENROLMENT_COUNT'] = pd.to_numeric(df['COURSE_ENROLMENT_COUNT'])
+    return df
+
+
+class LocalBackend:
+    """ CSV stand-in for the warehouse, to try a spec without a Snowflake connection """
+
+    def __init__(self, actual_df: pd.DataFrame, scenario_df: pd.DataFrame, rule_df: pd.DataFrame = None,
+                 output: str = None):
+        self.actual_df = actual_df
+        self.scenario_df = scenario_df
+        self.rule_df = rule_df
+        self.output = output
+
+    @staticmethod
+    def from_config(config: dict, base_dir: str = '.'):
+        # relative paths are relative to the spec file
+        paths = {key: os.path.join(base_dir, path) for key, path in config.items()}
+        return LocalBackend(
+            _read_csv(paths['actuals']),
+            _read_csv(paths['scenario_data']),
+            _read_csv(paths['rules']) if 'rules' in paths else None,
+            paths.get('output', 'batch_scenario_data.csv')
+        )
+
+    def rules(self) -> dict:
+        if self.rule_df is None:
+            return {}
+        return dict(zip(self.rule_df['RULE_NAME'], self.rule_df['RULE_CONTENT']))
+
+    def calibration(self, actual_name: str, base_scenario: str, observed_study_periods: list):
+        # the rows calibrate() selects in the warehouse
+        actual = self.actual_df[self.actual_df['ACTUAL_NAME'] == actual_name]
+        base = self.scenario_df[
+            (self.scenario_df['SCENARIO'] == base_scenario) & (self.scenario_df['PERIOD'] == BASE_PERIOD)
+        ]
+        observed = base['COMMENCING_STUDY_PERIOD'].isin(observed_study_periods)
+        carried = base['COMMENCING_STUDY_PERIOD'].notna() & ~observed
+        rows_df = pd.concat([
+            actual[BASE_COLUMNS].assign(ROW_SOURCE='actual'),
+            base.loc[carried, BASE_COLUMNS].assign(ROW_SOURCE='estimate'),
+        ], ignore_index=True).assign(
+            SCENARIO_ID=0,
+            # a sum over no rows is null in the warehouse, which leaves the carried rows as they are
+            ACTUAL_TOTAL=actual['COURSE_ENROLMENT_COUNT'].sum(min_count=1),
+            ESTIMATE_TOTAL=base.loc[observed, 'COURSE_ENROLMENT_COUNT'].sum(min_count=1),
+        )
+        return calibration_from_rows(rows_df)
+
+    def write(self, results: pd.DataFrame):
+        if self.output:
+            results.to_csv(self.output, index=False)
+
+
+class SnowflakeBackend:
+    def __init__(self, config: dict):
+        self.session = create_session(config)
+        self.session.query_tag = query_tag_text({'page': 'batch', 'operation': 'generate'})
+
+    def rules(self) -> dict:
+        rows = self.session.sql('select rule_name, rule_content from rule').collect()
+        return {row['RULE_NAME']: row['RULE_CONTENT'] for row in rows}
+
+    def calibration(self, actual_name: str, base_scenario: str, observed_study_periods: list):
+        return calibrate(self.session, actual_name, base_scenario, observed_study_periods)
+
+    def write(self, results: pd.DataFrame):
+        """ one upload, then the scenarios and their rows in one transaction """
+        session = self.session
+        session.write_pandas(
+            results, BATCH_TABLE, quote_identifiers=False, auto_create_table=True, overwrite=True, table_type='temp'
+        )
+        source = f"""(
+            select s.id as scenario_id, {', '.join(f't.{c}' for c in SCENARIO_DATA_COLUMNS)}
+            from {BATCH_TABLE} as t
+            inner join (
+                select scenario_name, max(id) as id
+                from scenario
+                where version_name = 'init'
+                group by scenario_name
+            ) as s
+                on s.scenario_name = t.scenario_name
+        )"""
+        session.sql('begin').collect()
+        try:
+            session.sql(
+                f"""insert into scenario (scenario_name, version_name, notes)
+                select distinct scenario_name, 'init', notes from {BATCH_TABLE}"""
+            ).collect()
+            for statement in scenario_store.ensure_sql(BATCH_TABLE):
+                session.sql(statement).collect()
+            session.sql(scenario_store.insert_sql(source, 't.scenario_id')).collect()
+            for statement in scenario_store.rollup_sql(
+                f"""select max(id) from scenario
+                where version_name = 'init' and scenario_name in (select scenario_name from {BATCH_TABLE})
+                group by scenario_name"""
+            ):
+                session.sql(statement).collect()
+            session.sql('commit').collect()
+        except Exception:
+            session.sql('rollback').collect()
+            raise
+
+
+BACKENDS = {
+    'local': lambda spec, base_dir: LocalBackend.from_config(spec['local'], base_dir),
+    'snowflake': lambda spec, base_dir: SnowflakeBackend(spec.get('connection')),
+}
+
+
+def _resolve_rules(rules: list, named: dict) -> list:
+    resolved = []
+    for rule in rules:
+        if isinstance(rule, str):
+            if rule not in named:
+                raise ValueError(f'Unknown rule: {rule}')
+            rule = json.loads(named[rule])
+        else:
+            rule = {'version': RULE_VERSION, **rule}
+        resolved.append(rule)
+    return resolved
+
+
+def _project(base_df: pd.DataFrame, rules: list, default_increase: float, periods: list):
+    start = time.perf_counter()
+    estimate_df = project(base_df, rules, default_increase, periods)
+    return estimate_df, time.perf_counter() - start
+
+
+def run_batch(spec: dict, backend, workers: int = None, write: bool = True) -> list:
+    """ Generate every variant of the spec; returns a report row per variant """
+    batch = variants(spec)
+    named = backend.rules() if any(isinstance(r, str) for v in batch for r in v['rules']) else {}
+
+    calibrations = {}
+    calibration_seconds = {}
+    for variant in batch:
+        key = (variant['actual_name'], variant['base_scenario'], tuple(variant['observed_study_periods']))
+        if key not in calibrations:
+            start = time.perf_counter()
+            calibrations[key] = backend.calibration(*key[:2], list(key[2]))
+            calibration_seconds[key] = time.perf_counter() - start
+        variant['key'] = key
+
+    report = []
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(
+                _project,
+                calibrations[v['key']].base_df,
+                _resolve_rules(v['rules'], named),
+                v['default_increase'],
+                v['periods']
+            )
+            for v in batch
+        ]
+        for variant, future in zip(batch, futures):
+            estimate_df, seconds = future.result()
+            results.append(estimate_df.assign(SCENARIO_NAME=variant['name'], NOTES=variant['notes']))
+            report.append({
+                'variant': variant['name'],
+                'rows': len(estimate_df),
+                'calibrate_seconds': round(calibration_seconds[variant['key']], 3),
+                'project_seconds': round(seconds, 3),
+            })
+
+    if write and results:
+        start = time.perf_counter()
+        backend.write(pd.concat(results, ignore_index=True)[RESULT_COLUMNS])
+        report.append({'variant': '(write)', 'rows': sum(r['rows'] for r in report),
+                       'write_seconds': round(time.perf_counter() - start, 3)})
+    return report
+
+
+def main(argv: list = None):
+    import yaml
+
+    parser = argparse.ArgumentParser(prog='python -m models.estimate')
+    commands = parser.add_subparsers(dest='command', required=True)
+    batch_parser = commands.add_parser('batch', help='generate the scenario variants of a spec file')
+    batch_parser.add_argument('spec', help='YAML spec of the variants')
+    batch_parser.add_argument('--workers', type=int, default=None, help='processes, defaults to the CPU count')
+    batch_parser.add_argument('--dry-run', action='store_true', help='project the variants without writing them')
+    args = parser.parse_args(argv)
+
+    with open(args.spec) as f:
+        spec = yaml.safe_load(f)
+    backend = BACKENDS[spec.get('backend', 'snowflake')](spec, os.path.dirname(os.path.abspath(args.spec)))
+    start = time.perf_counter()
+    report = run_batch(spec, backend, args.workers, write=not args.dry_run)
+    for row in report:
+        print(json.dumps(row))
+    print(json.dumps({'variants': len(variants(spec)), 'wall_seconds': round(time.perf_counter() - start, 3)}))
@@ -0,0 +1,214 @@
+import json
+
+import pandas as pd
+import streamlit as st
+from snowflake.snowpark.functions import abs, coalesce, col, concat, greatest, iff, lit, round, sum
+
+from helpers import streaming
+from helpers.refdata import RefData
+from helpers.utils import Utils
+from models.scenario_store import DIMENSIONS, FACT_TABLE, ROLLUP_GRAINS, ROLLUP_TABLE
+
+COMPARE_DIMENSIONS = [
+    'SCENARIO',
+    'PERIOD',
+    'COMMENCING_STUDY_PERIOD',
+    'OWNING_FACULTY',
+    'FEE_LIABILITY_GROUP',
+    'COURSE_LEVEL_NAME',
+    'COURSE',
+]
+
+# the cell of a scenario, what two scenarios are compared on
+CELL_KEYS = ['COURSE', 'PERIOD', 'COMMENCING_STUDY_PERIOD', 'OWNING_FACULTY', 'COURSE_LEVEL_NAME', 'FEE_LIABILITY_GROUP']
+
+COMPARE_SQL = """select s.SCENARIO_NAME || ' (' || s.VERSION_NAME || ')' as scenario,
+        sd.course,
+        sd.period,
+        sd.commencing_study_period,
+        sd.owning_faculty,
+        sd.course_level_name,
+        sd.fee_liability_group,
+        sd.course_enrolment_count
+    from scenario_data_resolved as sd
+    inner join scenario as s
+        on sd.scenario_id=s.id"""
+
+# the names scenario_rollup rows are keyed by, the columns of COMPARE_SQL it has
+ROLLUP_NAMES = ['period', 'commencing_study_period', 'owning_faculty']
+
+COMPARE_TTL = 10 * 60
+
+
+def _selections_key(selections: dict) -> tuple:
+    # hashable cache key, empty selections do not filter
+    return tuple((d, tuple(selections[d])) for d in COMPARE_DIMENSIONS if selections.get(d))
+
+
+def filter_selections(df, selections: dict):
+    """ every non-empty selection as a filter of the Snowpark frame """
+    for dimension, values in _selections_key(selections):
+        df = df.filter(col(dimension).isin(list(values)))
+    return df
+
+
+def rollup_grain(selections: dict) -> str:
+    """ the coarsest rollup grain the selections can be answered from, None when they need the cells """
+    selected = {dimension for dimension, _ in _selections_key(selections)} - {'SCENARIO', 'PERIOD'}
+    for grain, columns in ROLLUP_GRAINS.items():
+        if selected <= {column.upper() for column in columns}:
+            return grain
+    return None
+
+
+def rollup_df(session, grain: str, selections: dict):
+    """
+    Snowpark frame of the rollup rows at the grain with the names of their
+    ids and the scenario, filtered by the selections
+    """
+    scenario = session.table('scenario').select(
+        col('ID').alias('SCENARIO_REF_ID'),
+        concat(col('SCENARIO_NAME'), lit(' ('), col('VERSION_NAME'), lit(')')).alias('SCENARIO')
+    )
+    rollup = session.table(ROLLUP_TABLE)
+    df = rollup.filter(rollup['GRAIN'] == grain).join(scenario, col('SCENARIO_ID') == col('SCENARIO_REF_ID'))
+    for column in ROLLUP_NAMES:
+        table, name, fact = DIMENSIONS[column]
+        ref = session.table(table).select(col('ID').alias(f'{fact}_REF'), col(name).alias(column))
+        df = df.join(ref, col(fact) == col(f'{fact}_REF'), how='left')
+    df = df.select('SCENARIO_ID', 'SCENARIO', *(column.upper() for column in ROLLUP_NAMES), 'COURSE_ENROLMENT_COUNT')
+    return filter_selections(df, selections)
+
+
+def compare_df(session, selections: dict):
+    """ Snowpark frame of the scenario data with every non-empty selection pushed down as a filter """
+    return filter_selections(session.sql(COMPARE_SQL), selections)
+
+
+def series_df(df):
+    """ total enrolments per scenario and period """
+    return df.group_by(['SCENARIO', 'PERIOD']).agg(
+        sum(col('COURSE_ENROLMENT_COUNT')).alias('COURSE_ENROLMENT_COUNT')
+    ).sort(['SCENARIO', 'PERIOD'])
+
+
+@st.cache_data(ttl=COMPARE_TTL, show_spinner=False)
+def _options(_session) -> dict:
+    def names(dimension: str) -> str:
+        # the names of the ids the facts use, read from the small reference table
+        table, name, fact = DIMENSIONS[dimension.lower()]
+        return f"""(
+            select array_agg(distinct r.{name}) within group (order by r.{name})
+            from {table} as r
+            where r.id in (select {fact} from {FACT_TABLE})
+        ) as {dimension}"""
+
+    aggregates = ',\n'.join(names(d) for d in COMPARE_DIMENSIONS[1:])
+    row = _session.sql(
+        f"""select (
+            select array_agg(distinct scenario_name || ' (' || version_name || ')')
+                within group (order by scenario_name || ' (' || version_name || ')')
+            from scenario
+        ) as scenario,
+        {aggregates}"""
+    ).collect()[0]
+    return {d: json.loads(row[d]) if row[d] else [] for d in COMPARE_DIMENSIONS}
+
+
+@st.cache_data(ttl=COMPARE_TTL, show_spinner=False)
+def _series(_session, selections_key: tuple) -> pd.DataFrame:
+    selections = dict(selections_key)
+    # the chart reads the rollup unless a course, level or fee group is selected
+    grain = rollup_grain(selections)
+    df = rollup_df(_session, grain, selections) if grain else compare_df(_session, selections)
+    return series_df(df).to_pandas()
+
+
+@st.cache_data(ttl=COMPARE_TTL, show_spinner=False)
+def _totals(_session, scenario_id: int, grain: str) -> pd.DataFrame:
+    columns = ['PERIOD', *(column.upper() for column in ROLLUP_GRAINS[grain])]
+    df = rollup_df(_session, grain, {})
+    return df.filter(col('SCENARIO_ID') == int(scenario_id)).to_pandas()[
+        [*columns, 'COURSE_ENROLMENT_COUNT']
+    ].sort_values(columns, ignore_index=True)
+
+
+def diff_df(session, selections: dict, scenarios: list, baseline: str, top_n: int = None):
+    """
+    Snowpark frame pivoting the selected scenarios side by side per cell,
+    with the absolute and percentage delta of every scenario against the
+    baseline. Columns are V<i>, D<i> and P<i> in the order of the scenarios;
+    top_n keeps the cells with the largest absolute delta.
+    """
+    df = compare_df(session, {**selections, 'SCENARIO': scenarios})
+    diff = df.group_by(CELL_KEYS).agg(*[
+        sum(iff(col('SCENARIO') == lit(scenario), col('COURSE_ENROLMENT_COUNT'), lit(None))).alias(f'V{i}')
+        for i, scenario in enumerate(scenarios)
+    ])
+    base = col(f'V{scenarios.index(baseline)}')
+    others = [i for i, scenario in enumerate(scenarios) if scenario != baseline]
+    for i in others:
+        diff = diff.with_column(f'D{i}', col(f'V{i}') - base).with_column(
+            f'P{i}', iff(base == 0, lit(None), round((col(f'V{i}') - base) * 100 / base, 2))
+        )
+    if top_n and others:
+        movement = [abs(coalesce(col(f'D{i}'), lit(0))) for i in others]
+        diff = diff.sort((greatest(*movement) if len(movement) > 1 else movement[0]).desc()).limit(int(top_n))
+    else:
+        diff = diff.sort(CELL_KEYS)
+    return diff
+
+
+@st.cache_data(ttl=COMPARE_TTL, show_spinner=False)
+def _diff(_session, selections_key: tuple, scenarios: tuple, baseline: str, top_n: int) -> pd.DataFrame:
+    scenarios = list(scenarios)
+    # every cell when top_n is 0, so read in batches
+    diff = streaming.read(diff_df(_session, dict(selections_key), scenarios, baseline, top_n))
+    columns = {}
+    for i, scenario in enumerate(scenarios):
+        columns[f'V{i}'] = scenario
+        columns[f'D{i}'] = f'Δ {scenario}'
+        columns[f'P{i}'] = f'% {scenario}'
+    return diff.rename(columns=columns)
+
+
+class Compare:
+    """
+    Compare Scenarios data. Only the option lists are loaded up front; the
+    selections are pushed down to the warehouse, which returns the chart
+    series and the pivoted diff rows. Series and totals are read from
+    scenario_rollup where its grains allow.
+    """
+
+    @staticmethod
+    def options() -> dict:
+        return _options(Utils.get_session())
+
+    @staticmethod
+    def series(selections: dict) -> pd.DataFrame:
+        return _series(Utils.get_session(), _selections_key(selections))
+
+    @staticmethod
+    def totals(scenario_id: int, grain: str = 'period') -> pd.DataFrame:
+        """ totals of a scenario per period at a rollup grain """
+        return _totals(Utils.get_session(), scenario_id, grain)
+
+    @staticmethod
+    def diff(selections: dict, scenarios: list, baseline: str, top_n: int = None) -> pd.DataFrame:
+        return _diff(Utils.get_session(), _selections_key(selections), tuple(scenarios), baseline, top_n)
+
+    @staticmethod
+    def export(selections: dict) -> bytes:
+        """ CSV of the selected rows of the scenarios, written batch by batch """
+        return streaming.to_csv(compare_df(Utils.get_session(), selections))
+
+    @staticmethod
+    def invalidate():
+        _options.clear()
+        _series.clear()
+        _totals.clear()
+        _diff.clear()
+
+
+# the options and frames hold names of the reference tables
+RefData.on_invalidate(Compare.invalidate)
@@ -0,0 +1,180 @@
+"""
+Dashboard aggregate of the estimates source, materialized in CUBE_TABLE.
+
+The cube is rebuilt outside the app, under the role that owns it, when the
+source has changed:
+
+    python -m models.dashboard_cube
+
+The dashboard only reads the cube and reports when it is behind the source.
+"""
+import argparse
+import json
+
+import pandas as pd
+import streamlit as st
+
+from helpers.bitmap_filter import BitmapIndex
+from helpers.transaction import transaction
+from helpers.utils import Utils
+
+CUBE_SOURCE = 'DATA_SOURCE.COMMENCING_ESTIMATES.DRAFT_LP_CE_ESTIMATES_2024'
+CUBE_TABLE = 'dashboard_cube'
+
+CUBE_DIMENSIONS = [
+    'SCENARIO_TYPE',
+    'PERIOD_NAME',
+    'COURSE_NAME',
+    'OWNING_FACULTY',
+    'COMMENCING_STUDY_PERIOD',
+    'COURSE_LEVEL_NAME',
+    'FEE_LIABILITY_GROUP',
+]
+CUBE_MEASURE = 'COURSE_ENROLMENT_COUNT'
+
+# sidebar filters of the dashboard
+CUBE_FILTERS = [
+    'COURSE_NAME',
+    'OWNING_FACULTY',
+    'COURSE_LEVEL_NAME',
+    'FEE_LIABILITY_GROUP',
+    'SCENARIO_TYPE',
+]
+
+SCENARIO_TYPES = ['Final', '2023 Budget', '2023 CD1R', '2024 Load Plan 1.0', '2024 Load Plan 2.0']
+
+# how often a rerun may ask the warehouse whether the source or the cube has changed
+CUBE_CHECK_TTL = 5 * 60
+
+
+def cube_sql() -> str:
+    dims = ', '.join(d.lower() for d in CUBE_DIMENSIONS)
+    scenario_types = ', '.join(f"'{t}'" for t in SCENARIO_TYPES)
+    return f"""select {dims}, sum(course_enrolment_count) as course_enrolment_count
+from {CUBE_SOURCE}
+where scenario_type in ({scenario_types})
+  and (period_name in ('2023', '2024', '2025', '2026', '2027', '2028') or period_name like '%Final')
+group by {dims}"""
+
+
+def source_signature(session) -> str:
+    """
+    Load watermark of the source: last_altered and row_count from the table
+    metadata, falling back to a row count and hash of the source when the
+    information schema is not readable by the role.
+    """
+    database, schema, table = CUBE_SOURCE.split('.')
+    try:
+        rows = session.sql(
+            f"""select last_altered, row_count from {database}.information_schema.tables
+            where table_schema = ? and table_name = ?""",
+            params=[schema, table]
+        ).collect()
+    except Exception:
+        rows = []
+    if rows:
+        return f"{rows[0]['LAST_ALTERED']}|{rows[0]['ROW_COUNT']}"
+    row = session.sql(f'select count(*) as n, hash_agg(*) as h from {CUBE_SOURCE}').collect()[0]
+    return f"{row['N']}|{row['H']}"
+
+
+def watermark(session) -> tuple:
+    """ signature of the source the cube was built from and when, (None, None) before the first build """
+    rows = session.sql(
+        f'select signature, refreshed_at from {CUBE_TABLE}_watermark where source_name = ?',
+        params=[CUBE_SOURCE]
+    ).collect()
+    if not rows:
+        return None, None
+    return rows[0]['SIGNATURE'], rows[0]['REFRESHED_AT']
+
+
+def refresh(session, signature: str) -> bool:
+    """ Rebuild the cube table when its watermark differs from the source; returns True if rebuilt """
+    if watermark(session)[0] == signature:
+        return False
+    with transaction(session):
+        session.sql(f'insert overwrite into {CUBE_TABLE} {cube_sql()}').collect()
+        session.sql(
+            f"""merge into {CUBE_TABLE}_watermark as w
+            using (select ? as source_name, ? as signature) as s
+                on w.source_name = s.source_name
+            when matched then update set signature = s.signature, refreshed_at = current_timestamp()
+            when not matched then insert (source_name, signature, refreshed_at)
+                values (s.source_name, s.signature, current_timestamp())""",
+            params=[CUBE_SOURCE, signature]
+        ).collect()
+    return True
+
+
+@st.cache_data(ttl=CUBE_CHECK_TTL, show_spinner=False)
+def _signature(_session) -> str:
+    return source_signature(_session)
+
+
+@st.cache_data(ttl=CUBE_CHECK_TTL, show_spinner=False)
+def _watermark(_session) -> tuple:
+    return watermark(_session)
+
+
+# keyed on the watermark, so a rebuild is read on the next check
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _cube(_session, signature: str) -> pd.DataFrame:
+    cube_df = _session.table(CUBE_TABLE).select([*CUBE_DIMENSIONS, CUBE_MEASURE]).to_pandas()
+    cube_df[CUBE_MEASURE] = cube_df[CUBE_MEASURE].fillna(0).astype('int')
+    return cube_df
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _cube_index(_session, signature: str) -> BitmapIndex:
+    return BitmapIndex(_cube(_session, signature), CUBE_FILTERS)
+
+
+class DashboardCube:
+    """
+    Dashboard aggregate of the estimates source, read from CUBE_TABLE and
+    held in process until its watermark changes.
+    """
+
+    @staticmethod
+    def load() -> pd.DataFrame:
+        session = Utils.get_session()
+        return _cube(session, _watermark(session)[0])
+
+    @staticmethod
+    def index() -> BitmapIndex:
+        session = Utils.get_session()
+        return _cube_index(session, _watermark(session)[0])
+
+    @staticmethod
+    def refreshed_at():
+        """ when the cube was last built, None before the first build """
+        return _watermark(Utils.get_session())[1]
+
+    @staticmethod
+    def stale() -> bool:
+        """ whether the source has changed since the cube was built """
+        session = Utils.get_session()
+        return _watermark(session)[0] != _signature(session)
+
+    @staticmethod
+    def invalidate():
+        _signature.clear()
+        _watermark.clear()
+        _cube.clear()
+        _cube_index.clear()
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog='python -m models.dashboard_cube')
+    parser.parse_args(argv)
+
+    # not deployed with the app
+    from helpers.connection import create_session
+
+    session = create_session()
+    print(json.dumps({'refreshed': refresh(session, source_signature(session))}))
+
+
+if __name__ == '__main__':
+    main()
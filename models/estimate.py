@@ -0,0 +1,448 @@
+import json
+import uuid
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+
+from helpers.transaction import transaction
+from models import scenario_store
+from models.rule_engine import CELL_DIMENSIONS, RuleEngine, compile_rule
+from models.scenario_store import FACT_COLUMNS, codes_in
+
+# estimate rounds: study periods already observed in the actuals, projected periods
+ROUNDS = {
+    'March Round': {
+        'observed_study_periods': ['Session 1'],
+        'horizon': 4,
+    },
+    'July Round': {
+        'observed_study_periods': ['Session 1', 'Session 2'],
+        'horizon': 5,
+    },
+}
+
+BASE_PERIOD = '2024'
+
+SCENARIO_DATA_COLUMNS = [
+    'course',
+    'period',
+    'commencing_study_period',
+    'owning_faculty',
+    'course_level_name',
+    'fee_liability_group',
+    'course_enrolment_count',
+]
+
+# base period rows as returned by calibrate()
+BASE_COLUMNS = [c.upper() for c in SCENARIO_DATA_COLUMNS]
+
+# the statements run on the ids of the facts, see models.scenario_store
+FACT_DIMS = ', '.join(FACT_COLUMNS)
+FACT_CELLS = ', '.join(c for c in FACT_COLUMNS if c != 'period_id')
+
+CTE_SEPARATOR = ',\n'
+
+
+def projection_periods(base_period: str = BASE_PERIOD, horizon: int = 4) -> list:
+    return [str(int(base_period) + i) for i in range(1, int(horizon) + 1)]
+
+
+def project(base_df: pd.DataFrame, rules: list, default_increase: float, periods: list) -> pd.DataFrame:
+    """
+    Project the base period rows over the periods.
+
+    The INCREASE_BY of every (row, period) is resolved once into a growth
+    matrix, and the counts of every period are filled in column by column:
+    count[p] = ceil(count[p - 1] * (1 + increase_by[p])). The ceil is applied
+    per period so the result is identical to compounding one year at a time.
+
+    Returns the base rows followed by the rows of each period, with the
+    INCREASE_BY applied to every row.
+    """
+    base_df = base_df.reset_index(drop=True)
+    n = len(base_df)
+
+    rates = RuleEngine(base_df).resolve(rules, default_increase, periods)
+    growth = 1 + rates
+    counts = np.empty_like(growth)
+    current = base_df['COURSE_ENROLMENT_COUNT'].to_numpy(dtype=float)
+    for j in range(len(periods)):
+        current = np.ceil(current * growth[:, j])
+        counts[:, j] = current
+
+    projected = {
+        column: np.tile(base_df[column].to_numpy(), len(periods))
+        for column in base_df.columns
+    }
+    projected['PERIOD'] = np.repeat(np.asarray(periods, dtype=object), n)
+    # period-major to match the layout of the base rows
+    projected['COURSE_ENROLMENT_COUNT'] = counts.T.ravel()
+    projected['INCREASE_BY'] = rates.T.ravel()
+
+    base_df = base_df.assign(INCREASE_BY=float(default_increase))
+    return pd.concat([base_df, pd.DataFrame(projected, columns=base_df.columns)], ignore_index=True)
+
+
+def generation_params(actual_name: str, base_scenario: str, observed_study_periods: list, rules: list,
+                      default_increase: float, periods: list, base_period: str = BASE_PERIOD) -> dict:
+    """ inputs of a generated scenario, stored on it so that edits can be recomputed later """
+    return {
+        'actual_name': actual_name,
+        'base_scenario': base_scenario,
+        'observed_study_periods': list(observed_study_periods),
+        'rules': list(rules),
+        'default_increase': float(default_increase),
+        'periods': list(periods),
+        'base_period': base_period,
+    }
+
+
+def changed_rules(old: list, new: list) -> list:
+    """
+    Rules whose position in the list changed, from either list. A cell none
+    of them matches is matched by the same rules in the same order before and
+    after, so its rates do not change.
+    """
+    changed = []
+    for i in range(max(len(old), len(new))):
+        before = old[i] if i < len(old) else None
+        after = new[i] if i < len(new) else None
+        if before != after:
+            changed.extend(rule for rule in (before, after) if rule is not None)
+    return changed
+
+
+def recompute(rows_df: pd.DataFrame, rules: list, default_increase: float, periods: list,
+              edits: pd.DataFrame = None, old_rules: list = None, old_default_increase: float = None,
+              base_period: str = BASE_PERIOD) -> pd.DataFrame:
+    """
+    Recompute the projected counts of some cells through the compounding chain,
+    count[p] = ceil(count[p - 1] * (1 + increase_by[p])) as in project().
+
+    rows_df holds every period of the cells, the base period included. A cell
+    is recomputed from the period after its earliest edit (edits: cells with
+    the PERIOD edited), the edited counts kept as they are. With old_rules,
+    or old_default_increase, a cell is also recomputed from the first period
+    its rate changes.
+
+    Returns the rows whose count changed, in BASE_COLUMNS.
+    """
+    rows_df = rows_df.reset_index(drop=True)
+    cells, cell_index = pd.MultiIndex.from_frame(rows_df[CELL_DIMENSIONS]).factorize()
+    all_periods = pd.Index([base_period, *periods])
+    period_index = all_periods.get_indexer(rows_df['PERIOD'])
+    known = period_index >= 0
+    counts = np.full((len(cell_index), len(all_periods)), np.nan)
+    counts[cells[known], period_index[known]] = rows_df['COURSE_ENROLMENT_COUNT'].to_numpy(dtype=float)[known]
+
+    cells_df = cell_index.to_frame(index=False, name=CELL_DIMENSIONS)
+    engine = RuleEngine(cells_df)
+    rates = engine.resolve(rules, default_increase, periods)
+
+    # index in periods of the first period to recompute, len(periods) for none
+    start = np.full(len(cell_index), len(periods))
+    pinned = np.zeros(counts.shape, dtype=bool)
+    if edits is not None and not edits.empty:
+        edit_cells = cell_index.get_indexer(pd.MultiIndex.from_frame(edits[CELL_DIMENSIONS]))
+        edit_periods = all_periods.get_indexer(edits['PERIOD'])
+        edited = (edit_cells >= 0) & (edit_periods >= 0)
+        pinned[edit_cells[edited], edit_periods[edited]] = True
+        np.minimum.at(start, edit_cells[edited], edit_periods[edited])
+    if old_rules is not None or old_default_increase is not None:
+        old_rates = engine.resolve(
+            rules if old_rules is None else old_rules,
+            default_increase if old_default_increase is None else old_default_increase,
+            periods
+        )
+        differs = ~np.isclose(rates, old_rates, equal_nan=True)
+        start = np.minimum(start, np.where(differs.any(axis=1), differs.argmax(axis=1), len(periods)))
+
+    result = counts.copy()
+    for j in range(len(periods)):
+        rows = (start <= j) & ~pinned[:, j + 1]
+        result[rows, j + 1] = np.ceil(result[rows, j] * (1 + rates[rows, j]))
+
+    changed = ~np.isnan(result) & (result != counts)
+    cell_rows, period_cols = np.nonzero(changed)
+    changed_df = cells_df.iloc[cell_rows].reset_index(drop=True)
+    changed_df['PERIOD'] = all_periods.to_numpy(dtype=object)[period_cols]
+    changed_df['COURSE_ENROLMENT_COUNT'] = result[cell_rows, period_cols]
+    return changed_df[BASE_COLUMNS]
+
+
+def sql_literal(value) -> str:
+    if value is None:
+        return 'null'
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        # float arithmetic in the warehouse, the same as numpy
+        return f'cast({float(value)!r} as float)'
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def cell_predicate(rule: dict) -> str:
+    """ SQL predicate on the fact columns matching the cells of the rule, in any period """
+    predicates = compile_rule(rule)
+    # a dimension matching every value needs no test, so the statement does not grow with the catalogue
+    return ' and '.join(
+        codes_in(column.lower(), sorted(predicates[column]))
+        for column in CELL_DIMENSIONS if predicates[column] is not None
+    ) or 'true'
+
+
+def rule_predicate(rule: dict, period: str) -> str:
+    """ SQL predicate matching the rows of the rule, or None if the rule does not apply to the period """
+    if rule.get('increase_by') is None or not RuleEngine.matches_period(rule, period):
+        return None
+    return cell_predicate(rule)
+
+
+def calibration_ctes(observed_study_periods: list) -> list:
+    """
+    CTEs selecting the actual rows, the base period rows of the base scenario
+    and the totals of the observed study periods, on the fact columns.
+    Parameters: base scenario ('SCENARIO_NAME (VERSION_NAME)'), actual name,
+    base period.
+    """
+    observed = codes_in('commencing_study_period', observed_study_periods)
+    return [
+        """base_scenario as (
+    select max(id) as id
+    from scenario
+    where scenario_name || ' (' || version_name || ')' = ?
+)""",
+        f"""actual as (
+    select {FACT_DIMS}, course_enrolment_count
+    from {scenario_store.ACTUAL_TABLE}
+    where actual_name = ?
+)""",
+        f"""base_estimate as (
+    select {FACT_DIMS}, course_enrolment_count
+    from {scenario_store.RESOLVED_VIEW}
+    where scenario_id = (select id from base_scenario)
+        and period_id in (select id from ref_period where period_name = ?)
+)""",
+        # no actuals or no observed base rows leave the carried rows as they are
+        f"""calibration as (
+    select actual_total, estimate_total,
+        coalesce(actual_total::float / nullif(estimate_total, 0)::float, 1) as ratio
+    from (
+        select (select sum(course_enrolment_count) from actual) as actual_total,
+            (select sum(course_enrolment_count) from base_estimate where {observed}) as estimate_total
+    )
+)""",
+    ]
+
+
+class Calibration:
+    """ Pro rata calibration of a base scenario against the actuals to date """
+
+    def __init__(self, scenario_id, actual_total, estimate_total, base_df: pd.DataFrame):
+        self.scenario_id = scenario_id
+        self.actual_total = actual_total
+        self.estimate_total = estimate_total
+        self.base_df = base_df
+
+    @property
+    def ratio(self) -> float:
+        """ actual total over the observed base scenario total, None when either is missing or zero """
+        if pd.isna(self.actual_total) or pd.isna(self.estimate_total) or float(self.estimate_total) == 0:
+            return None
+        return float(self.actual_total) / float(self.estimate_total)
+
+
+def calibrate(session, actual_name: str, base_scenario: str, observed_study_periods: list,
+              base_period: str = BASE_PERIOD, lookups: dict = None) -> Calibration:
+    """
+    Fetch the totals and the base period rows in one query.
+
+    The base period keeps the actual rows as they are and carries forward the
+    base scenario rows of the study periods not observed yet, scaled by the
+    ratio of the actual total to the base scenario total of the observed
+    study periods, or as they are when either total is missing or zero.
+    The rows come back as ids and are decoded into
+    categoricals with the lookups, loaded when not given.
+    """
+    observed = codes_in('commencing_study_period', observed_study_periods)
+    sql = f"""with {CTE_SEPARATOR.join(calibration_ctes(observed_study_periods))}
+select 'actual' as row_source, (select id from base_scenario) as scenario_id, {FACT_DIMS}, course_enrolment_count,
+    calibration.actual_total, calibration.estimate_total
+from actual, calibration
+union all
+select 'estimate', (select id from base_scenario), {FACT_DIMS}, course_enrolment_count,
+    calibration.actual_total, calibration.estimate_total
+from base_estimate, calibration
+where not ({observed})"""
+    rows_df = scenario_store.read_frame(session, sql, [base_scenario, actual_name, base_period], lookups)
+    return calibration_from_rows(rows_df)
+
+
+def calibration_from_rows(rows_df: pd.DataFrame) -> Calibration:
+    if rows_df.empty:
+        return Calibration(None, None, None, pd.DataFrame(columns=['SCENARIO_ID', *BASE_COLUMNS]))
+    first = rows_df.iloc[0]
+    calibration = Calibration(int(first['SCENARIO_ID']), first['ACTUAL_TOTAL'], first['ESTIMATE_TOTAL'], None)
+    base_df = rows_df[['SCENARIO_ID', *BASE_COLUMNS]].reset_index(drop=True)
+    carried = (rows_df['ROW_SOURCE'] == 'estimate').to_numpy()
+    if carried.any() and calibration.ratio is not None:
+        base_df.loc[carried, 'COURSE_ENROLMENT_COUNT'] = np.ceil(
+            base_df.loc[carried, 'COURSE_ENROLMENT_COUNT'].astype(float) * calibration.ratio
+        )
+    calibration.base_df = base_df
+    return calibration
+
+
+def compile_sql(actual_name: str, base_scenario: str, observed_study_periods: list, rules: list,
+                default_increase: float, periods: list, base_period: str = BASE_PERIOD):
+    """
+    Compile the whole projection into one insert ... select into the facts.
+
+    The statement calibrates the base period against the actuals, then
+    projects every period with a chain of CTEs, one per period, so no rows
+    leave the warehouse. It runs on the ids throughout; the projected
+    periods must be in ref_period. The target is the latest 'init' version
+    of the scenario name bound as the last parameter.
+
+    Returns the statement and its parameters.
+    """
+    observed = codes_in('commencing_study_period', observed_study_periods)
+
+    ctes = [
+        *calibration_ctes(observed_study_periods),
+        f"""p0 as (
+    select {FACT_DIMS}, course_enrolment_count::float as course_enrolment_count,
+        {sql_literal(default_increase)} as increase_by
+    from actual
+    union all
+    select {FACT_DIMS}, ceil(course_enrolment_count * calibration.ratio),
+        {sql_literal(default_increase)}
+    from base_estimate, calibration
+    where not ({observed})
+)""",
+    ]
+    for j, period in enumerate(periods, start=1):
+        # the last matching rule wins, so test the rules in reverse order
+        whens = [
+            (rule_predicate(rule, period), rule.get('increase_by'))
+            for rule in reversed(rules)
+        ]
+        case = ''.join(
+            f'\n            when {predicate} then {sql_literal(increase_by)}'
+            for predicate, increase_by in whens if predicate is not None
+        )
+        increase_by = f'case{case}\n            else increase_by\n        end' if case else 'increase_by'
+        ctes.append(f"""r{j} as (
+    select {FACT_CELLS}, course_enrolment_count,
+        {increase_by} as increase_by
+    from p{j - 1}
+)""")
+        ctes.append(f"""p{j} as (
+    select {FACT_CELLS}, (select min(id) from ref_period where period_name = {sql_literal(period)}) as period_id,
+        ceil(course_enrolment_count * (1 + increase_by)) as course_enrolment_count,
+        increase_by
+    from r{j}
+)""")
+
+    projection = '\n    union all\n    '.join(
+        f'select {FACT_DIMS}, course_enrolment_count from p{j}' for j in range(len(periods) + 1)
+    )
+    ctes.append(f"""projection as (
+    {projection}
+)""")
+    sql = f"""insert into {scenario_store.FACT_TABLE} (scenario_id, {FACT_DIMS}, course_enrolment_count)
+with {CTE_SEPARATOR.join(ctes)}
+select (select max(id) from scenario where scenario_name = ? and version_name = 'init'),
+    {FACT_DIMS}, course_enrolment_count
+from projection"""
+    return sql, [base_scenario, actual_name, base_period]
+
+
+def _stage(job, name: str):
+    return job.stage(name) if job is not None else nullcontext()
+
+
+def _execute(session, sql: str, params: list, job=None):
+    # through an async query when run as a job, so a cancel stops the statement
+    if job is None:
+        return session.sql(sql, params=params).collect()
+    return job.wait(session.sql(sql, params=params).collect_nowait())
+
+
+def _rollup(session, scenario_name: str, job=None):
+    for statement in scenario_store.rollup_sql(
+        "select max(id) from scenario where scenario_name = ? and version_name = 'init'"
+    ):
+        _execute(session, statement, [scenario_name], job)
+
+
+def generate_in_warehouse(session, scenario_name: str, notes: str, actual_name: str, base_scenario: str,
+                          observed_study_periods: list, rules: list, default_increase: float, periods: list,
+                          job=None):
+    if job is not None:
+        job.stages(['scenario', 'projection', 'rollup'])
+    params = generation_params(actual_name, base_scenario, observed_study_periods, rules, default_increase, periods)
+    # a failed or cancelled job leaves no scenario behind
+    with transaction(session):
+        with _stage(job, 'scenario'):
+            _execute(
+                session,
+                "insert into scenario (scenario_name, version_name, notes, generation_params) values (?, 'init', ?, ?)",
+                [scenario_name, notes, json.dumps(params)],
+                job
+            )
+        with _stage(job, 'projection'):
+            for statement in scenario_store.ensure_sql(scenario_store.values_source('period', periods), ['period']):
+                _execute(session, statement, [], job)
+            sql, params = compile_sql(
+                actual_name, base_scenario, observed_study_periods, rules, default_increase, periods
+            )
+            _execute(session, sql, [*params, scenario_name], job)
+        with _stage(job, 'rollup'):
+            _rollup(session, scenario_name, job)
+
+
+def generate_in_client(session, scenario_name: str, notes: str, actual_name: str, base_scenario: str,
+                       observed_study_periods: list, rules: list, default_increase: float, periods: list,
+                       job=None) -> int:
+    """ Calibrate and project in pandas, then upload and insert the rows; returns the row count """
+    if job is not None:
+        job.stages(['calibrate', 'project', 'upload', 'insert', 'rollup'])
+    with _stage(job, 'calibrate'):
+        calibration = calibrate(session, actual_name, base_scenario, observed_study_periods)
+    with _stage(job, 'project'):
+        estimate_df = project(calibration.base_df, rules, default_increase, periods)
+    # temp tables are per session, and a session may run several jobs
+    tmp_table = f'tmp_estimate_{uuid.uuid4().hex[:8]}'
+    with _stage(job, 'upload'):
+        session.write_pandas(
+            estimate_df, tmp_table, quote_identifiers=False, auto_create_table=True, overwrite=True, table_type='temp'
+        )
+    params = generation_params(actual_name, base_scenario, observed_study_periods, rules, default_increase, periods)
+    # after the upload, which creates a table and so commits; a failed or cancelled job leaves no scenario behind
+    with transaction(session):
+        with _stage(job, 'insert'):
+            _execute(
+                session,
+                "insert into scenario (scenario_name, version_name, notes, generation_params) values (?, 'init', ?, ?)",
+                [scenario_name, notes, json.dumps(params)],
+                job
+            )
+            for statement in scenario_store.ensure_sql(tmp_table):
+                _execute(session, statement, [], job)
+            _execute(
+                session,
+                scenario_store.insert_sql(
+                    tmp_table, "(select max(id) from scenario where scenario_name = ? and version_name = 'init')"
+                ),
+                [scenario_name],
+                job
+            )
+        with _stage(job, 'rollup'):
+            _rollup(session, scenario_name, job)
+    return len(estimate_df)
+
+
+if __name__ == '__main__':
+    from models.batch import main
+
+    main()
@@ -0,0 +1,189 @@
+import json
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from helpers.refdata import RefData
+from helpers.utils import Utils
+from models import scenario_store
+from models.estimate import BASE_PERIOD
+from models.rule_engine import CELL_DIMENSIONS, RULE_PERIODS, RuleEngine
+
+# rules and cells change rarely, saving a rule goes through RuleCoverage.invalidate()
+COVERAGE_TTL = 10 * 60
+
+# the scenario ('SCENARIO_NAME (VERSION_NAME)') indexed, the latest final one by default
+SCENARIO_ID_SQL = """coalesce(
+    (select max(id) from scenario where scenario_name || ' (' || version_name || ')' = ?),
+    (select id from scenario order by iff(is_final = 'Y', 0, 1), id desc limit 1)
+)"""
+
+# set bits of every byte value
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.int64)
+
+
+def popcount(bits: np.ndarray) -> np.ndarray:
+    """ set bits of packed bitsets, along the last axis """
+    return POPCOUNT[bits].sum(axis=-1)
+
+
+class CoverageIndex:
+    """
+    The (cell, period) pairs every rule matches, over the cells of a scenario.
+
+    A rule matches the product of a set of cells and a set of periods, so its
+    coverage is kept as a packed bitset over the cells and a boolean vector
+    over the periods. Counts of a pair of rules are the set bits of the AND
+    of their cell bitsets times the periods they share.
+    """
+
+    def __init__(self, cells_df: pd.DataFrame, rules: dict, periods: list = RULE_PERIODS):
+        self.cells_df = cells_df.reset_index(drop=True)
+        self.periods = list(periods)
+        self.names = list(rules)
+        self.engine = RuleEngine(self.cells_df)
+        width = (len(self.cells_df) + 7) // 8
+        self.cell_bits = np.zeros((len(self.names), width), dtype=np.uint8)
+        self.period_bits = np.zeros((len(self.names), len(self.periods)), dtype=bool)
+        for i, rule in enumerate(rules.values()):
+            self.cell_bits[i], self.period_bits[i] = self.match(rule)
+
+    @property
+    def size(self) -> int:
+        """ (cell, period) pairs of the index """
+        return len(self.cells_df) * len(self.periods)
+
+    def match(self, rule: dict) -> tuple:
+        """ packed cell bits and period vector of a rule, saved or not """
+        if rule.get('increase_by') is None:
+            return np.zeros(self.cell_bits.shape[1], dtype=np.uint8), np.zeros(len(self.periods), dtype=bool)
+        periods = np.array([RuleEngine.matches_period(rule, period) for period in self.periods], dtype=bool)
+        return np.packbits(self.engine.cell_mask(rule)), periods
+
+    def affected(self, rule: dict) -> int:
+        """ (cell, period) pairs the rule matches """
+        cell_bits, period_bits = self.match(rule)
+        return int(popcount(cell_bits)) * int(period_bits.sum())
+
+    def overlaps(self, rule: dict) -> pd.Series:
+        """ (cell, period) pairs a rule, saved or not, shares with each saved rule """
+        cell_bits, period_bits = self.match(rule)
+        shared = popcount(self.cell_bits & cell_bits) * (self.period_bits & period_bits).sum(axis=1)
+        return pd.Series(shared, index=self.names, name='OVERLAP')
+
+    def _positions(self, names: list) -> list:
+        return [self.names.index(name) for name in names]
+
+    def summary(self, names: list = None) -> pd.DataFrame:
+        """ cells, periods and (cell, period) pairs matched by each rule """
+        positions = self._positions(names or self.names)
+        cells = popcount(self.cell_bits[positions])
+        periods = self.period_bits[positions].sum(axis=1)
+        return pd.DataFrame({
+            'RULE_NAME': [self.names[i] for i in positions],
+            'CELLS': cells,
+            'PERIODS': periods,
+            'AFFECTED': cells * periods,
+            'SHARE': np.round(cells * periods / max(self.size, 1), 4),
+        })
+
+    def overlap(self, names: list = None) -> pd.DataFrame:
+        """ (cell, period) pairs matched by both rules, for every pair of rules """
+        positions = self._positions(names or self.names)
+        cell_bits = self.cell_bits[positions]
+        period_bits = self.period_bits[positions].astype(np.int64)
+        cells = np.stack([popcount(cell_bits[i] & cell_bits) for i in range(len(positions))]) if positions else \
+            np.zeros((0, 0), dtype=np.int64)
+        labels = [self.names[i] for i in positions]
+        return pd.DataFrame(cells * (period_bits @ period_bits.T), index=labels, columns=labels)
+
+    def overridden(self, names: list) -> pd.DataFrame:
+        """
+        For rules applied in the given order: the (cell, period) pairs of each
+        rule that a later rule matches too, and so sets the rate of, and the
+        pairs the rule keeps.
+        """
+        positions = self._positions(names)
+        overridden = np.zeros(len(positions), dtype=np.int64)
+        for p in range(len(self.periods)):
+            # union of the cell bits of the later rules applying to the period
+            later = np.zeros(self.cell_bits.shape[1], dtype=np.uint8)
+            for k in reversed(range(len(positions))):
+                i = positions[k]
+                if self.period_bits[i, p]:
+                    overridden[k] += int(popcount(self.cell_bits[i] & later))
+                    later |= self.cell_bits[i]
+        summary = self.summary(names)
+        return summary.assign(OVERRIDDEN=overridden, EFFECTIVE=summary['AFFECTED'] - overridden)
+
+
+@st.cache_data(ttl=COVERAGE_TTL, show_spinner=False)
+def _cells(_session, scenario: str) -> pd.DataFrame:
+    cells = ', '.join(scenario_store.DIMENSIONS[c.lower()][2] for c in CELL_DIMENSIONS)
+    return scenario_store.read_frame(
+        _session,
+        f"""select distinct {cells}
+        from {scenario_store.RESOLVED_VIEW}
+        where scenario_id = {SCENARIO_ID_SQL}""",
+        [scenario],
+        RefData.lookups(),
+        columns=CELL_DIMENSIONS
+    )
+
+
+@st.cache_data(ttl=COVERAGE_TTL, show_spinner=False)
+def _periods(_session, scenario: str) -> list:
+    # the projected periods of the scenario, as many as its horizon
+    rows = _session.sql(
+        f"""select distinct p.period_name
+        from {scenario_store.RESOLVED_VIEW} as r
+        inner join ref_period as p
+            on p.id = r.period_id
+        where r.scenario_id = {SCENARIO_ID_SQL}
+            and p.period_name > ?
+        order by p.period_name""",
+        params=[scenario, BASE_PERIOD]
+    ).collect()
+    return [row['PERIOD_NAME'] for row in rows] or RULE_PERIODS
+
+
+@st.cache_data(ttl=COVERAGE_TTL, show_spinner=False)
+def _rules(_session) -> pd.DataFrame:
+    return _session.sql('select rule_name, rule_content, rule_owner from rule order by id').to_pandas()
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _index(_session, scenario: str, rules_key: tuple) -> CoverageIndex:
+    rules = {name: json.loads(content) for name, content in rules_key}
+    return CoverageIndex(_cells(_session, scenario), rules, _periods(_session, scenario))
+
+
+class RuleCoverage:
+    """
+    Coverage index of the saved rules, held in process per scenario. The cell
+    space is the cells of the scenario ('SCENARIO_NAME (VERSION_NAME)'), the
+    latest final one by default, over the periods it projects.
+    """
+
+    @staticmethod
+    def rules() -> pd.DataFrame:
+        return _rules(Utils.get_session())
+
+    @staticmethod
+    def index(scenario: str = None) -> CoverageIndex:
+        session = Utils.get_session()
+        rules_df = _rules(session)
+        rules_key = tuple(zip(rules_df['RULE_NAME'], rules_df['RULE_CONTENT']))
+        return _index(session, scenario, rules_key)
+
+    @staticmethod
+    def invalidate():
+        _cells.clear()
+        _periods.clear()
+        _rules.clear()
+        _index.clear()
+
+
+# the cells are decoded with the names of the reference tables
+RefData.on_invalidate(RuleCoverage.invalidate)
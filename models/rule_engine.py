@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+
+# rule.rule_content format; from version 2 an omitted dimension matches every value
+RULE_VERSION = 2
+
+# scenario_data column -> key of the list in rule.rule_content
+RULE_DIMENSIONS = {
+    'COURSE': 'courses',
+    'PERIOD': 'periods',
+    'COMMENCING_STUDY_PERIOD': 'commencing_study_periods',
+    'OWNING_FACULTY': 'owning_faculties',
+    'COURSE_LEVEL_NAME': 'course_level_names',
+    'FEE_LIABILITY_GROUP': 'fee_liability_groups',
+}
+
+# the dimensions identifying a cell within a period
+CELL_DIMENSIONS = [
+    'COURSE',
+    'COMMENCING_STUDY_PERIOD',
+    'OWNING_FACULTY',
+    'COURSE_LEVEL_NAME',
+    'FEE_LIABILITY_GROUP',
+]
+
+
+# values offered by Rule Settings where there is no reference table
+RULE_PERIODS = ['2025', '2026', '2027', '2028', '2029']
+COMMENCING_STUDY_PERIODS = [
+    'Session 1',
+    'Session 2',
+    'Session 3',
+    'Term 1',
+    'Term 2',
+    'Term 3',
+    'Term 4',
+    'Term 5',
+    'Term 6',
+]
+
+
+def compile_rule(rule: dict) -> dict:
+    """
+    Per dimension predicate of a rule: scenario_data column -> frozenset of
+    the values it matches, or None when it matches every value.
+
+    Version 1 rules spell out every dimension, so a missing list matches
+    nothing there; from version 2 a missing list matches everything.
+    """
+    wildcard = rule.get('version', 1) >= 2
+    predicates = {}
+    for column, key in RULE_DIMENSIONS.items():
+        values = rule.get(key)
+        predicates[column] = None if values is None and wildcard else frozenset(values or [])
+    return predicates
+
+
+def migrate_rule(rule: dict, catalogue: dict, course_faculty: dict = None) -> dict:
+    """
+    The rule in the current format. A list covering every value of the
+    catalogue (scenario_data column -> values) is dropped, so the rule also
+    covers the values added later. A course list covering every course of
+    the faculties of the rule (course_faculty: course -> faculty) is dropped
+    too, as Rule Settings filled it in from the faculties. The periods are
+    kept: Rule Settings filled in the periods of the horizon, and a wildcard
+    would apply the rule to the periods added later.
+    """
+    if rule.get('version', 1) >= RULE_VERSION:
+        return rule
+    migrated = {key: value for key, value in rule.items() if key not in RULE_DIMENSIONS.values()}
+    migrated['version'] = RULE_VERSION
+    predicates = compile_rule(rule)
+    for column, key in RULE_DIMENSIONS.items():
+        values = predicates[column]
+        if column != 'PERIOD' and catalogue.get(column) and values.issuperset(catalogue[column]):
+            continue
+        migrated[key] = rule.get(key) or []
+    if RULE_DIMENSIONS['COURSE'] in migrated and course_faculty is not None:
+        faculties = predicates['OWNING_FACULTY']
+        courses = {course for course, faculty in course_faculty.items() if faculty in faculties}
+        if predicates['COURSE'].issuperset(courses):
+            del migrated[RULE_DIMENSIONS['COURSE']]
+    return migrated
+
+
+class RuleEngine:
+    """
+    Matches estimate rules against the rows of a scenario frame.
+
+    Each cell dimension is dictionary encoded once, so matching a rule is a
+    lookup of its value list against the (small) dictionary followed by one
+    gather over the integer codes, instead of expanding the rule into the
+    cartesian product of its lists and merging it into the frame.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.size = len(df)
+        self.codes = {}
+        self.uniques = {}
+        for column in CELL_DIMENSIONS:
+            codes, uniques = pd.factorize(df[column])
+            self.codes[column] = codes
+            self.uniques[column] = uniques
+
+    def dimension_mask(self, column: str, values) -> np.ndarray:
+        """ rows matching the values, None matching every row """
+        if values is None:
+            return np.ones(self.size, dtype=bool)
+        # trailing False is picked up by the -1 code of missing values
+        lookup = np.append(self.uniques[column].isin(list(values)), False)
+        return lookup[self.codes[column]]
+
+    def cell_mask(self, rule: dict) -> np.ndarray:
+        predicates = compile_rule(rule)
+        mask = np.ones(self.size, dtype=bool)
+        for column in CELL_DIMENSIONS:
+            if predicates[column] is not None:
+                mask &= self.dimension_mask(column, predicates[column])
+        return mask
+
+    @staticmethod
+    def matches_period(rule: dict, period: str) -> bool:
+        periods = compile_rule(rule)['PERIOD']
+        return periods is None or period in periods
+
+    def increase_by(self, rules: list, period: str, current) -> np.ndarray:
+        """
+        INCREASE_BY of every row for the period. Rules are applied in the order
+        given, so a later rule overrides an earlier one on the rows both match;
+        rows no rule matches keep their current value.
+        """
+        increase_by = np.array(current, dtype=float)
+        for rule in rules:
+            if rule.get('increase_by') is None or not self.matches_period(rule, period):
+                continue
+            increase_by[self.cell_mask(rule)] = float(rule['increase_by'])
+        return increase_by
+
+    def sources(self, rules: list, periods: list) -> np.ndarray:
+        """
+        Index of the rule that sets the INCREASE_BY of every (row, period), as
+        a rows x periods matrix; -1 is the default increase.
+
+        Cell masks are computed once per rule and reused for every period. A
+        row no rule matches in a period carries the rate of the previous
+        period forward, starting from the default increase.
+        """
+        sources = np.empty((self.size, len(periods)), dtype=np.int64)
+        masks = [
+            self.cell_mask(rule) if rule.get('increase_by') is not None else None
+            for rule in rules
+        ]
+        current = np.full(self.size, -1, dtype=np.int64)
+        for j, period in enumerate(periods):
+            for i, (rule, mask) in enumerate(zip(rules, masks)):
+                if mask is not None and self.matches_period(rule, period):
+                    current[mask] = i
+            sources[:, j] = current
+        return sources
+
+    @staticmethod
+    def rate_values(rules: list, default_increase: float) -> np.ndarray:
+        """ INCREASE_BY by source: the default increase followed by the rate of every rule """
+        return np.array(
+            [float(default_increase)] + [
+                float(rule['increase_by']) if rule.get('increase_by') is not None else np.nan
+                for rule in rules
+            ]
+        )
+
+    def resolve(self, rules: list, default_increase: float, periods: list) -> np.ndarray:
+        """ INCREASE_BY of every (row, period) as a rows x periods matrix """
+        return self.rate_values(rules, default_increase)[self.sources(rules, periods) + 1]
@@ -0,0 +1,76 @@
+"""
+Migrate the stored rules to the current rule format, run from the repository root:
+
+    python -m models.rule_migration [--dry-run]
+
+Version 1 rules spell out every value of the dimensions left unselected in
+Rule Settings. A list covering the whole catalogue of its dimension is
+dropped, which matches the same rows today and the values added later.
+The periods are kept: the horizon of the rule is not extended to the
+periods added later. All rules are rewritten in one transaction.
+"""
+import argparse
+import json
+
+from helpers.connection import create_session
+from helpers.transaction import transaction
+from models.rule_engine import COMMENCING_STUDY_PERIODS, RULE_VERSION, migrate_rule
+
+
+def catalogue(session) -> tuple:
+    """ every value of each dimension, and the faculty of every course, from the reference tables """
+    def values(sql: str) -> set:
+        return {row[0] for row in session.sql(sql).collect() if row[0] is not None}
+
+    course_faculty = {
+        row['COURSE_NAME']: row['FACULTY_NAME']
+        for row in session.sql(
+            """select c.course_name, f.faculty_name
+            from ref_course c
+            join ref_owning_faculty f on f.id = c.owning_faculty_id"""
+        ).collect()
+    }
+    return {
+        'COURSE': values('select course_name from ref_course'),
+        'COMMENCING_STUDY_PERIOD': set(COMMENCING_STUDY_PERIODS),
+        'OWNING_FACULTY': values('select faculty_name from ref_owning_faculty'),
+        'COURSE_LEVEL_NAME': values('select course_level_name from ref_course_level'),
+        'FEE_LIABILITY_GROUP': values('select fee_liability_group from ref_fee_liability_group'),
+    }, course_faculty
+
+
+def migrate(session, dry_run: bool = False) -> dict:
+    """ rewrite the rules of an older format; returns the rules migrated and the content size before and after """
+    values, course_faculty = catalogue(session)
+    updates = []
+    before = after = 0
+    for row in session.sql('select id, rule_content from rule').collect():
+        rule = json.loads(row['RULE_CONTENT'])
+        if rule.get('version', 1) >= RULE_VERSION:
+            continue
+        content = json.dumps(migrate_rule(rule, values, course_faculty))
+        updates.append((row['ID'], content))
+        before += len(row['RULE_CONTENT'])
+        after += len(content)
+
+    if updates and not dry_run:
+        with transaction(session):
+            for rule_id, content in updates:
+                session.sql(
+                    'update rule set rule_content = ?, updated_by = current_role(), updated_at = current_timestamp() '
+                    'where id = ?',
+                    params=[content, rule_id]
+                ).collect()
+    return {'migrated': len(updates), 'bytes_before': before, 'bytes_after': after, 'dry_run': dry_run}
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog='python -m models.rule_migration')
+    parser.add_argument('--dry-run', action='store_true', help='report the rules to migrate without writing them')
+    args = parser.parse_args(argv)
+
+    print(json.dumps(migrate(create_session(), args.dry_run)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""
+ID keyed storage of the scenario cells and the actuals (sql/star_schema.sql).
+
+scenario_fact and commence_actual_fact hold the ref_* ids of the dimensions;
+scenario_data, scenario_data_resolved and commence_actual are views over
+them with the names. Rows are written through this module, which encodes
+the names of a source on the way in, and read as integer codes decoded
+into categoricals by small lookups of the reference tables. Every write
+also rebuilds the scenario_rollup rows of the scenarios it touched.
+"""
+import numpy as np
+import pandas as pd
+
+from helpers import streaming
+
+FACT_TABLE = 'scenario_fact'
+RESOLVED_VIEW = 'scenario_fact_resolved'
+ACTUAL_TABLE = 'commence_actual_fact'
+
+# scenario_data column -> reference table, its name column, fact column
+DIMENSIONS = {
+    'course': ('ref_course', 'course_name', 'course_id'),
+    'period': ('ref_period', 'period_name', 'period_id'),
+    'commencing_study_period': ('ref_commencing_study_period', 'commencing_study_period', 'commencing_study_period_id'),
+    'owning_faculty': ('ref_owning_faculty', 'faculty_name', 'owning_faculty_id'),
+    'course_level_name': ('ref_course_level', 'course_level_name', 'course_level_id'),
+    'fee_liability_group': ('ref_fee_liability_group', 'fee_liability_group', 'fee_liability_group_id'),
+}
+FACT_COLUMNS = [fact for _, _, fact in DIMENSIONS.values()]
+
+# called by read_frame() when the lookups it was given miss a name, for the caches they came from
+_stale_listeners = []
+
+ROLLUP_TABLE = 'scenario_rollup'
+# grain -> dimensions of its rollup rows besides the scenario and the period
+ROLLUP_GRAINS = {
+    'period': [],
+    'commencing_study_period': ['commencing_study_period'],
+    'owning_faculty': ['owning_faculty'],
+}
+ROLLUP_COLUMNS = [DIMENSIONS[column][2] for column in ['period', 'commencing_study_period', 'owning_faculty']]
+
+
+def code_sql(column: str) -> str:
+    """ name -> id of a dimension; a name entered twice is coded by its lowest id """
+    table, name, _ = DIMENSIONS[column]
+    return f'(select {name} as name, min(id) as id from {table} group by {name})'
+
+
+def codes_in(column: str, values) -> str:
+    """ predicate on the fact column matching the names, for statements on the facts """
+    table, name, fact = DIMENSIONS[column]
+    if not values:
+        return 'false'
+    names = ', '.join("'" + str(v).replace("'", "''") + "'" for v in values)
+    return f'{fact} in (select id from {table} where {name} in ({names}))'
+
+
+def ensure_sql(source: str, columns: list = None) -> list:
+    """
+    Statements adding the names of the source missing from the reference
+    tables, so that encoding it loses nothing. source is a table or a
+    parenthesised query with the scenario_data columns.
+    """
+    statements = []
+    for column in columns or DIMENSIONS:
+        table, name, _ = DIMENSIONS[column]
+        statements.append(
+            f"""insert into {table} ({name})
+            select distinct t.{column}
+            from {source} as t
+            where t.{column} is not null
+                and not exists (select 1 from {table} as r where r.{name} = t.{column})"""
+        )
+    return statements
+
+
+def values_source(column: str, values: list) -> str:
+    """ a parenthesised query of the values as the column, a source for ensure_sql() """
+    rows = ', '.join("('" + str(v).replace("'", "''") + "')" for v in values)
+    return f'(select column1 as {column} from values {rows})'
+
+
+def encoded_select(source: str, *leading: str, columns: list = None,
+                   measures: tuple = ('course_enrolment_count',)) -> str:
+    """
+    Select of the source with the names of the columns, every dimension by
+    default, replaced by their ids. leading are expressions selected first,
+    such as the scenario id, measures are selected last as they are.
+    """
+    columns = columns or list(DIMENSIONS)
+    joins = '\n'.join(
+        f'left join {code_sql(column)} as {column}_code on {column}_code.name = t.{column}'
+        for column in columns
+    )
+    selects = ', '.join([
+        *leading,
+        *(f'{column}_code.id as {DIMENSIONS[column][2]}' for column in columns),
+        *(f't.{measure}' for measure in measures),
+    ])
+    return f"""select {selects}
+from {source} as t
+{joins}"""
+
+
+def insert_sql(source: str, scenario_id_sql: str = '?') -> str:
+    """ insert of the rows of the source into the scenario scenario_id_sql selects """
+    return f"""insert into {FACT_TABLE} (scenario_id, {', '.join(FACT_COLUMNS)}, course_enrolment_count)
+{encoded_select(source, f'{scenario_id_sql} as scenario_id')}"""
+
+
+def lineage_sql(roots_sql: str) -> str:
+    """ ids of the scenarios roots_sql selects and of every version overlaid on them """
+    return f'select id from scenario start with id in ({roots_sql}) connect by parent_scenario_id = prior id'
+
+
+def rollup_sql(roots_sql: str) -> list:
+    """
+    Statements rebuilding the rollup rows of the scenarios roots_sql selects,
+    and of the versions overlaid on them whose cells resolve through theirs.
+    Every grain is summed in one pass over the resolved cells. Run them after
+    the cells are written, binding the parameters of roots_sql to each.
+    """
+    grains = list(ROLLUP_GRAINS.items())
+    # a grain is told by the dimensions grouped, the period grain groups none
+    grain = 'case' + ''.join(
+        f"\n        when grouping({DIMENSIONS[columns[0]][2]}) = 0 then '{name}'" for name, columns in grains if columns
+    ) + "\n        else 'period'\n    end"
+    sets = ',\n    '.join(
+        '(' + ', '.join(['scenario_id', 'period_id', *(DIMENSIONS[c][2] for c in columns)]) + ')'
+        for _, columns in grains
+    )
+    return [
+        f'delete from {ROLLUP_TABLE} where scenario_id in ({lineage_sql(roots_sql)})',
+        f"""insert into {ROLLUP_TABLE} (scenario_id, grain, {', '.join(ROLLUP_COLUMNS)}, course_enrolment_count, cells)
+select scenario_id,
+    {grain},
+    {', '.join(ROLLUP_COLUMNS)},
+    sum(course_enrolment_count),
+    count(*)
+from {RESOLVED_VIEW}
+where scenario_id in ({lineage_sql(roots_sql)})
+group by grouping sets (
+    {sets}
+)""",
+    ]
+
+
+def lookup(ids, names) -> pd.Series:
+    """ id -> name of a reference table """
+    return pd.Series(np.asarray(names, dtype=object), index=pd.Index(ids).astype('int64'))
+
+
+def load_lookups(session) -> dict:
+    """ scenario_data column -> lookup, every reference table in one query """
+    selects = '\nunion all\n'.join(
+        f"select '{column}' as dimension, id, {name} as name from {table}"
+        for column, (table, name, _) in DIMENSIONS.items()
+    )
+    df = session.sql(selects).to_pandas()
+    return {
+        column: lookup(df.loc[df['DIMENSION'] == column, 'ID'], df.loc[df['DIMENSION'] == column, 'NAME'])
+        for column in DIMENSIONS
+    }
+
+
+def decode_codes(codes, names: pd.Series) -> pd.Categorical:
+    """ categorical of the names of the ids, NaN for a null or unknown id """
+    categories = pd.Index(names.dropna().unique())
+    at = names.index.get_indexer(pd.Index(codes, dtype='float64'))
+    positions = categories.get_indexer(names.to_numpy())
+    return pd.Categorical.from_codes(np.where(at >= 0, positions[at], -1), categories)
+
+
+def decode(df: pd.DataFrame, lookups: dict) -> pd.DataFrame:
+    """ the <FACT COLUMN> id columns of the frame replaced by categorical name columns """
+    df = df.copy()
+    for column, (_, _, fact) in DIMENSIONS.items():
+        if fact.upper() in df.columns:
+            codes = df.pop(fact.upper())
+            df[column.upper()] = decode_codes(codes.to_numpy(dtype='float64'), lookups[column])
+    return df
+
+
+def covers(df: pd.DataFrame, lookups: dict) -> bool:
+    """ whether the lookups know every id of the fact columns of the frame """
+    return all(
+        df[fact.upper()].dropna().isin(lookups[column].index).all()
+        for column, (_, _, fact) in DIMENSIONS.items() if fact.upper() in df.columns
+    )
+
+
+def read_decoded(source, lookups: dict = None, columns: list = None, load=None) -> pd.DataFrame:
+    """
+    The chunks of the source with their fact columns decoded, as one frame.
+    A chunk is decoded into the codes of its names before the next one is
+    converted and only the codes are kept; the frame is built column by
+    column at the end, so the decoded chunks and their concatenation are
+    never held together. load(), when given, gives the lookups when they
+    are not given or miss an id of a chunk; an unknown id decodes to NaN.
+    """
+    parts = {}
+    categories = {}
+    for chunk in streaming.chunks(source):
+        if load is not None and (lookups is None or not covers(chunk, lookups)):
+            lookups = load()
+        for column, (_, _, fact) in DIMENSIONS.items():
+            if fact.upper() not in chunk.columns:
+                continue
+            name = column.upper()
+            decoded = decode_codes(chunk.pop(fact.upper()).to_numpy(dtype='float64'), lookups[column])
+            if name in categories and not decoded.categories.equals(categories[name]):
+                # reloaded lookups, the codes read so far move to their categories
+                moved = decoded.categories.get_indexer(categories[name])
+                parts[name] = [np.where(codes >= 0, moved[codes], -1) for codes in parts[name]]
+            categories[name] = decoded.categories
+            parts.setdefault(name, []).append(decoded.codes)
+        for name in chunk.columns:
+            parts.setdefault(name, []).append(chunk[name].to_numpy())
+    if not parts:
+        return pd.DataFrame(columns=columns or [])
+    # the names after the other columns by default, as decode() leaves them
+    order = columns or [name for name in parts if name not in categories] + [name for name in categories]
+    df = pd.DataFrame(index=pd.RangeIndex(sum(len(values) for values in next(iter(parts.values())))))
+    for name in order:
+        values = np.concatenate(parts.pop(name))
+        df[name] = pd.Categorical.from_codes(values, categories[name]) if name in categories else values
+    return df
+
+
+def on_stale_lookups(listener):
+    """ call listener() whenever read_frame() finds an id its given lookups do not know """
+    if listener not in _stale_listeners:
+        _stale_listeners.append(listener)
+
+
+def read_frame(session, sql: str, params: list = None, lookups: dict = None, columns: list = None) -> pd.DataFrame:
+    """
+    Run a query selecting fact columns and return it decoded, the columns
+    in the given order, read in batches through read_decoded(). The lookups
+    are loaded when not given, or when a name was added since they were;
+    the caches they came from are then told through on_stale_lookups().
+    """
+    def load() -> dict:
+        if lookups is not None:
+            for listener in _stale_listeners:
+                listener()
+        return load_lookups(session)
+
+    return read_decoded(session.sql(sql, params=params or []), lookups, columns, load)
+
+
+def plain(df: pd.DataFrame) -> pd.DataFrame:
+    """ categorical columns back to object, where the values are edited """
+    df = df.copy()
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+    return df
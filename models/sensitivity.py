@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+from models.rule_engine import RuleEngine
+
+SWEEP_GROUPS = ['OWNING_FACULTY', 'FEE_LIABILITY_GROUP']
+SWEEP_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+# parameter sets x cells projected at once, bounds the memory of a sweep
+SWEEP_CHUNK = 4_000_000
+DEFAULT_INCREASE = 'Default Annual Increase'
+
+
+def parameter_grid(rules: list, default_increase: float, values: list, swept: int = -1) -> np.ndarray:
+    """
+    Parameter sets varying one rate over the given values, every other rate
+    as given. swept is the index of the rule, -1 the default increase.
+    Returns a (values x 1 + rules) matrix, see RuleEngine.rate_values.
+    A rule without an increase_by sets no rate, so it cannot be swept.
+    """
+    if swept >= 0 and rules[swept].get('increase_by') is None:
+        name = rules[swept].get('rule_name', swept)
+        raise ValueError(f'rule {name!r} has no increase_by, varying it changes nothing')
+    parameters = np.tile(RuleEngine.rate_values(rules, default_increase), (len(values), 1))
+    parameters[:, swept + 1] = values
+    return parameters
+
+
+def parameter_sample(rules: list, default_increase: float, low: float, high: float, size: int,
+                     swept: int = -1, seed: int = None) -> np.ndarray:
+    """ Monte Carlo parameter sets, the swept rate drawn uniformly from [low, high] """
+    values = np.random.default_rng(seed).uniform(low, high, int(size))
+    return parameter_grid(rules, default_increase, values, swept)
+
+
+class Sweep:
+    """
+    Group totals of a projection under many parameter sets. totals has the
+    shape parameter sets x groups x periods; the first period is the base.
+    """
+
+    def __init__(self, parameters: np.ndarray, groups: pd.DataFrame, periods: list, totals: np.ndarray):
+        self.parameters = parameters
+        self.groups = groups
+        self.periods = periods
+        self.totals = totals
+
+    def _frame(self, values: np.ndarray, columns: list) -> pd.DataFrame:
+        # values is groups x periods x columns
+        index = pd.MultiIndex.from_product([range(len(self.groups)), self.periods], names=['GROUP', 'PERIOD'])
+        df = pd.DataFrame(values.reshape(-1, len(columns)), index=index, columns=columns).reset_index()
+        return self.groups.reset_index(drop=True).iloc[df.pop('GROUP')].reset_index(drop=True).join(df)
+
+    def fan(self, quantiles: list = SWEEP_QUANTILES, by_group: bool = True) -> pd.DataFrame:
+        """ quantiles of the totals over the parameter sets, per group and period """
+        totals = self.totals if by_group else self.totals.sum(axis=1, keepdims=True)
+        values = np.quantile(totals, quantiles, axis=0)
+        columns = [f'Q{round(q * 100):02d}' for q in quantiles]
+        if by_group:
+            return self._frame(np.moveaxis(values, 0, -1), columns)
+        return pd.DataFrame({'PERIOD': self.periods, **dict(zip(columns, values[:, 0, :]))})
+
+    def distribution(self, period: str = None) -> pd.DataFrame:
+        """ mean, spread and range of the totals of a period, the last by default, per group """
+        j = self.periods.index(period) if period else -1
+        totals = self.totals[:, :, j]
+        return self.groups.reset_index(drop=True).assign(
+            MEAN=totals.mean(axis=0),
+            STD=totals.std(axis=0),
+            MIN=totals.min(axis=0),
+            MEDIAN=np.median(totals, axis=0),
+            MAX=totals.max(axis=0),
+        )
+
+
+def sweep(base_df: pd.DataFrame, rules: list, periods: list, parameters: np.ndarray,
+          groups: list = SWEEP_GROUPS, base_period: str = None) -> Sweep:
+    """
+    Project the base rows under every parameter set without persisting them.
+
+    Which rule sets the rate of each (row, period) does not depend on the
+    rates, so it is resolved once; each parameter set only gathers its rates
+    through that matrix. The counts are compounded with the same per period
+    ceil as project(), as one array of parameter sets x cells per chunk, and
+    summed per group.
+    """
+    base_df = base_df.reset_index(drop=True)
+    sources = RuleEngine(base_df).sources(rules, periods) + 1
+
+    # rows ordered by group, so a group total is a reduceat over a slice
+    codes, group_index = pd.MultiIndex.from_frame(base_df[groups].astype(object).fillna('')).factorize(sort=True)
+    order = np.argsort(codes, kind='stable')
+    starts = np.searchsorted(codes[order], np.arange(len(group_index)))
+    sources = sources[order]
+    base = base_df['COURSE_ENROLMENT_COUNT'].to_numpy(dtype=float)[order]
+
+    n_sets, n_rows = len(parameters), len(base)
+    totals = np.empty((n_sets, len(group_index), len(periods) + 1))
+    totals[:, :, 0] = np.add.reduceat(base, starts) if n_rows else 0
+    chunk = max(1, SWEEP_CHUNK // max(n_rows, 1))
+    for first in range(0, n_sets, chunk):
+        values = parameters[first:first + chunk]
+        current = np.broadcast_to(base, (len(values), n_rows))
+        for j in range(len(periods)):
+            current = np.ceil(current * (1 + values[:, sources[:, j]]))
+            totals[first:first + chunk, :, j + 1] = np.add.reduceat(current, starts, axis=1) if n_rows else 0
+
+    groups_df = group_index.to_frame(index=False, name=groups)
+    return Sweep(parameters, groups_df, [base_period or 'Base', *periods], totals)
@@ -1,26 +1,18 @@
 import streamlit as st
-from snowflake.snowpark.context import get_active_session
-from snowflake.snowpark import Session
 import json
 from datetime import datetime
 from snowflake.snowpark.functions import col, sql_expr, sum
+from helpers.refdata import RefData
+from helpers.transaction import transaction
+from helpers.utils import Utils
+from models.rule_coverage import RuleCoverage
+from models.rule_engine import COMMENCING_STUDY_PERIODS, RULE_PERIODS, RULE_VERSION
 
 
-@st.cache_resource
-def create_session():
-    if 'snowflake' in st.secrets:
-        return Session.builder.configs(st.secrets.snowflake).create()
-    else:
-        return get_active_session()
+session = Utils.get_session()
+Utils.begin_page(__file__)
 
-
-if 'session' not in st.session_state:
-    session = create_session()
-    st.session_state['session'] = session
-else:
-    session = st.session_state.session
-
-current_role = session.get_current_role().replace('"', '')
+current_role = Utils.get_session_role()
 
 with st.sidebar:
     rule_option = st.radio('## Options', options=[
@@ -29,7 +21,7 @@ with st.sidebar:
     ])
     st.session_state['rule_option'] = rule_option
     st.info('The Reference Data is readonly. Only Admin can edit it.', icon='ℹ️')
-    st.warning(f"Login Role **{current_role}**")
+    Utils.show_login_role()
 
 
 st.title(':triangular_ruler: Rule Settings')
@@ -56,84 +48,69 @@ if 'rule_option' in st.session_state:
         )
         if option_rule_mgmt == 'Create a New Rule':
 
-            period_name_list = [
-                '2025', '2026', '2027', '2028', '2029'
-            ]
-            course_level_name_df = session.table('ref_course_level')
-            owning_faculty_df = session.table('ref_owning_faculty')
-            commencing_study_period_list = [
-                'Session 1',
-                'Session 2',
-                'Session 3',
-                'Term 1',
-                'Term 2',
-                'Term 3',
-                'Term 4',
-                'Term 5',
-                'Term 6'
-            ]
-            fee_liability_group_df = session.table('ref_fee_liability_group')
-            course_df = session.table('ref_course')
-            course_faculty_df = course_df.join(
-                owning_faculty_df,
-                (course_df['OWNING_FACULTY_ID'] == owning_faculty_df['ID'])
-            ).select(["COURSE_NAME", "FACULTY_NAME"])
+            period_name_list = RULE_PERIODS
+            # cached reference data, no warehouse queries while the rule is being built
+            course_level_name_df = RefData.table('ref_course_level')
+            owning_faculty_df = RefData.table('ref_owning_faculty')
+            commencing_study_period_list = COMMENCING_STUDY_PERIODS
+            fee_liability_group_df = RefData.table('ref_fee_liability_group')
+            course_faculty_df = RefData.course_faculty()
 
             if current_role in ['ACCOUNTADMIN', 'G1_ADMIN']:
                 st.warning("You can create and modify **Scenario Rules** as Admin")
-                course_level_name_df_pd = course_level_name_df.to_pandas()
-                owning_faculty_df_pd = owning_faculty_df.to_pandas()
-                fee_liability_group_df_pd = fee_liability_group_df.to_pandas()
-                course_faculty_df_pd = course_faculty_df.to_pandas()
+                course_level_name_df_pd = course_level_name_df
+                owning_faculty_df_pd = owning_faculty_df
+                fee_liability_group_df_pd = fee_liability_group_df
+                course_faculty_df_pd = course_faculty_df
             elif current_role == 'G1_RECRUITMENT_INTERNATIONAL':
                 st.warning("You can create and modify **Scenario Rules** for **International Estimates** changes.")
-                course_level_name_df_pd = course_level_name_df.to_pandas()
-                owning_faculty_df_pd = owning_faculty_df.to_pandas()
-                fee_liability_group_df_pd = fee_liability_group_df.filter(
-                    col("FEE_LIABILITY_GROUP_TYPE") == 'International'
-                ).to_pandas()
-                course_faculty_df_pd = course_faculty_df.to_pandas()
+                course_level_name_df_pd = course_level_name_df
+                owning_faculty_df_pd = owning_faculty_df
+                fee_liability_group_df_pd = fee_liability_group_df[
+                    fee_liability_group_df["FEE_LIABILITY_GROUP_TYPE"] == 'International'
+                ]
+                course_faculty_df_pd = course_faculty_df
             elif current_role == 'G1_RECRUITMENT_DOMESTIC':
                 st.warning("You can create and modify **Scenario Rules** for **Domestic Estimates** changes.")
-                course_level_name_df_pd = course_level_name_df.to_pandas()
-                owning_faculty_df_pd = owning_faculty_df.to_pandas()
-                fee_liability_group_df_pd = fee_liability_group_df.filter(
-                    col("FEE_LIABILITY_GROUP_TYPE") == 'Domestic'
-                ).to_pandas()
-                course_faculty_df_pd = course_faculty_df.to_pandas()
+                course_level_name_df_pd = course_level_name_df
+                owning_faculty_df_pd = owning_faculty_df
+                fee_liability_group_df_pd = fee_liability_group_df[
+                    fee_liability_group_df["FEE_LIABILITY_GROUP_TYPE"] == 'Domestic'
+                ]
+                course_faculty_df_pd = course_faculty_df
             elif current_role == 'G1_FACULTY_SCI':
                 st.warning("You can create and modify **Scenario Rules** for **Faculty of Science and Engineering**.")
-                course_level_name_df_pd = course_level_name_df.to_pandas()
-                owning_faculty_df_pd = owning_faculty_df.filter(
-                    col('FACULTY_NAME') == 'Faculty of Science and Engineering'
-                ).to_pandas()
-                fee_liability_group_df_pd = fee_liability_group_df.to_pandas()
-                course_faculty_df_pd = course_faculty_df.to_pandas()
+                course_level_name_df_pd = course_level_name_df
+                owning_faculty_df_pd = owning_faculty_df[
+                    owning_faculty_df['FACULTY_NAME'] == 'Faculty of Science and Engineering'
+                ]
+                fee_liability_group_df_pd = fee_liability_group_df
+                course_faculty_df_pd = course_faculty_df
             elif current_role == 'G1_FACULTY_ARTS':
                 st.warning("You can create and modify **Scenario Rules** for **Faculty of Arts**.")
-                course_level_name_df_pd = course_level_name_df.to_pandas()
-                owning_faculty_df_pd = owning_faculty_df.filter(
-                    col('FACULTY_NAME') == 'Faculty of Arts'
-                ).to_pandas()
-                fee_liability_group_df_pd = fee_liability_group_df.to_pandas()
-                course_faculty_df_pd = course_faculty_df.to_pandas()
+                course_level_name_df_pd = course_level_name_df
+                owning_faculty_df_pd = owning_faculty_df[
+                    owning_faculty_df['FACULTY_NAME'] == 'Faculty of Arts'
+                ]
+                fee_liability_group_df_pd = fee_liability_group_df
+                course_faculty_df_pd = course_faculty_df
             elif current_role == 'G1_FACULTY_MQBS':
                 st.warning("You can create and modify **Scenario Rules** for **Macquarie Business School**.")
-                course_level_name_df_pd = course_level_name_df.to_pandas()
-                owning_faculty_df_pd = owning_faculty_df.filter(
-                    col('FACULTY_NAME') == 'Macquarie Business School'
-                ).to_pandas()
-                fee_liability_group_df_pd = fee_liability_group_df.to_pandas()
-                course_faculty_df_pd = course_faculty_df.to_pandas()
+                course_level_name_df_pd = course_level_name_df
+                owning_faculty_df_pd = owning_faculty_df[
+                    owning_faculty_df['FACULTY_NAME'] == 'Macquarie Business School'
+                ]
+                fee_liability_group_df_pd = fee_liability_group_df
+                course_faculty_df_pd = course_faculty_df
             elif current_role == 'G1_FACULTY_FMHHS':
                 st.warning("You can create and modify **Scenario Rules** for "
                            "**Faculty of Medicine, Health and Human Sciences**.")
-                course_level_name_df_pd = course_level_name_df.to_pandas()
-                owning_faculty_df_pd = owning_faculty_df.filter(
-                    col('FACULTY_NAME') == 'Faculty of Medicine, Health and Human Sciences'
-                ).to_pandas()
-                fee_liability_group_df_pd = fee_liability_group_df.to_pandas()
-                course_faculty_df_pd = course_faculty_df.to_pandas()
+                course_level_name_df_pd = course_level_name_df
+                owning_faculty_df_pd = owning_faculty_df[
+                    owning_faculty_df['FACULTY_NAME'] == 'Faculty of Medicine, Health and Human Sciences'
+                ]
+                fee_liability_group_df_pd = fee_liability_group_df
+                course_faculty_df_pd = course_faculty_df
             else:
                 st.error("You don't have permission to access this page.")
 
@@ -161,70 +138,76 @@ if 'rule_option' in st.session_state:
                 value="0.03"
             )
 
-            if option_period:
-                period_name_text = '; '.join(option_period)
-                period_name_json = option_period
-            else:
-                period_name_text = '; '.join(period_name_list)
-                period_name_json = period_name_list
-
-            if option_owning_faculty:
-                owning_faculty_text = '; '.join(option_owning_faculty)
-                owning_faculty_json = option_owning_faculty
-            else:
-                owning_faculty_text = '; '.join(sorted(owning_faculty_df_pd['FACULTY_NAME']))
-                owning_faculty_json = sorted(owning_faculty_df_pd['FACULTY_NAME'])
-
-            if option_fee_liability_group:
-                fee_liability_text = '; '.join(option_fee_liability_group)
-                fee_liability_json = option_fee_liability_group
-            else:
-                fee_liability_text = '; '.join(sorted(fee_liability_group_df_pd['FEE_LIABILITY_GROUP']))
-                fee_liability_json = sorted(fee_liability_group_df_pd['FEE_LIABILITY_GROUP'])
-
-            if option_course_level:
-                course_level_text = '; '.join(option_course_level)
-                course_level_json = option_course_level
-            else:
-                course_level_text = '; '.join(sorted(course_level_name_df_pd['COURSE_LEVEL_NAME']))
-                course_level_json = sorted(course_level_name_df_pd['COURSE_LEVEL_NAME'])
-
-            if option_commencing_study_period:
-                commencing_study_period_text = '; '.join(option_commencing_study_period)
-                commencing_study_period_json = option_commencing_study_period
-            else:
-                commencing_study_period_text = '; '.join(commencing_study_period_list)
-                commencing_study_period_json = commencing_study_period_list
+            # an unselected dimension is left out of the rule and matches every value,
+            # unless the role only sees part of it
+            def dimension(selected: list, allowed: list, values: list) -> tuple:
+                if selected:
+                    return '; '.join(selected), selected
+                if len(allowed) < len(values):
+                    return '; '.join(allowed), allowed
+                return 'All', None
+
+            period_name_text, period_name_json = dimension(option_period, period_name_list, period_name_list)
+            owning_faculty_text, owning_faculty_json = dimension(
+                option_owning_faculty,
+                sorted(owning_faculty_df_pd['FACULTY_NAME']),
+                owning_faculty_df['FACULTY_NAME']
+            )
+            fee_liability_text, fee_liability_json = dimension(
+                option_fee_liability_group,
+                sorted(fee_liability_group_df_pd['FEE_LIABILITY_GROUP']),
+                fee_liability_group_df['FEE_LIABILITY_GROUP']
+            )
+            course_level_text, course_level_json = dimension(
+                option_course_level,
+                sorted(course_level_name_df_pd['COURSE_LEVEL_NAME']),
+                course_level_name_df['COURSE_LEVEL_NAME']
+            )
+            commencing_study_period_text, commencing_study_period_json = dimension(
+                option_commencing_study_period, commencing_study_period_list, commencing_study_period_list
+            )
 
             if option_course:
                 course_text = '; '.join(option_course)
                 course_json = option_course
             else:
+                # the owning faculties already select the courses, including the ones added later
                 course_text = f'All courses owned by select faculties ({owning_faculty_text})'
-                if option_owning_faculty:
-                    course_json = sorted(
-                        course_faculty_df_pd[course_faculty_df_pd['FACULTY_NAME'].isin(
-                            st.session_state.option_owning_faculty)].COURSE_NAME
-                    )
-                else:
-                    course_json = sorted(course_faculty_df_pd['COURSE_NAME'])
+                course_json = None
             rule_name = st.text_input("Estimate Rule Name", value="")
 
-            # TODO generate json content for the new rule
-            # json generation
             rule_dict = {
+                'version': RULE_VERSION,
                 'rule_name': rule_name,
                 'increase_by': float(input_increase_by),
-                'periods': period_name_json,
-                'commencing_study_periods': commencing_study_period_json,
-                'owning_faculties': owning_faculty_json,
-                'fee_liability_groups': fee_liability_json,
-                'course_level_names': course_level_json,
-                'courses': course_json,
             }
+            for key, values in [
+                ('periods', period_name_json),
+                ('commencing_study_periods', commencing_study_period_json),
+                ('owning_faculties', owning_faculty_json),
+                ('fee_liability_groups', fee_liability_json),
+                ('course_level_names', course_level_json),
+                ('courses', course_json),
+            ]:
+                if values is not None:
+                    rule_dict[key] = values
             with st.expander('Rule Data'):
                 st.write(rule_dict)
 
+            # cells the rule would touch, from the coverage index of the saved rules; loading the
+            # index reads the cells of a scenario, so only on request
+            if st.checkbox('Check the cells the rule matches', key='rule_coverage_check'):
+                coverage = RuleCoverage.index()
+                st.info(
+                    f"The rule matches **{coverage.affected(rule_dict):,}** of {coverage.size:,} "
+                    f"course cells x periods of the latest final scenario",
+                    icon='ℹ️'
+                )
+                overlaps = coverage.overlaps(rule_dict)
+                if overlaps.any():
+                    with st.expander('Overlapping Rules'):
+                        st.dataframe(overlaps[overlaps > 0].sort_values(ascending=False))
+
             estimate_rule_text = (
                 f"**New Rule** {rule_name}\n\n"
                 f"Increase by {round(float(input_increase_by)*100,4)}% , applying on \n\n"
@@ -242,11 +225,13 @@ if 'rule_option' in st.session_state:
             submit = st.button("Create New Rule")
             if submit:
                 try:
-                    session.sql(f"""insert into rule (rule_name, description, extra_comment, rule_content, rule_owner)
-                    values
-                    ('{rule_name}-{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}', '{description}', '{extra_comment}', 
-                    '{json.dumps(rule_dict).replace("'", "''")}', '{current_role}' )
-                    """).collect()
+                    with Utils.query_tag('save_rule'), transaction(session):
+                        session.sql(f"""insert into rule (rule_name, description, extra_comment, rule_content, rule_owner)
+                        values
+                        ('{rule_name}-{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}', '{description}', '{extra_comment}', 
+                        '{json.dumps(rule_dict).replace("'", "''")}', '{current_role}' )
+                        """).collect()
+                    RuleCoverage.invalidate()
                     st.success(f"""New Rule **{rule_name}-{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}** is saved""")
                     # TODO reset values in the form
                 except Exception as e:
@@ -255,4 +240,12 @@ if 'rule_option' in st.session_state:
         elif option_rule_mgmt == 'List Rules':
             st.dataframe(session.table('rule'))
 
+            st.subheader('Rule Coverage')
+            st.caption('Course cells x periods of the latest final scenario each rule matches, '
+                       'and the cells every pair of rules both match')
+            coverage = RuleCoverage.index()
+            st.dataframe(coverage.summary())
+            with st.expander('Pairwise Overlap'):
+                st.dataframe(coverage.overlap())
+
 
@@ -1,36 +1,130 @@
 from datetime import datetime
-import itertools
 import json
 import time
 
 import streamlit as st
-from snowflake.snowpark.context import get_active_session
-from snowflake.snowpark import Session
 from snowflake.snowpark.functions import col, sql_expr, sum
 import numpy as np
 import pandas as pd
 import altair as alt
 import warnings
-from helpers.utils import Utils
-
-from models.Scenario import Scenario
-
-
-@st.cache_resource
-def create_session():
-    if 'snowflake' in st.secrets:
-        return Session.builder.configs(st.secrets.snowflake).create()
-    else:
-        return get_active_session()
+from helpers import streaming
+from helpers.jobs import Jobs
+from helpers.refdata import RefData
+from helpers.transaction import transaction
+from helpers.instrumentation import section
+from helpers.utils import Utils, can_open_session, tagged
+
+from models.Scenario import Scenario, stage_changes
+from models.compare import Compare
+from models.rule_coverage import RuleCoverage
+from models.scenario_store import plain
+from models.estimate import BASE_PERIOD, ROUNDS, calibrate, generate_in_client, generate_in_warehouse, projection_periods
+from models.sensitivity import DEFAULT_INCREASE, parameter_grid, parameter_sample, sweep
+
+
+def rule_coverage(base_scenario: str, rule_names: list):
+    # cells each selected rule matches and how many of them a later rule overrides
+    coverage = RuleCoverage.index(base_scenario)
+    rule_names = [name for name in rule_names if name in coverage.names]
+    if not rule_names:
+        return
+    coverage_df = coverage.overridden(rule_names)
+    shadowed = coverage_df[(coverage_df['AFFECTED'] > 0) & (coverage_df['EFFECTIVE'] == 0)]['RULE_NAME'].tolist()
+    if shadowed:
+        st.warning(f"Later rules override every cell of: {', '.join(shadowed)}")
+    with st.expander('Rule Coverage'):
+        st.caption(f'Course cells x periods of **{base_scenario}**. '
+                   'OVERRIDDEN cells are also matched by a later rule, which sets their rate.')
+        st.dataframe(coverage_df)
+        if len(rule_names) >= 2:
+            st.dataframe(coverage.overlap(rule_names))
+
+
+def generation_rules(scenario: Scenario):
+    # change a rate of the generated scenario and recompute only the cells it touches
+    params = scenario.params()
+    if params is None:
+        return
+    with st.expander('Generation Rules'):
+        st.caption(f"Generated from **{params['base_scenario']}** and actuals **{params['actual_name']}**. "
+                   'Changing a rate recomputes the cells its rule matches from the first period it applies to.')
+        default_increase = st.number_input(
+            'Default Annual Increase',
+            value=float(params['default_increase']),
+            step=0.005,
+            format='%.3f',
+            key='generation_default_increase_input'
+        )
+        rates_df = pd.DataFrame({
+            'RULE_NAME': [rule.get('rule_name') or f'Rule {i + 1}' for i, rule in enumerate(params['rules'])],
+            'INCREASE_BY': [rule.get('increase_by') for rule in params['rules']],
+        })
+        # Streamlit 1.22 only disables the whole editor, the rule names are put back after editing
+        edited_rates_df = st.experimental_data_editor(rates_df, key='generation_rules_edit_df').assign(
+            RULE_NAME=rates_df['RULE_NAME']
+        )
+        if st.button('Recompute', key='generation_recompute_button'):
+            rules = [
+                {**rule, 'increase_by': None if pd.isna(increase_by) else float(increase_by)}
+                for rule, increase_by in zip(params['rules'], edited_rates_df['INCREASE_BY'])
+            ]
+            with st.spinner('Recomputing'), Utils.query_tag('recompute', scenario_id=int(scenario.id)):
+                written = scenario.recompute(rules=rules, default_increase=default_increase)
+            Compare.invalidate()
+            st.success(f'{written} rows recomputed')
+
+
+def sensitivity_sweep(session, round_name: str, rules: list, rule_names: list, default_increase: float, periods: list):
+    # what-if of one rate over a range, nothing is persisted
+    with st.expander('Sensitivity Sweep'):
+        # a rule without a rate sets none, varying it would change nothing
+        rated = [name for name, rule in zip(rule_names, rules) if rule.get('increase_by') is not None]
+        swept = st.selectbox('Rate to vary', [DEFAULT_INCREASE, *rated], key='sweep_rate_select')
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            low = st.number_input('From', value=default_increase - 0.01, step=0.005, format='%.3f', key='sweep_low_input')
+        with col2:
+            high = st.number_input('To', value=default_increase + 0.01, step=0.005, format='%.3f', key='sweep_high_input')
+        with col3:
+            size = st.number_input('Parameter Sets', min_value=2, max_value=10000, value=1000, key='sweep_size_input')
+        st.radio('Sample', ['Grid', 'Monte Carlo'], horizontal=True, key='sweep_mode_select')
+
+        if st.button('Run Sweep', key='sweep_button'):
+            index = rule_names.index(swept) if swept in rule_names else -1
+            if st.session_state.sweep_mode_select == 'Grid':
+                parameters = parameter_grid(rules, default_increase, np.linspace(low, high, int(size)), index)
+            else:
+                parameters = parameter_sample(rules, default_increase, low, high, int(size), index)
+            with st.spinner('Sweeping'):
+                calibration = calibrate(
+                    session,
+                    st.session_state.cs_actual_name_select,
+                    st.session_state.cs_estimate_scenario_select,
+                    ROUNDS[round_name]['observed_study_periods'],
+                    lookups=RefData.lookups()
+                )
+                with section('rule apply'):
+                    result = sweep(calibration.base_df, rules, periods, parameters, base_period=BASE_PERIOD)
+
+            fan_df = result.fan(by_group=False)
+            fan = alt.Chart(fan_df).encode(x=alt.X('PERIOD:N', title='Period'))
+            st.altair_chart(
+                fan.mark_area(opacity=0.2).encode(y=alt.Y('Q05:Q', title='Enrolments', scale=alt.Scale(zero=False)), y2='Q95:Q')
+                + fan.mark_area(opacity=0.4).encode(y='Q25:Q', y2='Q75:Q')
+                + fan.mark_line(point=True).encode(y='Q50:Q', tooltip=['PERIOD', 'Q05', 'Q25', 'Q50', 'Q75', 'Q95']),
+                use_container_width=True
+            )
+            st.write(f'**{periods[-1]}** totals per faculty and fee liability group over {len(parameters)} parameter sets')
+            st.dataframe(result.distribution())
+            with st.expander('Quantiles per faculty and fee liability group'):
+                st.dataframe(result.fan())
 
 
-if 'session' not in st.session_state:
-    session = create_session()
-    st.session_state['session'] = session
-else:
-    session = st.session_state.session
+session = Utils.get_session()
+Utils.begin_page(__file__)
 
-current_role = session.get_current_role().replace('"', '')
+current_role = Utils.get_session_role()
 
 st.title(':dart: Scenario Management')
 
@@ -45,7 +139,7 @@ with st.sidebar:
         key="scenario_actual_option"
     )
 
-    st.warning(f"Login Role **{current_role}**")
+    Utils.show_login_role()
 
 if st.session_state.scenario_actual_option == 'Actuals':
     st.header('Actuals')
@@ -86,13 +180,16 @@ if st.session_state.scenario_actual_option == 'Actuals':
     ).sum("COURSE_ENROLMENT_COUNT").sort(['OWNING_FACULTY', 'COURSE'])
     with st.expander('Expand to check data'):
         st.dataframe(actual_df_format)
-    # st.download_button(
-    #     f"Download {actual_name_select}.csv",
-    #     data=actual_df.to_pandas().to_csv(index = False).encode('utf-8'),
-    #     file_name=f'{actual_name_select}.csv',
-    #     mime='text/csv',
-    #     help='Click here to download the data as a CSV file'
-    # )
+    if st.checkbox('Prepare CSV download', key='actual_export_checkbox'):
+        with st.spinner('Preparing CSV'), Utils.query_tag('actual_export'):
+            actual_csv = streaming.to_csv(actual_df.filter(col('ACTUAL_NAME') == actual_name_select))
+        st.download_button(
+            f"Download {actual_name_select}.csv",
+            data=actual_csv,
+            file_name=f'{actual_name_select}.csv',
+            mime='text/csv',
+            help='Click here to download the data as a CSV file'
+        )
 
 elif st.session_state.scenario_actual_option == 'Scenario':
     st.header('Scenario Management')
@@ -106,6 +203,12 @@ elif st.session_state.scenario_actual_option == 'Scenario':
         key='scenario_radio'
     )
     st.subheader(st.session_state.scenario_radio)
+    # pick up the generation jobs finished since the last rerun, their
+    # periods and names may be new to the reference tables
+    if any(job.status == 'done' for job in Jobs.collect()):
+        RefData.invalidate()
+        Compare.invalidate()
+    Jobs.show()
     if st.session_state.scenario_radio == 'Create a Scenario':
         # load actuals
         actual_df = session.table('commence_actual')
@@ -195,6 +298,14 @@ elif st.session_state.scenario_actual_option == 'Scenario':
                     value='0.03',
                     key='default_increase_input'
                 )
+                st.number_input(
+                    '## Projection Horizon (years)',
+                    min_value=1,
+                    max_value=20,
+                    value=ROUNDS['March Round']['horizon'],
+                    key='cs_horizon_input'
+                )
+                periods = projection_periods(horizon=st.session_state.cs_horizon_input)
 
                 rule_df = session.table('rule').to_pandas()
                 rule_df = rule_df[rule_df['RULE_OWNER'].isin(allow_rule_owner_list)]
@@ -214,10 +325,11 @@ elif st.session_state.scenario_actual_option == 'Scenario':
                 description_text = f'The 2024 whole year estimation is based on the pro rata calcuation on top of the actual '\
                                    f'**{st.session_state.cs_actual_name_select}** '\
                                    f'enrolments and esitmation plan **{st.session_state.cs_estimate_scenario_select}**. \n'\
-                                   f'The rest 2025-2028 calcuation applies the estimation rules, including default annual increase.' \
+                                   f'The rest {periods[0]}-{periods[-1]} calcuation applies the estimation rules, including default annual increase.' \
                                    f'The select rules are,\n' \
                                    f'{rule_select_text}'
                 st.info(description_text, icon='ℹ️')
+                rule_coverage(st.session_state.cs_estimate_scenario_select, st.session_state.rule_select)
 
                 # fetch rule details
                 # rule_detail_list = rule_df[rule_df['RULE_NAME'].isin(st.session_state.rule_select)]['RULE_CONTENT']
@@ -234,123 +346,50 @@ elif st.session_state.scenario_actual_option == 'Scenario':
                 # apply default rules
                 default_increase_float = float(st.session_state.default_increase_input)
 
+                st.radio(
+                    'Generate in',
+                    ['Warehouse', 'Client'],
+                    horizontal=True,
+                    help='Warehouse runs the whole projection as one statement in Snowflake. '
+                         'Client downloads the base rows and computes the projection in the app.',
+                    key='cs_mode_select'
+                )
+
                 submit = st.button(
                     '## Generate Scenario'
                 )
                 if submit:
-                    try:
-                        # estimate current year based on March Round (Session 1)
-                        # march (session 1) actual
-                        march_actual_df = session.table('commence_actual').filter(
-                            col('ACTUAL_NAME') == st.session_state.cs_actual_name_select
-                        ).select(sum(col('COURSE_ENROLMENT_COUNT')).alias('COURSE_ENROLMENT_COUNT'))
-                        s1_actual = march_actual_df.to_pandas().iloc[0]['COURSE_ENROLMENT_COUNT']
-
-                        st.write(st.session_state.cs_estimate_scenario_select)
-
-                        scenario_data_df = session.table('SCENARIO_DATA')
-
-                        scenario_id = scenario_df.filter(
-                            col('SCENARIO') == st.session_state.cs_estimate_scenario_select
-                        ).select('ID').to_pandas().iloc[0]['ID']
-
-                        # st.write(scenario_id)
-
-                        scenario_data_df_filter = session.table('SCENARIO_DATA').filter(
-                            (col('SCENARIO_ID') == int(scenario_id)) & (col('COMMENCING_STUDY_PERIOD') == 'Session 1') & (col('PERIOD') == '2024')
-                        )
-                        s1_estimate = scenario_data_df_filter.select(
-                            sum('COURSE_ENROLMENT_COUNT').alias('COURSE_ENROLMENT_COUNT')
-                        ).select('COURSE_ENROLMENT_COUNT').to_pandas().iloc[0]['COURSE_ENROLMENT_COUNT']
-                        increase_by = float(s1_actual / s1_estimate)
-                        # st.write(f'increase by {increase_by}')
-
-                        not_s1_estimate_df = session.table('SCENARIO_DATA').filter(
-                            (col('SCENARIO_ID') == int(scenario_id)) & (col('COMMENCING_STUDY_PERIOD') != 'Session 1') & (col('PERIOD') == '2024')
+                    # generation runs as a background job, picked up on the next rerun; on the
+                    # session of the page it would share its transactions, so it runs here then
+                    generate = generate_in_warehouse if st.session_state.cs_mode_select == 'Warehouse' else generate_in_client
+                    background = can_open_session()
+                    with st.spinner('Generating the scenario'):
+                        Jobs.submit(
+                            f'Generate {st.session_state.cs_scenario_name_input}',
+                            tagged(generate, session, operation='generate'),
+                            st.session_state.cs_scenario_name_input,
+                            st.session_state.cs_scenario_notes_input,
+                            st.session_state.cs_actual_name_select,
+                            st.session_state.cs_estimate_scenario_select,
+                            ROUNDS['March Round']['observed_study_periods'],
+                            rule_json_list,
+                            default_increase_float,
+                            periods,
+                            background=background
                         )
-                        not_s1_estimate_df_pd = not_s1_estimate_df.to_pandas()
-                        not_s1_estimate_df_pd['COURSE_ENROLMENT_COUNT'] = np.ceil(not_s1_estimate_df_pd['COURSE_ENROLMENT_COUNT'] * increase_by)
-                        not_s1_estimate_df_pd= not_s1_estimate_df_pd.drop(columns=['ID'])
-                        # st.write(not_s1_estimate_df_pd)
-                        march_actual_df_pd = session.table('commence_actual').filter(
-                            col('ACTUAL_NAME') == st.session_state.cs_actual_name_select
-                        ).to_pandas()
-                        march_actual_df_pd = march_actual_df_pd[['COURSE', 'PERIOD', 'COMMENCING_STUDY_PERIOD', 'OWNING_FACULTY', 'COURSE_LEVEL_NAME', 'FEE_LIABILITY_GROUP', 'COURSE_ENROLMENT_COUNT']]
-                        march_actual_df_pd['SCENARIO_ID'] = int(scenario_id)
-                        march_actual_df_pd = march_actual_df_pd[['SCENARIO_ID', 'COURSE', 'PERIOD', 'COMMENCING_STUDY_PERIOD', 'OWNING_FACULTY', 'COURSE_LEVEL_NAME', 'FEE_LIABILITY_GROUP', 'COURSE_ENROLMENT_COUNT']]
-                        estimate_2024_pd = pd.concat([march_actual_df_pd, not_s1_estimate_df_pd], sort=False)
-
-                        estimate_2024_pd['INCREASE_BY'] = float(st.session_state.default_increase_input)
-                        df = estimate_2024_pd.copy()
-
-                        estimate_all_pd = estimate_2024_pd
-                        for year in ['2025', '2026', '2027', '2028']:
-                            df['PERIOD'] = year
-                            for rule_dict in rule_json_list:
-                                x = {
-                                    'COURSE': rule_dict.get('courses'),
-                                    'PERIOD': rule_dict.get('periods'),
-                                    'COMMENCING_STUDY_PERIOD': rule_dict.get('commencing_study_periods'),
-                                    'OWNING_FACULTY': rule_dict.get('owning_faculties'),
-                                    'COURSE_LEVEL_NAME': rule_dict.get('course_level_names'),
-                                    'FEE_LIABILITY_GROUP': rule_dict.get('fee_liability_groups'),
-                                    'INCREASE_BY': [rule_dict.get('increase_by')],
-                                }
-                                rule_pd = pd.DataFrame(list(itertools.product(*x.values())), columns=x.keys())
-                                df = pd.merge(
-                                    df, rule_pd,
-                                    how="left",
-                                    on=['COURSE', 'PERIOD', 'COMMENCING_STUDY_PERIOD', 'OWNING_FACULTY', 'COURSE_LEVEL_NAME', 'FEE_LIABILITY_GROUP'],
-                                    suffixes=('_OLD', '')
-                                )
-                                # st.write(df)
-                                df['INCREASE_BY'].fillna(df['INCREASE_BY_OLD'], inplace=True)
-
-                                df.drop(columns=['INCREASE_BY_OLD'], inplace=True)
-
-                            df['COURSE_ENROLMENT_COUNT'] = np.ceil(
-                                df['COURSE_ENROLMENT_COUNT'] * (1 + df['INCREASE_BY']))
-                            estimate_all_pd = pd.concat([estimate_all_pd, df], sort=False)
-                        # st.dataframe(estimate_all_pd)
-                        # st.write(estimate_all_pd.shape)
-                        session.write_pandas(estimate_all_pd, 'tmp_estimate', quote_identifiers=False, auto_create_table=True, overwrite=True, create_temp_table=True)
-
-                        insert_scenario_sql = \
-                            f"""insert into scenario (scenario_name, version_name, notes)
-                                                    values(
-                                                    '{st.session_state.cs_scenario_name_input}',
-                                                    'init',
-                                                    '{st.session_state.cs_scenario_notes_input}'
-                                                    )"""
-                        session.sql(insert_scenario_sql).collect()
-
-                        insert_scenario_data_sql = f"""insert into scenario_data (scenario_id, 
-                                                                                    course,
-                                                                                    period,
-                                                                                    commencing_study_period,
-                                                                                    owning_faculty,
-                                                                                    course_level_name,
-                                                                                    fee_liability_group,
-                                                                                    course_enrolment_count)
-                                                    select s.id as scenario_id,
-                                                            t.course,
-                                                            t.period,
-                                                            t.commencing_study_period,
-                                                            t.owning_faculty,
-                                                            t.course_level_name,
-                                                            t.fee_liability_group,
-                                                            t.course_enrolment_count
-                                                        from scenario s
-                                                        inner join tmp_estimate as t
-                                                        where s.scenario_name='{st.session_state.cs_scenario_name_input}' 
-                                                            and version_name='init'
-                                                    """
-                        session.sql(insert_scenario_data_sql).collect()
-
-                        st.success(f'Scenario **{st.session_state.cs_scenario_name_input}** is saved in Snowflake')
-                    except Exception as e:
-                        st.error('Failed to save')
-                        st.error(e)
+                    if not background:
+                        st.experimental_rerun()
+                    st.info('Generation is queued. Its progress is shown under **Jobs** on the next refresh', icon='ℹ️')
+
+                with Utils.query_tag('sensitivity_sweep'):
+                    sensitivity_sweep(
+                        session,
+                        'March Round',
+                        rule_json_list,
+                        st.session_state.rule_select,
+                        default_increase_float,
+                        periods
+                    )
             elif st.session_state.cs_round_select == 'July Round':
                 st.info('Create scenario based on the selected Actuals. '
                         'Set targets for 2025 and set the outlook for 2026-2029.\n'
@@ -404,6 +443,14 @@ elif st.session_state.scenario_actual_option == 'Scenario':
                     value='0.03',
                     key='default_increase_input'
                 )
+                st.number_input(
+                    '## Projection Horizon (years)',
+                    min_value=1,
+                    max_value=20,
+                    value=ROUNDS['July Round']['horizon'],
+                    key='cs_horizon_input'
+                )
+                periods = projection_periods(horizon=st.session_state.cs_horizon_input)
 
                 rule_df = session.table('rule').to_pandas()
                 rule_df = rule_df[rule_df['RULE_OWNER'].isin(allow_rule_owner_list)]
@@ -423,10 +470,11 @@ elif st.session_state.scenario_actual_option == 'Scenario':
                 description_text = f'The 2024 whole year estimation is based on the pro rata calcuation on top of the actual ' \
                                    f'**{st.session_state.cs_actual_name_select}** ' \
                                    f'enrolments and esitmation plan **{st.session_state.cs_estimate_scenario_select}**. \n' \
-                                   f'The rest 2025-2029 calcuation applies the estimation rules, including default annual increase.' \
+                                   f'The rest {periods[0]}-{periods[-1]} calcuation applies the estimation rules, including default annual increase.' \
                                    f'The select rules are,\n' \
                                    f'{rule_select_text}'
                 st.info(description_text, icon='ℹ️')
+                rule_coverage(st.session_state.cs_estimate_scenario_select, st.session_state.rule_select)
 
                 # fetch rule details
                 # rule_detail_list = rule_df[rule_df['RULE_NAME'].isin(st.session_state.rule_select)]['RULE_CONTENT']
@@ -443,132 +491,50 @@ elif st.session_state.scenario_actual_option == 'Scenario':
                 # apply default rules
                 default_increase_float = float(st.session_state.default_increase_input)
 
+                st.radio(
+                    'Generate in',
+                    ['Warehouse', 'Client'],
+                    horizontal=True,
+                    help='Warehouse runs the whole projection as one statement in Snowflake. '
+                         'Client downloads the base rows and computes the projection in the app.',
+                    key='cs_mode_select'
+                )
+
                 submit = st.button(
                     '## Generate Scenario'
                 )
                 if submit:
-                    try:
-                        # estimate current year based on July Round (Session 2)
-                        # July (session 1 + session 2) actual
-                        july_actual_df = session.table('commence_actual').filter(
-                            col('ACTUAL_NAME') == st.session_state.cs_actual_name_select
-                        ).select(sum(col('COURSE_ENROLMENT_COUNT')).alias('COURSE_ENROLMENT_COUNT'))
-                        s1_s2_actual = july_actual_df.to_pandas().iloc[0]['COURSE_ENROLMENT_COUNT']
-
-                        st.write(st.session_state.cs_estimate_scenario_select)
-
-                        scenario_data_df = session.table('SCENARIO_DATA')
-
-                        scenario_id = scenario_df.filter(
-                            col('SCENARIO') == st.session_state.cs_estimate_scenario_select
-                        ).select('ID').to_pandas().iloc[0]['ID']
-
-                        # st.write(scenario_id)
-
-                        scenario_data_df_filter = session.table('SCENARIO_DATA').filter(
-                            (col('SCENARIO_ID') == int(scenario_id)) & (
-                                    (col('COMMENCING_STUDY_PERIOD') == 'Session 1') | (col('COMMENCING_STUDY_PERIOD') == 'Session 2') ) & (col('PERIOD') == '2024')
-                        )
-                        s1_s2_estimate = scenario_data_df_filter.select(
-                            sum('COURSE_ENROLMENT_COUNT').alias('COURSE_ENROLMENT_COUNT')
-                        ).select('COURSE_ENROLMENT_COUNT').to_pandas().iloc[0]['COURSE_ENROLMENT_COUNT']
-                        increase_by = float(s1_s2_actual / s1_s2_estimate)
-                        # st.write(f'increase by {increase_by}')
-
-                        not_s1_s2_estimate_df = session.table('SCENARIO_DATA').filter(
-                            (col('SCENARIO_ID') == int(scenario_id)) & (
-                                        col('COMMENCING_STUDY_PERIOD') != 'Session 1') & (col('COMMENCING_STUDY_PERIOD') != 'Session 2') & (col('PERIOD') == '2024')
+                    # generation runs as a background job, picked up on the next rerun; on the
+                    # session of the page it would share its transactions, so it runs here then
+                    generate = generate_in_warehouse if st.session_state.cs_mode_select == 'Warehouse' else generate_in_client
+                    background = can_open_session()
+                    with st.spinner('Generating the scenario'):
+                        Jobs.submit(
+                            f'Generate {st.session_state.cs_scenario_name_input}',
+                            tagged(generate, session, operation='generate'),
+                            st.session_state.cs_scenario_name_input,
+                            st.session_state.cs_scenario_notes_input,
+                            st.session_state.cs_actual_name_select,
+                            st.session_state.cs_estimate_scenario_select,
+                            ROUNDS['July Round']['observed_study_periods'],
+                            rule_json_list,
+                            default_increase_float,
+                            periods,
+                            background=background
                         )
-                        not_s1_s2_estimate_df_pd = not_s1_s2_estimate_df.to_pandas()
-                        not_s1_s2_estimate_df_pd['COURSE_ENROLMENT_COUNT'] = np.ceil(
-                            not_s1_s2_estimate_df_pd['COURSE_ENROLMENT_COUNT'] * increase_by)
-                        not_s1_s2_estimate_df_pd = not_s1_s2_estimate_df_pd.drop(columns=['ID'])
-                        # st.write(not_s1_s2_estimate_df_pd)
-                        july_actual_df_pd = session.table('commence_actual').filter(
-                            col('ACTUAL_NAME') == st.session_state.cs_actual_name_select
-                        ).to_pandas()
-                        july_actual_df_pd = july_actual_df_pd[
-                            ['COURSE', 'PERIOD', 'COMMENCING_STUDY_PERIOD', 'OWNING_FACULTY', 'COURSE_LEVEL_NAME',
-                             'FEE_LIABILITY_GROUP', 'COURSE_ENROLMENT_COUNT']]
-                        july_actual_df_pd['SCENARIO_ID'] = int(scenario_id)
-                        july_actual_df_pd = july_actual_df_pd[
-                            ['SCENARIO_ID', 'COURSE', 'PERIOD', 'COMMENCING_STUDY_PERIOD', 'OWNING_FACULTY',
-                             'COURSE_LEVEL_NAME', 'FEE_LIABILITY_GROUP', 'COURSE_ENROLMENT_COUNT']]
-                        estimate_2024_pd = pd.concat([july_actual_df_pd, not_s1_s2_estimate_df_pd], sort=False)
-
-                        estimate_2024_pd['INCREASE_BY'] = float(st.session_state.default_increase_input)
-                        df = estimate_2024_pd.copy()
-
-                        estimate_all_pd = estimate_2024_pd
-                        for year in ['2025', '2026', '2027', '2028', '2029']:
-                            df['PERIOD'] = year
-                            for rule_dict in rule_json_list:
-                                x = {
-                                    'COURSE': rule_dict.get('courses'),
-                                    'PERIOD': rule_dict.get('periods'),
-                                    'COMMENCING_STUDY_PERIOD': rule_dict.get('commencing_study_periods'),
-                                    'OWNING_FACULTY': rule_dict.get('owning_faculties'),
-                                    'COURSE_LEVEL_NAME': rule_dict.get('course_level_names'),
-                                    'FEE_LIABILITY_GROUP': rule_dict.get('fee_liability_groups'),
-                                    'INCREASE_BY': [rule_dict.get('increase_by')],
-                                }
-                                rule_pd = pd.DataFrame(list(itertools.product(*x.values())), columns=x.keys())
-                                df = pd.merge(
-                                    df, rule_pd,
-                                    how="left",
-                                    on=['COURSE', 'PERIOD', 'COMMENCING_STUDY_PERIOD', 'OWNING_FACULTY',
-                                        'COURSE_LEVEL_NAME', 'FEE_LIABILITY_GROUP'],
-                                    suffixes=('_OLD', '')
-                                )
-                                # st.write(df)
-                                df['INCREASE_BY'].fillna(df['INCREASE_BY_OLD'], inplace=True)
-
-                                df.drop(columns=['INCREASE_BY_OLD'], inplace=True)
-
-                            df['COURSE_ENROLMENT_COUNT'] = np.ceil(
-                                df['COURSE_ENROLMENT_COUNT'] * (1 + df['INCREASE_BY']))
-                            estimate_all_pd = pd.concat([estimate_all_pd, df], sort=False)
-                        # st.dataframe(estimate_all_pd)
-                        # st.write(estimate_all_pd.shape)
-                        session.write_pandas(estimate_all_pd, 'tmp_estimate', quote_identifiers=False,
-                                             auto_create_table=True, overwrite=True, create_temp_table=True)
-
-                        insert_scenario_sql = \
-                            f"""insert into scenario (scenario_name, version_name, notes)
-                                                                    values(
-                                                                    '{st.session_state.cs_scenario_name_input}',
-                                                                    'init',
-                                                                    '{st.session_state.cs_scenario_notes_input}'
-                                                                    )"""
-                        session.sql(insert_scenario_sql).collect()
-
-                        insert_scenario_data_sql = f"""insert into scenario_data (scenario_id, 
-                                                                                                    course,
-                                                                                                    period,
-                                                                                                    commencing_study_period,
-                                                                                                    owning_faculty,
-                                                                                                    course_level_name,
-                                                                                                    fee_liability_group,
-                                                                                                    course_enrolment_count)
-                                                                    select s.id as scenario_id,
-                                                                            t.course,
-                                                                            t.period,
-                                                                            t.commencing_study_period,
-                                                                            t.owning_faculty,
-                                                                            t.course_level_name,
-                                                                            t.fee_liability_group,
-                                                                            t.course_enrolment_count
-                                                                        from scenario s
-                                                                        inner join tmp_estimate as t
-                                                                        where s.scenario_name='{st.session_state.cs_scenario_name_input}' 
-                                                                            and version_name='init'
-                                                                    """
-                        session.sql(insert_scenario_data_sql).collect()
-
-                        st.success(f'Scenario **{st.session_state.cs_scenario_name_input}** is saved in Snowflake')
-                    except Exception as e:
-                        st.error('Failed to save')
-                        st.error(e)
+                    if not background:
+                        st.experimental_rerun()
+                    st.info('Generation is queued. Its progress is shown under **Jobs** on the next refresh', icon='ℹ️')
+
+                with Utils.query_tag('sensitivity_sweep'):
+                    sensitivity_sweep(
+                        session,
+                        'July Round',
+                        rule_json_list,
+                        st.session_state.rule_select,
+                        default_increase_float,
+                        periods
+                    )
 
         elif st.session_state.create_scenario_select:
             # have drop down to pick a scenario and version
@@ -597,9 +563,9 @@ elif st.session_state.scenario_actual_option == 'Scenario':
                     )
                 scenario_id = scenario_df_pd['ID'].iloc[0]
                 # st.write(scenario_id)
-                scenario_data_df = session.table('scenario_data').filter(
-                    col('SCENARIO_ID') == int(scenario_id)
-                ).to_pandas()
+                with Utils.query_tag('modify_scenario', scenario_id=int(scenario_id)):
+                    scenario_data_df = Scenario.find(int(scenario_id)).frame()
+                generation_rules(Scenario.find(int(scenario_id)))
 
                 # manage security. Admin can access all faculty courses. Faculty can only access faculty ones
                 allow_faculty_list = []
@@ -680,7 +646,8 @@ elif st.session_state.scenario_actual_option == 'Scenario':
                                 st.session_state.modify_scenario_fee_liability_group)]
 
                 if st.session_state.modify_scenario_owning_faculty:
-
+                    # the editor and the change set work on plain values
+                    scenario_data_df_filter = plain(scenario_data_df_filter)
                     edit_df = st.experimental_data_editor(
                         scenario_data_df_filter,
                         num_rows="dynamic",
@@ -704,111 +671,65 @@ elif st.session_state.scenario_actual_option == 'Scenario':
                         value="",
                         key='modify_scenario_notes'
                     )
+                    generated = Scenario.find(int(scenario_id)).params() is not None
+                    st.checkbox(
+                        'Recompute the later periods of the edited cells',
+                        value=generated,
+                        disabled=not generated,
+                        help='Compounds the later periods on the edited counts with the rules the scenario was '
+                             'generated with. Only the edited cells are recomputed.',
+                        key='modify_scenario_recompute'
+                    )
+                    Utils.show_flash()
                     submit_button = st.button("Save Data")
 
                     if submit_button:
-                        st.info('button clicked. Please wait for 5 seconds')
-                        try:
-                            # save modified data to temp table, later merge / update
-                            session.write_pandas(
-                                edit_df,
-                                table_name=f'tmp_modify_scenario',
-                                overwrite=True,
-                                create_temp_table=True,
-                                quote_identifiers=False,
-                                auto_create_table=True,
-                                # table_type='temp'
-                            )
-                            time.sleep(3)
-
-                            if st.session_state.modify_scenario_save_option == 'Save to a New Version':
-
-                                scenario_name = scenario_df_pd['SCENARIO_NAME'].iloc[0]
-                                session.sql(
-                                    f"""insert into scenario (scenario_name, version_name, notes)
-                                                    values(
-                                                    '{scenario_name}',
-                                                    '{st.session_state.modify_scenario_version}',
-                                                    '{st.session_state.modify_scenario_notes}'
-                                                    )"""
-                                ).collect()
-                                session.sql(
-                                    f"""insert into scenario_data (scenario_id, 
-                                                                                    course,
-                                                                                    period,
-                                                                                    commencing_study_period,
-                                                                                    owning_faculty,
-                                                                                    course_level_name,
-                                                                                    fee_liability_group,
-                                                                                    course_enrolment_count)
-                                                    select (select id from scenario 
-                                                        where scenario_name='{scenario_name}'
-                                                        and version_name= '{st.session_state.modify_scenario_version}'
-                                                        ) as scenario_id,
-                                                    sd.course,
-                                                    sd.period,
-                                                    sd.COMMENCING_STUDY_PERIOD,
-                                                    sd.owning_faculty,
-                                                    sd.course_level_name,
-                                                    sd.fee_liability_group,
-                                                    coalesce(t.course_enrolment_count, sd.course_enrolment_count) as course_enrolment_count
-                                                from scenario_data as sd
-                                                left outer join tmp_modify_scenario as t
-                                                    on t.id = sd.id
-                                                where exists(
-                                                    select null
-                                                    from tmp_modify_scenario as t1
-                                                    where t1.scenario_id=sd.scenario_id
-                                                )
-"""
-                                ).collect()
-                                msg = st.success(f"Data is saved to the version ")
-                                time.sleep(3)
-                                msg.empty()
-                            elif st.session_state.modify_scenario_save_option == 'Save to Current Version **{st.session_state.modify_scenario_version}**':
-                                session.sql(
-                                    f"""update scenario_data as s
-                                        set course_enrolment_count=t.course_enrolment_count
-                                        from tmp_modify_scenario as t
-                                        where t.id=s.id"""
-                                ).collect()
-                                session.sql(
-                                    f"""insert into scenario_notes (scenario_id, notes, created_by, created_at)
-                                    values (
-                                    {scenario_id},
-                                    '{st.session_state.modify_scenario_notes}',
-                                    '{current_role}',
-                                    current_timestamp()
+                        saved = False
+                        with Utils.query_tag('save_scenario', scenario_id=int(scenario_id)):
+                            try:
+                                # only the inserted, changed and deleted cells are sent to the warehouse
+                                with st.spinner('Saving changes'), section('write_pandas'):
+                                    staged = stage_changes(scenario_data_df_filter, edit_df)
+
+                                # the later periods are merged with the edits, in one transaction
+                                recompute = staged if st.session_state.modify_scenario_recompute else None
+                                if st.session_state.modify_scenario_save_option == 'Save to a New Version':
+                                    # the new version only stores the edited cells over its parent
+                                    Scenario.create_version(
+                                        int(scenario_id),
+                                        st.session_state.modify_scenario_version,
+                                        st.session_state.modify_scenario_notes,
+                                        merge_changes=not staged.empty,
+                                        recompute=recompute
                                     )
-                                    """
-                                ).collect()
-
-                                msg = st.success("Data is saved to the current version")
-                                time.sleep(3)
-                                msg.empty()
-                        except:
-                            st.warning("Error updating table")
-                        # st.experimental_rerun()
+                                    Compare.invalidate()
+                                    Utils.flash(f"Data is saved to the version {st.session_state.modify_scenario_version}")
+                                    saved = True
+                                elif st.session_state.modify_scenario_save_option == 'Save to Current Version':
+                                    Scenario.find(int(scenario_id)).apply_changes(
+                                        merge_changes=not staged.empty,
+                                        recompute=recompute,
+                                        note=st.session_state.modify_scenario_notes,
+                                        created_by=current_role
+                                    )
+                                    Compare.invalidate()
+                                    Utils.flash("Data is saved to the current version")
+                                    saved = True
+                            except Exception as e:
+                                st.error('Failed to save the changes')
+                                st.error(e)
+                        if saved:
+                            # reload the saved cells into the editor, the message is shown after the rerun
+                            st.experimental_rerun()
 
     elif st.session_state.scenario_radio == 'Compare Scenarios':
         # choose multiple scenario to compare
-        scenario_df = session.sql(
-            """select s.SCENARIO_NAME || ' (' || s.VERSION_NAME || ')' as scenario,
-                    sd.course,
-                    sd.period,
-                    sd.commencing_study_period,
-                    sd.owning_faculty,
-                    sd.course_level_name,
-                    sd.fee_liability_group,
-                    sd.course_enrolment_count
-                from scenario_data as sd
-                inner join scenario as s
-                    on sd.scenario_id=s.id"""
-        ).to_pandas()
+        # option lists only, the selections are pushed down to the warehouse
+        compare_options = Compare.options()
 
         compare_scenario_select = st.multiselect(
             '## Choose Scenarios to compare',
-            options=sorted(scenario_df['SCENARIO'].unique()),
+            options=compare_options['SCENARIO'],
             key='compare_scenario_select'
         )
 
@@ -816,67 +737,50 @@ elif st.session_state.scenario_actual_option == 'Scenario':
         with col1:
             compare_period_select = st.multiselect(
                 '## Choose Period to compare',
-                options=sorted(scenario_df['PERIOD'].unique()),
+                options=compare_options['PERIOD'],
                 key='compare_period_select'
             )
             compare_commencing_study_period_select = st.multiselect(
                 '## Choose Commencing Study Period to compare',
-                options=sorted(scenario_df['COMMENCING_STUDY_PERIOD'].unique()),
+                options=compare_options['COMMENCING_STUDY_PERIOD'],
                 key='compare_commencing_study_period_select'
             )
             compare_owning_faculty_select = st.multiselect(
                 '## Choose Owning Faculty to compare',
-                options=sorted(scenario_df['OWNING_FACULTY'].unique()),
+                options=compare_options['OWNING_FACULTY'],
                 key='compare_owning_faculty_select'
             )
         with col2:
             compare_fee_liability_group_select = st.multiselect(
                 '## Choose Fee Liability Group to compare',
-                options=sorted(scenario_df['FEE_LIABILITY_GROUP'].unique()),
+                options=compare_options['FEE_LIABILITY_GROUP'],
                 key='compare_fee_liability_group_select'
             )
             compare_course_level_select = st.multiselect(
                 '## Choose Course Level to compare',
-                options=sorted(scenario_df['COURSE_LEVEL_NAME'].unique()),
+                options=compare_options['COURSE_LEVEL_NAME'],
                 key='compare_course_level_select'
             )
             compare_course_select = st.multiselect(
                 '## Choose Courses to compare',
-                options=sorted(scenario_df['COURSE'].unique()),
+                options=compare_options['COURSE'],
                 key='compare_course_select'
             )
 
-        scenario_df_filter = scenario_df.copy()
-        scenario_df_filter = scenario_df_filter[
-        scenario_df_filter['SCENARIO'].isin(st.session_state.compare_scenario_select)]
-
-        if st.session_state.compare_period_select:
-            scenario_df_filter = scenario_df_filter[scenario_df_filter['PERIOD'].isin(st.session_state.compare_period_select)]
-        else:
-            scenario_df_filter = scenario_df_filter
-        if st.session_state.compare_commencing_study_period_select:
-            scenario_df_filter = scenario_df_filter[scenario_df_filter['COMMENCING_STUDY_PERIOD'].isin(st.session_state.compare_commencing_study_period_select)]
+        compare_selections = {
+            'SCENARIO': st.session_state.compare_scenario_select,
+            'PERIOD': st.session_state.compare_period_select,
+            'COMMENCING_STUDY_PERIOD': st.session_state.compare_commencing_study_period_select,
+            'OWNING_FACULTY': st.session_state.compare_owning_faculty_select,
+            'FEE_LIABILITY_GROUP': st.session_state.compare_fee_liability_group_select,
+            'COURSE_LEVEL_NAME': st.session_state.compare_course_level_select,
+            'COURSE': st.session_state.compare_course_select,
+        }
+        if st.session_state.compare_scenario_select:
+            with section('compare series'), Utils.query_tag('compare'):
+                scenario_df_sum = Compare.series(compare_selections)
         else:
-            scenario_df_filter = scenario_df_filter
-        if st.session_state.compare_owning_faculty_select:
-            scenario_df_filter = scenario_df_filter[scenario_df_filter['OWNING_FACULTY'].isin(st.session_state.compare_owning_faculty_select)]
-        else:
-            scenario_df_filter = scenario_df_filter
-        if st.session_state.compare_fee_liability_group_select:
-            scenario_df_filter = scenario_df_filter[scenario_df_filter['FEE_LIABILITY_GROUP'].isin(st.session_state.compare_fee_liability_group_select)]
-        else:
-            scenario_df_filter = scenario_df_filter
-        if st.session_state.compare_course_level_select:
-            scenario_df_filter = scenario_df_filter[scenario_df_filter['COURSE_LEVEL_NAME'].isin(st.session_state.compare_course_level_select)]
-        else:
-            scenario_df_filter = scenario_df_filter
-        if st.session_state.compare_course_select:
-            scenario_df_filter = scenario_df_filter[scenario_df_filter['COURSE'].isin(st.session_state.compare_course_select)]
-        else:
-            scenario_df_filter = scenario_df_filter
-
-        scenario_df_sum = scenario_df_filter.groupby(
-            ["SCENARIO", "PERIOD"])["COURSE_ENROLMENT_COUNT"].sum().reset_index()
+            scenario_df_sum = pd.DataFrame(columns=['SCENARIO', 'PERIOD', 'COURSE_ENROLMENT_COUNT'])
 
         scale_range = [0, 100]
         if not scenario_df_sum.empty:
@@ -895,24 +799,42 @@ elif st.session_state.scenario_actual_option == 'Scenario':
 
         st.altair_chart(line_chart, use_container_width=True)
 
-        # st.download_button(
-        #     f"Download Select Data",
-        #     data=scenario_df_filter.to_csv(index=False).encode('utf-8'),
-        #     file_name=f'scenario_data.csv',
-        #     mime='text/csv',
-        #     help='Click here to download the selected data as a CSV file'
-        # )
-        if len(st.session_state.compare_scenario_select) == 2:
-            st.subheader(f'Difference between {st.session_state.compare_scenario_select[0]} and {st.session_state.compare_scenario_select[1]}')
-            df_1 = scenario_df_filter[scenario_df_filter['SCENARIO'] == st.session_state.compare_scenario_select[0]]
-            df_2 = scenario_df_filter[scenario_df_filter['SCENARIO'] == st.session_state.compare_scenario_select[1]]
-            merged_df = pd.merge(
-                df_1,
-                df_2,
-                on=['COURSE', 'PERIOD', 'COMMENCING_STUDY_PERIOD', 'OWNING_FACULTY', 'COURSE_LEVEL_NAME', 'FEE_LIABILITY_GROUP'],
-                suffixes=(' '+st.session_state.compare_scenario_select[0], ' '+st.session_state.compare_scenario_select[1])
-            ).drop(columns=[f'SCENARIO {st.session_state.compare_scenario_select[0]}', f'SCENARIO {st.session_state.compare_scenario_select[1]}'])
-            st.write(merged_df)
+        if st.session_state.compare_scenario_select and st.checkbox(
+                'Prepare CSV download', key='compare_export_checkbox'):
+            with st.spinner('Preparing CSV'), Utils.query_tag('compare_export'):
+                compare_csv = Compare.export(compare_selections)
+            st.download_button(
+                f"Download Select Data",
+                data=compare_csv,
+                file_name=f'scenario_data.csv',
+                mime='text/csv',
+                help='Click here to download the selected data as a CSV file'
+            )
+        if len(st.session_state.compare_scenario_select) >= 2:
+            (col1, col2) = st.columns(2)
+            with col1:
+                st.selectbox(
+                    '## Baseline',
+                    st.session_state.compare_scenario_select,
+                    key='compare_baseline_select'
+                )
+            with col2:
+                st.number_input(
+                    '## Top N largest movers, 0 for all',
+                    min_value=0,
+                    value=100,
+                    step=10,
+                    key='compare_top_n_input'
+                )
+            st.subheader(f'Difference against {st.session_state.compare_baseline_select}')
+            with section('compare diff'), Utils.query_tag('compare'):
+                diff_df = Compare.diff(
+                    compare_selections,
+                    st.session_state.compare_scenario_select,
+                    st.session_state.compare_baseline_select,
+                    st.session_state.compare_top_n_input
+                )
+            st.write(diff_df)
 
 
 elif st.session_state.scenario_actual_option == 'Faculty Approval':
@@ -930,6 +852,18 @@ elif st.session_state.scenario_actual_option == 'Faculty Approval':
 
     role = Utils.get_session_role()
 
+    # totals of the version under review, from the rollup
+    with Utils.query_tag('approval_review', scenario_id=scenario.id):
+        totals_df = Compare.totals(scenario.id, 'owning_faculty')
+    st.altair_chart(
+        alt.Chart(totals_df).mark_bar().encode(
+            x=alt.X('PERIOD:N', title="Period", axis=alt.Axis(labelAngle=-45)),
+            y=alt.Y('COURSE_ENROLMENT_COUNT:Q', title="Course Enrolment Count"),
+            color=alt.Color('OWNING_FACULTY:N', title="Owning Faculty")
+        ),
+        use_container_width=True
+    )
+
     comments_df = session.sql("select * from scenario_notes where scenario_id=? order by CREATED_AT", params=[scenario.id]).to_pandas()
     for index, row in comments_df.iterrows():
         st.info(f"""
@@ -942,13 +876,15 @@ elif st.session_state.scenario_actual_option == 'Faculty Approval':
 
     def add_comment(comment):
         session = Utils.get_session()
-        session.sql(
+        # in a transaction, not inside one a job may have open on the session
+        with transaction(session):
+            session.sql(
 f"""
 insert into scenario_notes (scenario_id, notes, created_by, created_at) values
 (?, ?, ?, current_timestamp)
 """,
-            params=[scenario.id, comment, Utils.get_session_role()]
-        ).collect()
+                params=[scenario.id, comment, Utils.get_session_role()]
+            ).collect()
 
     if (st.button(
             'Add Comment',
@@ -963,7 +899,8 @@ insert into scenario_notes (scenario_id, notes, created_by, created_at) values
             disabled=scenario.has_role_approved()
         )):
         scenario = Scenario.find(scenario.id)
-        scenario.approve()
+        with Utils.query_tag('approve', scenario_id=scenario.id):
+            scenario.approve()
         st.success('Approval Saved.')
         time.sleep(3)
         st.experimental_rerun()
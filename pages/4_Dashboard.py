@@ -1,104 +1,40 @@
 import streamlit as st
-from snowflake.snowpark.context import get_active_session
-from snowflake.snowpark import Session
-from snowflake.snowpark.functions import col, sql_expr, sum
-import pandas as pd
 import altair as alt
 import warnings
+from helpers.instrumentation import section
+from helpers.utils import Utils
+from models.dashboard_cube import SCENARIO_TYPES, DashboardCube
 
 
 warnings.filterwarnings("ignore")
 
+# the cube holds these scenario types only, Final is the actuals
+ESTIMATE_TYPES = [t for t in SCENARIO_TYPES if t != 'Final']
 
-@st.cache_resource
-def create_session():
-    if 'snowflake' in st.secrets:
-        return Session.builder.configs(st.secrets.snowflake).create()
-    else:
-        return get_active_session()
-
-
-if 'session' not in st.session_state:
-    session = create_session()
-    st.session_state['session'] = session
-else:
-    session = st.session_state.session
-
-
-def get_ce():
-    """
-    scenario_type
-
-    Final
-    2023 Budget
-    2023 CD1R
-    2024 Load Plan 1.0
-    2024 Load Plan 2.0
-    """
-    sql_expr_str = """
-    scenario_type in ('Final', '2023 Budget', '2023 CD1R', '2024 Load Plan 1.0', '2024 Load Plan 2.0')
-and (period_name in ('2023', '2024', '2025', '2026', '2027', '2028') or period_name like '%Final' )"""
-    dim_list = [
-        'scenario_type',
-        'period_name',
-        'course_name',
-        'owning_faculty',
-        'commencing_study_period',
-        'course_level_name',
-        'fee_liability_group'
-    ]
-    measure = 'course_enrolment_count'
-
-    ce_df = session.table('DATA_SOURCE.COMMENCING_ESTIMATES.DRAFT_LP_CE_ESTIMATES_2024') \
-        .select([*dim_list, measure]) \
-        .filter(sql_expr(sql_expr_str)) \
-        .group_by(dim_list).agg(sum(col(measure)).alias(measure))
 
-    return ce_df
+session = Utils.get_session()
+Utils.begin_page(__file__)
 
 
-ce_df = get_ce().to_pandas()
-ce_df["COURSE_ENROLMENT_COUNT"] = ce_df["COURSE_ENROLMENT_COUNT"].fillna(0).astype('int')
-
-filtered_df = ce_df.copy()
+# materialized aggregate, only goes back to the warehouse when the source changes
+with section('dashboard cube'):
+    ce_index = DashboardCube.index()
 
 with st.sidebar:
     # course filter on sidebar
-    course_df = pd.DataFrame(sorted(ce_df["COURSE_NAME"].unique()), columns=['COURSE_NAME'])
-    unique_course_name = course_df
-    filter_course_name = st.multiselect("## Course Name", unique_course_name)
-
-    if filter_course_name:
-        filtered_df = filtered_df[filtered_df["COURSE_NAME"].isin(filter_course_name)]
-    else:
-        filtered_df = filtered_df
+    filter_course_name = st.multiselect("## Course Name", ce_index.options("COURSE_NAME"))
 
     # owning_faculty filter on sidebar
-    unique_owning_faculty = sorted(ce_df["OWNING_FACULTY"].unique())
-    filter_owning_faculty = st.multiselect('## Owning Faculty', unique_owning_faculty)
-    if filter_owning_faculty:
-        filtered_df = filtered_df[filtered_df["OWNING_FACULTY"].isin(filter_owning_faculty)]
-    else:
-        filtered_df = filtered_df
+    filter_owning_faculty = st.multiselect('## Owning Faculty', ce_index.options("OWNING_FACULTY"))
 
     # course_level_name filter on sidebar
-    unique_course_level_name = sorted(ce_df["COURSE_LEVEL_NAME"].unique())
-    filter_course_level_name = st.multiselect('## Course Level', unique_course_level_name)
-    if filter_course_level_name:
-        filtered_df = filtered_df[filtered_df["COURSE_LEVEL_NAME"].isin(filter_course_level_name)]
-    else:
-        filtered_df = filtered_df
+    filter_course_level_name = st.multiselect('## Course Level', ce_index.options("COURSE_LEVEL_NAME"))
 
     # fee_liability_group filter on sidebar
-    unique_fee_liability_group = sorted(ce_df["FEE_LIABILITY_GROUP"].unique())
-    filter_fee_liability_group = st.multiselect('## Fee Liability Group', unique_fee_liability_group)
-    if filter_fee_liability_group:
-        filtered_df = filtered_df[filtered_df["FEE_LIABILITY_GROUP"].isin(filter_fee_liability_group)]
-    else:
-        filtered_df = filtered_df
+    filter_fee_liability_group = st.multiselect('## Fee Liability Group', ce_index.options("FEE_LIABILITY_GROUP"))
 
     # scenario_type filter on sidebar
-    unique_scenario_type = ['2023 Budget', '2023 CD1R', '2024 Load Plan 1.0', '2024 Load Plan 2.0', 'Final']
+    unique_scenario_type = [*ESTIMATE_TYPES, 'Final']
     filter_scenario_type = st.multiselect('## Scenario Type', unique_scenario_type, default=unique_scenario_type)
 
     if filter_scenario_type:
@@ -107,13 +43,27 @@ with st.sidebar:
     else:
         filter_scenario_type = unique_scenario_type
 
-    filtered_df = filtered_df[filtered_df["SCENARIO_TYPE"].isin(filter_scenario_type)]
+    # one bitmap AND over all the selections, only the final slice is materialized
+    filtered_df = ce_index.filter({
+        "COURSE_NAME": filter_course_name,
+        "OWNING_FACULTY": filter_owning_faculty,
+        "COURSE_LEVEL_NAME": filter_course_level_name,
+        "FEE_LIABILITY_GROUP": filter_fee_liability_group,
+        "SCENARIO_TYPE": filter_scenario_type,
+    })
 
-    current_role = session.get_current_role().replace('"', '')
-    st.warning(f"Login Role **{current_role}**")
+    Utils.show_login_role()
 
 st.title(":chart_with_upwards_trend: Dashboard")
 
+# the cube is rebuilt under the role owning it, the page only reads it
+refreshed_at = DashboardCube.refreshed_at()
+if refreshed_at is None:
+    st.warning("The dashboard data has not been built yet, run `python -m models.dashboard_cube` as its owner")
+elif DashboardCube.stale():
+    st.info(f"The estimates have changed since the dashboard data was refreshed at {refreshed_at:%Y-%m-%d %H:%M}",
+            icon='ℹ️')
+
 col1, col2 = st.columns(2)
 with col1:
     st.subheader('Actuals')
@@ -123,16 +73,14 @@ with col2:
 actual_ce_df_sum = filtered_df[filtered_df["SCENARIO_TYPE"] == "Final"].groupby("PERIOD_NAME")[
     "COURSE_ENROLMENT_COUNT"].sum().reset_index()
 
-ce_df_sum = filtered_df[filtered_df["SCENARIO_TYPE"].isin(
-    ['2023 Budget', '2023 CD1R', '2024 Load Plan 1.0', '2024 Load Plan 2.0', 'Final'])].groupby(
+ce_df_sum = filtered_df[filtered_df["SCENARIO_TYPE"].isin(SCENARIO_TYPES)].groupby(
     ["SCENARIO_TYPE", "PERIOD_NAME"])["COURSE_ENROLMENT_COUNT"].sum().reset_index()
 
-ce_df_sum_term = filtered_df[filtered_df["SCENARIO_TYPE"].isin(
-    ['2023 Budget', '2023 CD1R', '2024 Load Plan 1.0', '2024 Load Plan 2.0', 'Final'])].groupby(
+ce_df_sum_term = filtered_df[filtered_df["SCENARIO_TYPE"].isin(SCENARIO_TYPES)].groupby(
     ["SCENARIO_TYPE", "PERIOD_NAME", "COMMENCING_STUDY_PERIOD"])["COURSE_ENROLMENT_COUNT"].sum().reset_index()
 
 estimate_ce_df_sum = ce_df_sum[
-    ce_df_sum["SCENARIO_TYPE"].isin(['2023 Budget', '2023 CD1R', '2024 Load Plan 1.0', '2024 Load Plan 2.0'])]
+    ce_df_sum["SCENARIO_TYPE"].isin(ESTIMATE_TYPES)]
 
 scale_range = [0, 100]
 if not ce_df_sum.empty:
@@ -1,30 +1,19 @@
 import streamlit as st
-from snowflake.snowpark.context import get_active_session
-from snowflake.snowpark import Session
 import time
 import warnings
+from helpers.refdata import RefData
+from helpers.utils import Utils
 
 
 warnings.filterwarnings("ignore")
 
 
-@st.cache_resource
-def create_session():
-    if 'snowflake' in st.secrets:
-        return Session.builder.configs(st.secrets.snowflake).create()
-    else:
-        return get_active_session()
-
-
-if 'session' not in st.session_state:
-    session = create_session()
-    st.session_state['session'] = session
-else:
-    session = st.session_state.session
+session = Utils.get_session()
+Utils.begin_page(__file__)
 
 st.title(":books: Reference Data Management")
 
-current_role = session.get_current_role().replace('"', '')
+current_role = Utils.get_session_role()
 
 with st.sidebar:
     ref_option = st.radio('## Choose Reference Data', options=[
@@ -32,11 +21,12 @@ with st.sidebar:
         'Owning Faculty',
         'Period Name',
         'Course Level Name',
-        'Fee Liability Group'
+        'Fee Liability Group',
+        'Commencing Study Period'
     ])
     st.session_state['ref_option'] = ref_option
     st.info('The Reference Data is readonly. Only Admin can edit it.', icon='ℹ️')
-    st.warning(f"Login Role **{current_role}**")
+    Utils.show_login_role()
 
 if 'ref_option' in st.session_state:
     st.subheader(ref_option)
@@ -50,10 +40,12 @@ if 'ref_option' in st.session_state:
         st.session_state['table'] = 'ref_course_level'
     if st.session_state.ref_option == 'Fee Liability Group':
         st.session_state['table'] = 'ref_fee_liability_group'
+    if st.session_state.ref_option == 'Commencing Study Period':
+        st.session_state['table'] = 'ref_commencing_study_period'
 
     if 'table' in st.session_state:
-        df = session.table(st.session_state.table)
         if current_role in ['ACCOUNTADMIN', 'G1_ADMIN']:
+            df = RefData.decoded(st.session_state.table)
             with st.form("data_editor_form"):
                 st.caption("Edit the dataframe below")
 
@@ -62,19 +54,19 @@ if 'ref_option' in st.session_state:
 
             if submit_button:
                 try:
-                    # Note the quote_identifiers argument for case insensitivity
-                    session.write_pandas(
-                        edited,
-                        table_name=f'tmp_{st.session_state.table}',
-                        overwrite=True,
-                        quote_identifiers=False,
-                        table_type='temp'
-                    )
-                    msg = st.success("Table updated")
-                    time.sleep(3)
-                    msg.empty()
-                except:
-                    st.warning("Error updating table")
-                st.experimental_rerun()
+                    with Utils.query_tag('edit_reference_data', table=st.session_state.table):
+                        counts = RefData.apply(st.session_state.table, df, edited)
+                    if any(counts.values()):
+                        msg = st.success(
+                            f"Table updated: {counts['inserted']} inserted, "
+                            f"{counts['updated']} updated, {counts['deleted']} deleted"
+                        )
+                        time.sleep(3)
+                        msg.empty()
+                        st.experimental_rerun()
+                    else:
+                        st.info("No changes to save")
+                except Exception as e:
+                    st.warning(f"Error updating table: {e}")
         else:
-            st.dataframe(df)
\ No newline at end of file
+            st.dataframe(RefData.table(st.session_state.table))
\ No newline at end of file
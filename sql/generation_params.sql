@@ -0,0 +1,6 @@
+use database hackathon;
+use schema group_1;
+
+-- inputs a scenario was generated with, so that edits and rule changes are
+-- recomputed incrementally; run after table_creation.sql
+alter table scenario add column if not exists generation_params varchar;
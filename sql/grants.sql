@@ -1,5 +1,26 @@
--- grants
+-- grants, run after table_creation.sql, star_schema.sql and scenario_rollup.sql
 grant all on all tables in schema hackathon.group_1 to role g1_role;
+grant all on future tables in schema hackathon.group_1 to role g1_role;
+
+-- the star schema written through models/scenario_store.py, and the rollup rebuilt with it
+grant select, insert, update, delete on table hackathon.group_1.scenario_fact to role g1_role;
+grant select, insert, update, delete on table hackathon.group_1.commence_actual_fact to role g1_role;
+grant select, insert, update, delete on table hackathon.group_1.scenario_rollup to role g1_role;
+
+-- written by the migrations and python -m models.dashboard_cube, under the role owning them; the app only reads
+revoke all on table hackathon.group_1.schema_migration from role g1_role;
+revoke all on table hackathon.group_1.dashboard_cube from role g1_role;
+revoke all on table hackathon.group_1.dashboard_cube_watermark from role g1_role;
+grant select on table hackathon.group_1.schema_migration to role g1_role;
+grant select on table hackathon.group_1.dashboard_cube to role g1_role;
+grant select on table hackathon.group_1.dashboard_cube_watermark to role g1_role;
+
+-- the views over the facts
+grant select on view hackathon.group_1.scenario_data to role g1_role;
+grant select on view hackathon.group_1.commence_actual to role g1_role;
+grant select on view hackathon.group_1.scenario_fact_resolved to role g1_role;
+grant select on view hackathon.group_1.scenario_data_resolved to role g1_role;
+grant select on future views in schema hackathon.group_1 to role g1_role;
 
 grant usage on database hackathon to role g1_role;
 grant usage on schema hackathon.group_1 to role g1_role;
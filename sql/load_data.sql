@@ -78,7 +78,7 @@ where scenario_type in ('2024 Load Plan 1.0', '2024 Load Plan 2.0');
 -- load 2024 actuals
 -- 2024.march actuals
 -- apply random float between 0.8 to 1.2 on the course enrolments from '2024 Load Plan 2.0', 2024.Session_1
-create or replace table commence_actual as
+create or replace temporary table commence_actual_stage as
 with base as (
     select scenario_type,
         period_name,
@@ -112,7 +112,7 @@ from base
 ;
 
 -- apply random float between 0.8 to 1.2 on the course enrolments from '2024 Load Plan 2.0', 2024.Session_2
-insert into commence_actual
+insert into commence_actual_stage
 with session_1 as (
     select '2024.07' as actual_name,
         '2024' as period_name,
@@ -122,7 +122,7 @@ with session_1 as (
         course_level_name,
         fee_liability_group,
         course_enrolment_count
-    from commence_actual
+    from commence_actual_stage
 ),
 session_2 as (
 
@@ -167,31 +167,51 @@ session_union as (
 select * from session_union
 ;
 
-insert into scenario_data (
+-- the facts hold the ids of the names, star_schema.sql creates the views reading them back
+insert overwrite into commence_actual_fact (actual_name, course_id, period_id, commencing_study_period_id,
+    owning_faculty_id, course_level_id, fee_liability_group_id, course_enrolment_count)
+select ca.actual_name,
+    ref_course.id,
+    ref_period.id,
+    ref_commencing_study_period.id,
+    ref_owning_faculty.id,
+    ref_course_level.id,
+    ref_fee_liability_group.id,
+    ca.course_enrolment_count
+from commence_actual_stage as ca
+left join ref_course on ref_course.course_name=ca.course
+left join ref_period on ref_period.period_name=ca.period
+left join ref_commencing_study_period on ref_commencing_study_period.commencing_study_period=ca.commencing_study_period
+left join ref_owning_faculty on ref_owning_faculty.faculty_name=ca.owning_faculty
+left join ref_course_level on ref_course_level.course_level_name=ca.course_level_name
+left join ref_fee_liability_group on ref_fee_liability_group.fee_liability_group=ca.fee_liability_group
+;
+
+insert into scenario_fact (
     scenario_id,
-    course,
-    period,
-    commencing_study_period,
-    owning_faculty_name,
-    course_level_name,
-    fee_liability_group,
+    course_id,
+    period_id,
+    commencing_study_period_id,
+    owning_faculty_id,
+    course_level_id,
+    fee_liability_group_id,
     course_enrolment_count
 )
 select scenario.id as scenario_id,
-    ds.course_name ,
-    ds.period_name,
-    ds.commencing_study_period,
-    ds.owning_faculty,
-    ds.course_level_name,
-    ds.fee_liability_group,
+    ref_course.id,
+    ref_period.id,
+    ref_commencing_study_period.id,
+    ref_owning_faculty.id,
+    ref_course_level.id,
+    ref_fee_liability_group.id,
     ds.course_enrolment_count
 from stage_data_source as ds
 inner join scenario on scenario.scenario_name=ds.scenario_type
 inner join ref_course on ref_course.course_name=ds.course_name
 inner join ref_period on ref_period.period_name=ds.period_name
+left join ref_commencing_study_period on ref_commencing_study_period.commencing_study_period=ds.commencing_study_period
 inner join ref_owning_faculty on ref_owning_faculty.faculty_name=ds.owning_faculty
 inner join ref_course_level on ref_course_level.course_level_name=ds.course_level_name
 inner join ref_fee_liability_group on ref_fee_liability_group.fee_liability_group=ds.fee_liability_group
 where 1=1
 ;
-
@@ -0,0 +1,37 @@
+use database hackathon;
+use schema group_1;
+
+-- totals of every scenario version at the grains the charts read, rebuilt
+-- by the app for the versions it writes (models/scenario_store.py);
+-- run after star_schema.sql
+create table if not exists scenario_rollup (
+    scenario_id number(38),
+    grain varchar(50), -- [period|commencing_study_period|owning_faculty]
+    period_id number(38),
+    commencing_study_period_id number(38), -- commencing_study_period grain only
+    owning_faculty_id number(38), -- owning_faculty grain only
+    course_enrolment_count number(38),
+    cells number(38)
+) cluster by (grain, scenario_id);
+
+comment on table scenario_rollup is 'scenario_fact_resolved summed per scenario and period, and per study period or owning faculty';
+
+insert overwrite into scenario_rollup (scenario_id, grain, period_id, commencing_study_period_id, owning_faculty_id,
+    course_enrolment_count, cells)
+select scenario_id,
+    case
+        when grouping(commencing_study_period_id) = 0 then 'commencing_study_period'
+        when grouping(owning_faculty_id) = 0 then 'owning_faculty'
+        else 'period'
+    end,
+    period_id,
+    commencing_study_period_id,
+    owning_faculty_id,
+    sum(course_enrolment_count),
+    count(*)
+from scenario_fact_resolved
+group by grouping sets (
+    (scenario_id, period_id),
+    (scenario_id, period_id, commencing_study_period_id),
+    (scenario_id, period_id, owning_faculty_id)
+);
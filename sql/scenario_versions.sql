@@ -0,0 +1,55 @@
+use database hackathon;
+use schema group_1;
+
+-- copy-on-write scenario versions
+-- a version stores only the cells changed against its parent version;
+-- upgrades a schema of text tables made before the versions, a fresh
+-- schema from table_creation.sql has them in scenario_fact already
+alter table scenario add column if not exists parent_scenario_id number(38);
+alter table scenario_data add column if not exists is_deleted varchar(1) default 'N';
+
+-- every version with its full set of cells: the nearest row along the
+-- lineage wins and tombstoned cells are dropped
+create or replace view scenario_data_resolved as
+with recursive lineage (scenario_id, ancestor_id, depth) as (
+    select id, id, 0
+    from scenario
+    union all
+    select lineage.scenario_id, scenario.parent_scenario_id, lineage.depth + 1
+    from lineage
+    inner join scenario
+        on scenario.id = lineage.ancestor_id
+    where scenario.parent_scenario_id is not null
+)
+select id,
+    scenario_id,
+    course,
+    period,
+    commencing_study_period,
+    owning_faculty,
+    course_level_name,
+    fee_liability_group,
+    course_enrolment_count
+from (
+    select sd.id,
+        lineage.scenario_id,
+        sd.course,
+        sd.period,
+        sd.commencing_study_period,
+        sd.owning_faculty,
+        sd.course_level_name,
+        sd.fee_liability_group,
+        sd.course_enrolment_count,
+        sd.is_deleted
+    from lineage
+    inner join scenario_data as sd
+        on sd.scenario_id = lineage.ancestor_id
+    qualify row_number() over (
+        partition by lineage.scenario_id, sd.course, sd.period, sd.commencing_study_period,
+            sd.owning_faculty, sd.course_level_name, sd.fee_liability_group
+        order by lineage.depth
+    ) = 1
+)
+where coalesce(is_deleted, 'N') = 'N';
+
+comment on view scenario_data_resolved is 'scenario_data of every version merged along its parent_scenario_id lineage';
@@ -0,0 +1,292 @@
+use database hackathon;
+use schema group_1;
+
+-- dictionary encoded scenario cells: the facts hold the ref_* ids of their
+-- dimensions, scenario_data, scenario_data_resolved and commence_actual are
+-- views over them with the columns as before. Run after load_data.sql,
+-- scenario_versions.sql and generation_params.sql on a schema of text
+-- tables, or after table_creation.sql and load_data.sql on a fresh one; the
+-- app writes through models/scenario_store.py from then on. Safe to rerun:
+-- the backfill runs once, recorded in schema_migration, and the views are
+-- replaced.
+
+-- migrations applied to the schema, by name
+create table if not exists schema_migration (
+    name varchar(100),
+    applied_at timestamp(6)
+);
+
+-- fact tables
+create table if not exists scenario_fact (
+    id number(38) identity,
+    scenario_id number(38),
+    course_id number(38),
+    period_id number(38),
+    commencing_study_period_id number(38),
+    owning_faculty_id number(38),
+    course_level_id number(38),
+    fee_liability_group_id number(38),
+    course_enrolment_count number(38),
+    is_deleted varchar(1) default 'N' -- [Y|N] tombstone hiding the cell of a parent version
+) cluster by (scenario_id);
+
+comment on table scenario_fact is 'cells of every scenario version keyed by the ref_* ids of their dimensions, read through the scenario_data view';
+
+create table if not exists commence_actual_fact (
+    actual_name varchar(100),
+    course_id number(38),
+    period_id number(38),
+    commencing_study_period_id number(38),
+    owning_faculty_id number(38),
+    course_level_id number(38),
+    fee_liability_group_id number(38),
+    course_enrolment_count number(38)
+);
+
+comment on table commence_actual_fact is 'actual commencing enrolments keyed by the ref_* ids of their dimensions, read through the commence_actual view';
+
+-- the backfill of the facts from the text tables, once
+execute immediate $$
+declare
+    applied integer default 0;
+    text_tables integer default 0;
+begin
+    select count(*) into :applied from schema_migration where name = 'star_schema';
+    if (applied > 0) then
+        return 'star_schema already applied';
+    end if;
+
+    -- the text tables are kept until the views are checked, then dropped. The
+    -- renames commit on their own, so a rerun after a failed backfill finds
+    -- them renamed already
+    select count(*) into :text_tables
+    from information_schema.tables
+    where table_schema = current_schema()
+        and table_name = 'SCENARIO_DATA'
+        and table_type = 'BASE TABLE';
+    if (text_tables > 0) then
+        alter table scenario_data rename to scenario_data_text;
+        alter table commence_actual rename to commence_actual_text;
+    end if;
+
+    begin transaction;
+
+    -- every name the facts use gets an id
+    insert into ref_course (course_name)
+    select distinct course from (
+        select course from scenario_data_text union select course from commence_actual_text
+    )
+    where course is not null
+        and course not in (select course_name from ref_course where course_name is not null);
+
+    insert into ref_period (period_name)
+    select distinct period from (
+        select period from scenario_data_text union select period from commence_actual_text
+    )
+    where period is not null
+        and period not in (select period_name from ref_period where period_name is not null);
+
+    insert into ref_commencing_study_period (commencing_study_period)
+    select distinct commencing_study_period from (
+        select commencing_study_period from scenario_data_text union select commencing_study_period from commence_actual_text
+    )
+    where commencing_study_period is not null
+        and commencing_study_period not in (
+            select commencing_study_period from ref_commencing_study_period where commencing_study_period is not null
+        );
+
+    insert into ref_owning_faculty (faculty_name)
+    select distinct owning_faculty from (
+        select owning_faculty from scenario_data_text union select owning_faculty from commence_actual_text
+    )
+    where owning_faculty is not null
+        and owning_faculty not in (select faculty_name from ref_owning_faculty where faculty_name is not null);
+
+    insert into ref_course_level (course_level_name)
+    select distinct course_level_name from (
+        select course_level_name from scenario_data_text union select course_level_name from commence_actual_text
+    )
+    where course_level_name is not null
+        and course_level_name not in (select course_level_name from ref_course_level where course_level_name is not null);
+
+    insert into ref_fee_liability_group (fee_liability_group, fee_liability_group_type)
+    select distinct fee_liability_group,
+        case when fee_liability_group ilike '%international%' then 'International' else 'Domestic' end
+    from (
+        select fee_liability_group from scenario_data_text union select fee_liability_group from commence_actual_text
+    )
+    where fee_liability_group is not null
+        and fee_liability_group not in (
+            select fee_liability_group from ref_fee_liability_group where fee_liability_group is not null
+        );
+
+    -- a name may appear twice in a reference table, its lowest id is its code
+    insert into scenario_fact (scenario_id, course_id, period_id, commencing_study_period_id, owning_faculty_id,
+        course_level_id, fee_liability_group_id, course_enrolment_count, is_deleted)
+    select sd.scenario_id,
+        c.id,
+        p.id,
+        csp.id,
+        f.id,
+        cl.id,
+        flg.id,
+        sd.course_enrolment_count,
+        coalesce(sd.is_deleted, 'N')
+    from scenario_data_text as sd
+    left join (select course_name, min(id) as id from ref_course group by course_name) as c
+        on c.course_name = sd.course
+    left join (select period_name, min(id) as id from ref_period group by period_name) as p
+        on p.period_name = sd.period
+    left join (
+        select commencing_study_period, min(id) as id from ref_commencing_study_period group by commencing_study_period
+    ) as csp
+        on csp.commencing_study_period = sd.commencing_study_period
+    left join (select faculty_name, min(id) as id from ref_owning_faculty group by faculty_name) as f
+        on f.faculty_name = sd.owning_faculty
+    left join (select course_level_name, min(id) as id from ref_course_level group by course_level_name) as cl
+        on cl.course_level_name = sd.course_level_name
+    left join (select fee_liability_group, min(id) as id from ref_fee_liability_group group by fee_liability_group) as flg
+        on flg.fee_liability_group = sd.fee_liability_group;
+
+    insert into commence_actual_fact (actual_name, course_id, period_id, commencing_study_period_id, owning_faculty_id,
+        course_level_id, fee_liability_group_id, course_enrolment_count)
+    select ca.actual_name,
+        c.id,
+        p.id,
+        csp.id,
+        f.id,
+        cl.id,
+        flg.id,
+        ca.course_enrolment_count
+    from commence_actual_text as ca
+    left join (select course_name, min(id) as id from ref_course group by course_name) as c
+        on c.course_name = ca.course
+    left join (select period_name, min(id) as id from ref_period group by period_name) as p
+        on p.period_name = ca.period
+    left join (
+        select commencing_study_period, min(id) as id from ref_commencing_study_period group by commencing_study_period
+    ) as csp
+        on csp.commencing_study_period = ca.commencing_study_period
+    left join (select faculty_name, min(id) as id from ref_owning_faculty group by faculty_name) as f
+        on f.faculty_name = ca.owning_faculty
+    left join (select course_level_name, min(id) as id from ref_course_level group by course_level_name) as cl
+        on cl.course_level_name = ca.course_level_name
+    left join (select fee_liability_group, min(id) as id from ref_fee_liability_group group by fee_liability_group) as flg
+        on flg.fee_liability_group = ca.fee_liability_group;
+
+    insert into schema_migration (name, applied_at) values ('star_schema', current_timestamp());
+    commit;
+    return 'star_schema applied';
+end;
+$$
+;
+
+create or replace view scenario_data as
+select sd.id,
+    sd.scenario_id,
+    c.course_name as course,
+    p.period_name as period,
+    csp.commencing_study_period,
+    f.faculty_name as owning_faculty,
+    cl.course_level_name,
+    flg.fee_liability_group,
+    sd.course_enrolment_count,
+    sd.is_deleted
+from scenario_fact as sd
+left join ref_course as c on c.id = sd.course_id
+left join ref_period as p on p.id = sd.period_id
+left join ref_commencing_study_period as csp on csp.id = sd.commencing_study_period_id
+left join ref_owning_faculty as f on f.id = sd.owning_faculty_id
+left join ref_course_level as cl on cl.id = sd.course_level_id
+left join ref_fee_liability_group as flg on flg.id = sd.fee_liability_group_id;
+
+comment on view scenario_data is 'scenario_fact with the names of its dimensions';
+
+create or replace view commence_actual as
+select ca.actual_name,
+    p.period_name as period,
+    csp.commencing_study_period,
+    c.course_name as course,
+    f.faculty_name as owning_faculty,
+    cl.course_level_name,
+    flg.fee_liability_group,
+    ca.course_enrolment_count
+from commence_actual_fact as ca
+left join ref_course as c on c.id = ca.course_id
+left join ref_period as p on p.id = ca.period_id
+left join ref_commencing_study_period as csp on csp.id = ca.commencing_study_period_id
+left join ref_owning_faculty as f on f.id = ca.owning_faculty_id
+left join ref_course_level as cl on cl.id = ca.course_level_id
+left join ref_fee_liability_group as flg on flg.id = ca.fee_liability_group_id;
+
+comment on view commence_actual is 'commence_actual_fact with the names of its dimensions';
+
+-- the lineage of scenario_versions.sql resolved on the ids, the names
+-- joined once to the surviving rows
+create or replace view scenario_fact_resolved as
+with recursive lineage (scenario_id, ancestor_id, depth) as (
+    select id, id, 0
+    from scenario
+    union all
+    select lineage.scenario_id, scenario.parent_scenario_id, lineage.depth + 1
+    from lineage
+    inner join scenario
+        on scenario.id = lineage.ancestor_id
+    where scenario.parent_scenario_id is not null
+)
+select id,
+    scenario_id,
+    course_id,
+    period_id,
+    commencing_study_period_id,
+    owning_faculty_id,
+    course_level_id,
+    fee_liability_group_id,
+    course_enrolment_count
+from (
+    select sd.id,
+        lineage.scenario_id,
+        sd.course_id,
+        sd.period_id,
+        sd.commencing_study_period_id,
+        sd.owning_faculty_id,
+        sd.course_level_id,
+        sd.fee_liability_group_id,
+        sd.course_enrolment_count,
+        sd.is_deleted
+    from lineage
+    inner join scenario_fact as sd
+        on sd.scenario_id = lineage.ancestor_id
+    qualify row_number() over (
+        partition by lineage.scenario_id, sd.course_id, sd.period_id, sd.commencing_study_period_id,
+            sd.owning_faculty_id, sd.course_level_id, sd.fee_liability_group_id
+        order by lineage.depth
+    ) = 1
+)
+where coalesce(is_deleted, 'N') = 'N';
+
+comment on view scenario_fact_resolved is 'scenario_fact of every version merged along its parent_scenario_id lineage';
+
+create or replace view scenario_data_resolved as
+select r.id,
+    r.scenario_id,
+    c.course_name as course,
+    p.period_name as period,
+    csp.commencing_study_period,
+    f.faculty_name as owning_faculty,
+    cl.course_level_name,
+    flg.fee_liability_group,
+    r.course_enrolment_count
+from scenario_fact_resolved as r
+left join ref_course as c on c.id = r.course_id
+left join ref_period as p on p.id = r.period_id
+left join ref_commencing_study_period as csp on csp.id = r.commencing_study_period_id
+left join ref_owning_faculty as f on f.id = r.owning_faculty_id
+left join ref_course_level as cl on cl.id = r.course_level_id
+left join ref_fee_liability_group as flg on flg.id = r.fee_liability_group_id;
+
+comment on view scenario_data_resolved is 'scenario_data of every version merged along its parent_scenario_id lineage';
+
+-- once the app reads and writes through the views:
+-- drop table scenario_data_text;
+-- drop table commence_actual_text;
@@ -11,6 +11,8 @@ create table scenario if not exists (
     confirmed_by_sci varchar(1) default 'N',
     confirmed_by_fmhhs varchar(1) default 'N',
     notes varchar,
+    parent_scenario_id number(38), -- version the data is overlaid on, null when the version holds all its rows
+    generation_params varchar, -- json inputs of the generation, null for scenarios not generated by the app
     created_by varchar(100),
     created_at timestamp(6),
     updated_by varchar(100),
@@ -30,18 +32,54 @@ create table scenario_notes if not exists (
 
 comment on table scenario_notes is 'Notes and Comments associated with Scenario for better collabration'
 
-create table scenario_data if not exists (
+-- migrations applied to the schema, by name
+create table if not exists schema_migration (
+    name varchar(100),
+    applied_at timestamp(6)
+);
+
+-- scenario cells keyed by the ref_* ids of their dimensions; star_schema.sql
+-- creates the scenario_data and commence_actual views over them
+create table if not exists scenario_fact (
     id number(38) identity,
     scenario_id number(38),
-    course varchar(100),
-    period varchar(100),
-    commencing_study_period varchar(100),
-    owning_faculty_name varchar(200),
-    course_level_name varchar(100),
-    fee_liability_group varchar(100),
+    course_id number(38),
+    period_id number(38),
+    commencing_study_period_id number(38),
+    owning_faculty_id number(38),
+    course_level_id number(38),
+    fee_liability_group_id number(38),
+    course_enrolment_count number(38),
+    is_deleted varchar(1) default 'N' -- [Y|N] tombstone hiding the cell of a parent version
+) cluster by (scenario_id);
+
+comment on table scenario_fact is 'cells of every scenario version keyed by the ref_* ids of their dimensions, read through the scenario_data view';
+
+create table if not exists commence_actual_fact (
+    actual_name varchar(100),
+    course_id number(38),
+    period_id number(38),
+    commencing_study_period_id number(38),
+    owning_faculty_id number(38),
+    course_level_id number(38),
+    fee_liability_group_id number(38),
     course_enrolment_count number(38)
 );
 
+comment on table commence_actual_fact is 'actual commencing enrolments keyed by the ref_* ids of their dimensions, read through the commence_actual view';
+
+-- a fresh schema starts as the star schema, nothing to backfill; a schema
+-- still holding the text scenario_data table is left to star_schema.sql
+insert into schema_migration (name, applied_at)
+select 'star_schema', current_timestamp()
+where not exists (select 1 from schema_migration where name = 'star_schema')
+    and not exists (
+        select 1 from information_schema.tables
+        where table_schema = current_schema()
+            and table_name = 'SCENARIO_DATA'
+            and table_type = 'BASE TABLE'
+    );
+
 
 create table ref_course (
     id number(38) identity,
@@ -101,3 +139,24 @@ create table if not exists rule (
 
 comment on column rule.rule_content is 'json content to combine lists of owning faculty, fee liability group, course level, period, commencing study period and courses';
 
+
+-- dashboard aggregate of data_source.commencing_estimates.draft_lp_ce_estimates_2024, refreshed by
+-- python -m models.dashboard_cube under the role owning it
+create table if not exists dashboard_cube (
+    scenario_type varchar,
+    period_name varchar,
+    course_name varchar,
+    owning_faculty varchar,
+    commencing_study_period varchar,
+    course_level_name varchar,
+    fee_liability_group varchar,
+    course_enrolment_count number(38)
+);
+
+create table if not exists dashboard_cube_watermark (
+    source_name varchar(300),
+    signature varchar(300),
+    refreshed_at timestamp(6)
+);
+
+comment on table dashboard_cube_watermark is 'load watermark (last_altered and row count, or row count and hash) of the source the dashboard cube was built from';
@@ -0,0 +1,139 @@
+import os
+import re
+
+import pandas as pd
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def collect(self):
+        return self.rows
+
+    def collect_nowait(self):
+        return self
+
+    def is_done(self):
+        return True
+
+    def result(self):
+        return self.rows
+
+    def cancel(self):
+        pass
+
+
+class FakeSession:
+    """ records the statements sent to it; fail_on raises on the first statement containing it """
+
+    def __init__(self, fail_on: str = None, rows: list = None):
+        self.statements = []
+        self.params = []
+        self.query_tag = None
+        self.fail_on = fail_on
+        self.rows = rows or []
+
+    def sql(self, sql: str, params: list = None):
+        self.statements.append(' '.join(sql.split()))
+        self.params.append(params)
+        if self.fail_on and self.fail_on in sql:
+            raise RuntimeError(f'failed: {self.fail_on}')
+        return FakeResult(self.rows)
+
+    def write_pandas(self, df, table_name: str, **kwargs):
+        self.statements.append(f'write_pandas {table_name}')
+
+    def verbs(self) -> list:
+        return [statement.split()[0] for statement in self.statements]
+
+
+class Warehouse:
+    """
+    The star schema in DuckDB, to run the statements of the app on a fixture.
+    scenario_fact_resolved is the view of sql/star_schema.sql as it is.
+    """
+
+    def __init__(self):
+        import duckdb
+
+        from models.scenario_store import DIMENSIONS, FACT_COLUMNS
+
+        self.dimensions = DIMENSIONS
+        self.fact_columns = FACT_COLUMNS
+        self.connection = duckdb.connect()
+        for table, name, _ in DIMENSIONS.values():
+            self.connection.execute(f'create table {table} (id bigint, {name} varchar)')
+        facts = ', '.join(f'{fact} bigint' for fact in FACT_COLUMNS)
+        self.connection.execute('create sequence fact_id')
+        self.connection.execute("""create table scenario (
+            id bigint, scenario_name varchar, version_name varchar, parent_scenario_id bigint
+        )""")
+        self.connection.execute(f"""create table scenario_fact (
+            id bigint default nextval('fact_id'), scenario_id bigint, {facts},
+            course_enrolment_count bigint, is_deleted varchar default 'N'
+        )""")
+        self.connection.execute(f"""create table commence_actual_fact (
+            actual_name varchar, {facts}, course_enrolment_count bigint
+        )""")
+        with open(os.path.join(os.path.dirname(__file__), '..', 'sql', 'star_schema.sql')) as f:
+            schema = f.read()
+        [view] = re.findall(r'create or replace view scenario_fact_resolved as.*?;', schema, re.S)
+        self.connection.execute(view)
+
+    def execute(self, sql: str, params: list = None):
+        # FLOAT is a double in Snowflake, a single in DuckDB
+        sql = sql.replace('::float', '::double').replace(' as float)', ' as double)')
+        return self.connection.execute(sql, params or [])
+
+    def ref(self, column: str, name: str, id: int = None) -> int:
+        """ id of the name, added to the reference table when missing or when the id is given """
+        table, name_column, _ = self.dimensions[column]
+        found = self.connection.execute(f'select min(id) from {table} where {name_column} = ?', [name]).fetchone()[0]
+        if found is not None and id is None:
+            return found
+        if id is None:
+            id = self.connection.execute(f'select coalesce(max(id), 0) + 1 from {table}').fetchone()[0]
+        self.connection.execute(f'insert into {table} values (?, ?)', [id, name])
+        return id
+
+    def add_scenario(self, id: int, scenario_name: str, version_name: str = 'init', parent_id: int = None):
+        self.connection.execute(
+            'insert into scenario values (?, ?, ?, ?)', [id, scenario_name, version_name, parent_id]
+        )
+
+    def _ids(self, row) -> list:
+        return [
+            None if pd.isna(row[column.upper()]) else self.ref(column, row[column.upper()])
+            for column in self.dimensions
+        ]
+
+    def add_cells(self, scenario_id: int, df: pd.DataFrame):
+        """ the cells of the frame of scenario_data columns, IS_DELETED 'N' when missing """
+        for _, row in df.iterrows():
+            self.connection.execute(
+                f'insert into scenario_fact (scenario_id, {", ".join(self.fact_columns)}, course_enrolment_count, '
+                'is_deleted) values (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [scenario_id, *self._ids(row), row['COURSE_ENROLMENT_COUNT'], row.get('IS_DELETED', 'N')]
+            )
+
+    def add_actuals(self, actual_name: str, df: pd.DataFrame):
+        for _, row in df.iterrows():
+            self.connection.execute(
+                'insert into commence_actual_fact values (?, ?, ?, ?, ?, ?, ?, ?)',
+                [actual_name, *self._ids(row), row['COURSE_ENROLMENT_COUNT']]
+            )
+
+    def cells(self, scenario_id: int, source: str = 'scenario_fact_resolved') -> pd.DataFrame:
+        """ the cells of the scenario with the names of their dimensions, sorted """
+        names = ', '.join(
+            f'{table}.{name} as {column.upper()}' for column, (table, name, _) in self.dimensions.items()
+        )
+        joins = ' '.join(
+            f'left join {table} on {table}.id = f.{fact}' for table, _, fact in self.dimensions.values()
+        )
+        df = self.connection.execute(
+            f'select {names}, f.course_enrolment_count as COURSE_ENROLMENT_COUNT '
+            f'from {source} as f {joins} where f.scenario_id = ?', [scenario_id]
+        ).df()
+        return df.sort_values(list(df.columns)).reset_index(drop=True)
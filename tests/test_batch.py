@@ -0,0 +1,76 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+import yaml
+
+from helpers.connection import connection_config
+from models.batch import BACKENDS, RESULT_COLUMNS, run_batch
+from models.estimate import project
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'batch')
+
+
+@pytest.fixture
+def spec_dir(tmp_path):
+    # the output is written next to the spec
+    for name in os.listdir(FIXTURES):
+        shutil.copy(os.path.join(FIXTURES, name), tmp_path)
+    return tmp_path
+
+
+def load(spec_dir):
+    with open(spec_dir / 'spec.yaml') as f:
+        spec = yaml.safe_load(f)
+    return spec, BACKENDS[spec['backend']](spec, str(spec_dir))
+
+
+def test_run_batch_writes_every_variant(spec_dir):
+    spec, backend = load(spec_dir)
+    report = run_batch(spec, backend, workers=2)
+
+    assert [row['variant'] for row in report] == ['What-if 2%', 'Arts growth', '(write)']
+    # 5 base rows (3 actuals, 2 carried) over the base period and 4 projected periods
+    assert [row['rows'] for row in report] == [25, 25, 50]
+
+    output = pd.read_csv(spec_dir / 'batch_scenario_data.csv', dtype={'PERIOD': str})
+    assert list(output.columns) == RESULT_COLUMNS
+    assert output.groupby('SCENARIO_NAME').size().to_dict() == {'What-if 2%': 25, 'Arts growth': 25}
+
+
+def test_run_batch_matches_project(spec_dir):
+    spec, backend = load(spec_dir)
+    run_batch(spec, backend, workers=1)
+    output = pd.read_csv(spec_dir / 'batch_scenario_data.csv', dtype={'PERIOD': str})
+
+    base_df = backend.calibration('2024.03', 'Base (init)', ['Session 1']).base_df
+    # carried Session 2 rows scaled by 87 actual / 75 estimated
+    assert sorted(base_df['COURSE_ENROLMENT_COUNT']) == [10, 12, 24, 30, 45]
+    rules = [
+        {'version': 2, 'owning_faculties': ['Faculty of Arts'], 'periods': ['2025', '2026'], 'increase_by': 0.1},
+        {'version': 2, 'periods': ['2027'], 'increase_by': -0.05, 'fee_liability_groups': ['International']},
+    ]
+    expected = project(base_df, rules, 0.03, ['2025', '2026', '2027', '2028'])
+    actual = output[output['SCENARIO_NAME'] == 'Arts growth']
+    assert actual['COURSE_ENROLMENT_COUNT'].tolist() == expected['COURSE_ENROLMENT_COUNT'].tolist()
+
+
+def test_dry_run_writes_nothing(spec_dir):
+    spec, backend = load(spec_dir)
+    report = run_batch(spec, backend, workers=1, write=False)
+    assert [row['variant'] for row in report] == ['What-if 2%', 'Arts growth']
+    assert not (spec_dir / 'batch_scenario_data.csv').exists()
+
+
+def test_unknown_rule_name(spec_dir):
+    spec, backend = load(spec_dir)
+    spec['variants'][1]['rules'] = ['No such rule']
+    with pytest.raises(ValueError, match='Unknown rule'):
+        run_batch(spec, backend, workers=1)
+
+
+def test_connection_config_reads_the_readme_layout(tmp_path):
+    secrets = tmp_path / 'secrets.toml'
+    secrets.write_text('[connections.snowflake]\naccount = "vd12345-example"\nuser = "john.smith@example.com"\n')
+    assert connection_config(str(secrets)) == {'account': 'vd12345-example', 'user': 'john.smith@example.com'}
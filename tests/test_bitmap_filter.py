@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from helpers.bitmap_filter import BitmapIndex
+
+DIMENSIONS = ['COURSE_NAME', 'OWNING_FACULTY', 'SCENARIO_TYPE']
+
+
+@pytest.fixture(scope='module')
+def df() -> pd.DataFrame:
+    # not a multiple of 8 rows, so the last packed byte is partly padding
+    rng = np.random.default_rng(7)
+    n = 61
+    return pd.DataFrame({
+        'COURSE_NAME': rng.choice(['C1', 'C2', 'C3', 'C4', 'C5'], n),
+        'OWNING_FACULTY': rng.choice(['Faculty of Arts', 'Macquarie Business School', None], n),
+        'SCENARIO_TYPE': rng.choice(['Final', '2023 Budget', '2024 Load Plan 1.0'], n),
+        'COURSE_ENROLMENT_COUNT': rng.integers(0, 100, n),
+    }, index=np.arange(100, 100 + n))
+
+
+@pytest.fixture(scope='module')
+def index(df) -> BitmapIndex:
+    return BitmapIndex(df, DIMENSIONS)
+
+
+def isin_mask(df: pd.DataFrame, selections: dict) -> np.ndarray:
+    mask = np.ones(len(df), dtype=bool)
+    for dimension, selected in selections.items():
+        if selected:
+            mask &= df[dimension].isin(selected).to_numpy()
+    return mask
+
+
+@pytest.mark.parametrize('selections', [
+    {'COURSE_NAME': ['C2']},
+    {'COURSE_NAME': ['C1', 'C4'], 'SCENARIO_TYPE': ['Final']},
+    {
+        'COURSE_NAME': ['C1', 'C3', 'C5'],
+        'OWNING_FACULTY': ['Faculty of Arts'],
+        'SCENARIO_TYPE': ['Final', '2023 Budget'],
+    },
+    {'OWNING_FACULTY': ['Faculty of Arts', 'Macquarie Business School']},
+])
+def test_combined_selections_match_isin(df, index, selections):
+    expected = isin_mask(df, selections)
+    np.testing.assert_array_equal(index.mask(selections), expected)
+    pd.testing.assert_frame_equal(index.filter(selections), df.reset_index(drop=True)[expected])
+
+
+@pytest.mark.parametrize('selections', [{}, {'COURSE_NAME': []}, {'COURSE_NAME': [], 'SCENARIO_TYPE': None}])
+def test_empty_selection_keeps_every_row(df, index, selections):
+    assert index.bits(selections) is None
+    assert index.mask(selections).all()
+    assert len(index.filter(selections)) == len(df)
+
+
+def test_value_missing_from_the_index_matches_nothing(df, index):
+    assert not index.mask({'COURSE_NAME': ['C9']}).any()
+    # alongside a known value it only drops out
+    selections = {'COURSE_NAME': ['C9', 'C2']}
+    np.testing.assert_array_equal(index.mask(selections), isin_mask(df, {'COURSE_NAME': ['C2']}))
+
+
+def test_options_leave_out_missing_values(df, index):
+    assert index.options('OWNING_FACULTY') == ['Faculty of Arts', 'Macquarie Business School']
+    assert index.options('COURSE_NAME') == sorted(df['COURSE_NAME'].unique())
+
+
+def test_aggregate_matches_groupby(df, index):
+    selections = {'SCENARIO_TYPE': ['Final']}
+    expected = df[isin_mask(df, selections)].groupby('COURSE_NAME')['COURSE_ENROLMENT_COUNT'].sum().reset_index()
+    pd.testing.assert_frame_equal(index.aggregate(selections, ['COURSE_NAME'], 'COURSE_ENROLMENT_COUNT'), expected)
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from helpers import changeset
+from helpers.changeset import DELETE, INSERT, OP_COLUMN, UPDATE
+from models import Scenario as scenario_module
+from models.Scenario import stage_changes
+
+KEYS = ['COURSE', 'PERIOD']
+
+
+def frame(rows: list, columns=('ID', 'COURSE', 'PERIOD', 'COUNT')) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=list(columns))
+
+
+def ops(rows: list) -> pd.DataFrame:
+    return frame(rows, ('ID', 'COURSE', 'PERIOD', 'COUNT', OP_COLUMN))
+
+
+@pytest.fixture
+def snapshot():
+    return frame([
+        [1, 'B Arts', '2025', 10],
+        [2, 'B Arts', '2026', 11],
+        [3, 'B Science', '2025', 12],
+    ])
+
+
+def test_diff_inserts_updates_and_deletes(snapshot):
+    edited = frame([
+        [1, 'B Arts', '2025', 10],
+        [2, 'B Arts', '2026', 15],
+        [np.nan, 'B Law', '2025', 4],
+    ])
+    expected = ops([
+        [3, 'B Science', '2025', 12, DELETE],
+        [2, 'B Arts', '2026', 15, UPDATE],
+        [np.nan, 'B Law', '2025', 4, INSERT],
+    ])
+    pd.testing.assert_frame_equal(changeset.diff(snapshot, edited), expected, check_dtype=False)
+
+
+def test_diff_new_rows_with_nan_ids_are_all_inserts(snapshot):
+    # the editor gives added rows no ID, and turns the column float
+    edited = pd.concat([snapshot, frame([[np.nan, 'B Law', '2025', 4], [np.nan, 'B Law', '2026', 5]])], ignore_index=True)
+    assert edited['ID'].dtype == float
+    expected = ops([
+        [np.nan, 'B Law', '2025', 4, INSERT],
+        [np.nan, 'B Law', '2026', 5, INSERT],
+    ])
+    pd.testing.assert_frame_equal(changeset.diff(snapshot, edited), expected, check_dtype=False)
+
+
+def test_diff_ignores_float_int_drift(snapshot):
+    # an edited column comes back float, 10.0 is still 10; nulls on both sides are unchanged
+    edited = snapshot.astype({'COUNT': float})
+    assert changeset.diff(snapshot, edited).empty
+    with_null = snapshot.astype({'COUNT': float})
+    with_null.loc[0, 'COUNT'] = np.nan
+    assert changeset.diff(with_null, with_null.copy()).empty
+    edited.loc[0, 'COUNT'] = 10.5
+    pd.testing.assert_frame_equal(
+        changeset.diff(snapshot, edited), ops([[1, 'B Arts', '2025', 10.5, UPDATE]]), check_dtype=False
+    )
+
+
+def test_moved_key_change_is_a_delete_and_an_insert(snapshot):
+    edited = snapshot.copy()
+    edited.loc[1, 'PERIOD'] = '2027'
+    edited.loc[2, 'COUNT'] = 20
+    changes = changeset.moved(snapshot, changeset.diff(snapshot, edited), KEYS)
+    expected = ops([
+        [2, 'B Arts', '2026', 11, DELETE],
+        [3, 'B Science', '2025', 20, UPDATE],
+        [2, 'B Arts', '2027', 11, INSERT],
+    ])
+    pd.testing.assert_frame_equal(changes[expected.columns], expected, check_dtype=False)
+
+
+def test_moved_leaves_changes_without_key_changes(snapshot):
+    edited = snapshot.assign(COUNT=snapshot['COUNT'] + 1)
+    changes = changeset.diff(snapshot, edited)
+    assert changeset.moved(snapshot, changes, KEYS) is changes
+
+
+CELL = ['B Arts', '2025', 'Session 1', 'Faculty of Arts', 'Undergraduate', 'Domestic']
+COLUMNS = ['ID', 'COURSE', 'PERIOD', 'COMMENCING_STUDY_PERIOD', 'OWNING_FACULTY', 'COURSE_LEVEL_NAME',
+           'FEE_LIABILITY_GROUP', 'COURSE_ENROLMENT_COUNT']
+
+
+@pytest.fixture
+def written(monkeypatch):
+    frames = []
+    monkeypatch.setattr(scenario_module, '_write_changes', frames.append)
+    return frames
+
+
+def test_stage_changes_delete_and_reinsert_of_a_cell_keeps_the_insert(written):
+    snapshot = pd.DataFrame([[1, *CELL, 10], [2, *CELL[:1], '2026', *CELL[2:], 11]], columns=COLUMNS)
+    # the row of the cell removed in the editor and added again with another count
+    edited = pd.DataFrame([[2, *CELL[:1], '2026', *CELL[2:], 11], [np.nan, *CELL, 30]], columns=COLUMNS)
+    staged = stage_changes(snapshot, edited)
+    expected = pd.DataFrame([[INSERT, *CELL, 30]], columns=[OP_COLUMN, *COLUMNS[1:]])
+    pd.testing.assert_frame_equal(staged.reset_index(drop=True), expected, check_dtype=False)
+    assert len(written) == 1
+
+
+def test_stage_changes_moved_cell(written):
+    snapshot = pd.DataFrame([[1, *CELL, 10]], columns=COLUMNS)
+    edited = pd.DataFrame([[1, *CELL[:1], '2026', *CELL[2:], 10]], columns=COLUMNS)
+    staged = stage_changes(snapshot, edited)
+    expected = pd.DataFrame(
+        [[DELETE, *CELL, 10], [INSERT, *CELL[:1], '2026', *CELL[2:], 10]], columns=[OP_COLUMN, *COLUMNS[1:]]
+    )
+    pd.testing.assert_frame_equal(staged.reset_index(drop=True), expected, check_dtype=False)
+
+
+def test_stage_changes_nothing_changed_writes_nothing(written):
+    snapshot = pd.DataFrame([[1, *CELL, 10]], columns=COLUMNS)
+    assert stage_changes(snapshot, snapshot.astype({'COURSE_ENROLMENT_COUNT': float})).empty
+    assert written == []
@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+import pytest
+from snowflake.snowpark import functions
+from snowflake.snowpark.mock import ColumnEmulator, ColumnType, patch
+from snowflake.snowpark.mock._functions import MockedFunctionRegistry
+from snowflake.snowpark.types import DoubleType, NullType
+
+from benchmarks.run import _local_session, encoded, save_rollup
+from benchmarks.synthetic import generate
+from models import compare
+from models.compare import CELL_KEYS, _totals, diff_df, rollup_df, rollup_grain, series_df
+
+
+@pytest.fixture(scope='module')
+def data():
+    return generate(courses=20, study_periods=2, fee_groups=2, versions=2, rules_count=2)
+
+
+@pytest.fixture(scope='module')
+def session(data):
+    session = _local_session()
+    save_rollup(session, data['scenario'], *encoded(data['scenario_data']))
+    return session
+
+
+@pytest.fixture(scope='module')
+def cells_df(data):
+    scenario = data['scenario'].assign(SCENARIO=lambda df: df['SCENARIO_NAME'] + ' (' + df['VERSION_NAME'] + ')')
+    return data['scenario_data'].merge(
+        scenario[['ID', 'SCENARIO']].rename(columns={'ID': 'SCENARIO_ID'}), on='SCENARIO_ID'
+    )
+
+
+@pytest.mark.parametrize('selected', [[], ['OWNING_FACULTY'], ['COMMENCING_STUDY_PERIOD']])
+def test_rollup_series_matches_the_cells(session, cells_df, selected):
+    selections = {'SCENARIO': sorted(cells_df['SCENARIO'].unique())[:1]}
+    selections.update({column: sorted(cells_df[column].unique())[:1] for column in selected})
+    expected = cells_df[
+        pd.concat([cells_df[column].isin(values) for column, values in selections.items()], axis=1).all(axis=1)
+    ].groupby(['SCENARIO', 'PERIOD'], as_index=False)['COURSE_ENROLMENT_COUNT'].sum()
+
+    actual = series_df(rollup_df(session, rollup_grain(selections), selections)).to_pandas()
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+def test_totals_of_a_scenario_per_faculty(session, cells_df):
+    expected = cells_df[cells_df['SCENARIO_ID'] == 2].groupby(
+        ['PERIOD', 'OWNING_FACULTY'], as_index=False
+    )['COURSE_ENROLMENT_COUNT'].sum()
+    pd.testing.assert_frame_equal(_totals(session, 2, 'owning_faculty'), expected, check_dtype=False)
+
+
+def emulated(values, data_type=DoubleType(), index=None) -> ColumnEmulator:
+    column = ColumnEmulator(data=values, index=index)
+    column.sf_type = ColumnType(data_type, True)
+    return column
+
+
+def patch_warehouse_functions(monkeypatch):
+    """ iff, round and sum of the local testing session as the warehouse has them, for the test """
+    registry = MockedFunctionRegistry.get_or_create()
+    monkeypatch.setattr(registry, '_registry', dict(registry._registry))
+
+    # local testing aligns the iff branches on their index, has no round, and its sum does not skip NaN
+    @patch(functions.iff)
+    def mock_iff(condition, expr1, expr2):
+        values = np.where(condition.to_numpy(dtype=bool), expr1.to_numpy(dtype=object), expr2.to_numpy(dtype=object))
+        typed = expr2 if isinstance(expr1.sf_type.datatype, NullType) else expr1
+        return emulated(values, typed.sf_type.datatype, condition.index)
+
+    @patch(functions.round)
+    def mock_round(column, scale):
+        return emulated(column.astype(float).round(int(scale.iloc[0])), index=column.index)
+
+    @patch(functions.sum)
+    def mock_sum(column):
+        values = column.dropna()
+        return emulated([float(values.sum()) if len(values) else None])
+
+
+def diff_cell(course: str, *counts) -> list:
+    """ the cell of the course in every scenario with a count, in the order A, B, C """
+    return [
+        {**dict(zip(CELL_KEYS, (course, '2025', 'Session 1', 'Faculty of Arts', 'Undergraduate', 'Domestic'))),
+         'SCENARIO': scenario, 'COURSE_ENROLMENT_COUNT': count}
+        for scenario, count in zip('ABC', counts) if count is not None
+    ]
+
+
+@pytest.fixture
+def diff_session(monkeypatch):
+    session = _local_session()
+    patch_warehouse_functions(monkeypatch)
+    cells = session.create_dataframe(pd.DataFrame([
+        *diff_cell('C1', 100, 110, 90),
+        # missing from B
+        *diff_cell('C2', 50, None, 60),
+        # missing from the baseline
+        *diff_cell('C3', None, 7, None),
+        *diff_cell('C4', 0, 5, 0),
+    ]))
+    monkeypatch.setattr(compare, 'compare_df', lambda session, selections: compare.filter_selections(cells, selections))
+    return session
+
+
+def test_diff_of_three_scenarios_with_missing_cells(diff_session):
+    actual = diff_df(diff_session, {}, ['A', 'B', 'C'], 'A').to_pandas()
+    assert actual['COURSE'].tolist() == ['C1', 'C2', 'C3', 'C4']
+    expected = pd.DataFrame({
+        'V0': [100, 50, np.nan, 0],
+        'V1': [110, np.nan, 7, 5],
+        'V2': [90, 60, np.nan, 0],
+        # a cell missing on either side has no delta, a zero baseline no percentage
+        'D1': [10, np.nan, np.nan, 5],
+        'P1': [10, np.nan, np.nan, np.nan],
+        'D2': [-10, 10, np.nan, 0],
+        'P2': [-10, 20, np.nan, np.nan],
+    })
+    pd.testing.assert_frame_equal(actual[expected.columns], expected, check_dtype=False)
+
+
+def test_diff_top_n_against_a_baseline_in_the_middle(diff_session):
+    actual = diff_df(diff_session, {'COURSE': ['C1', 'C2', 'C4']}, ['B', 'A', 'C'], 'A', top_n=2).to_pandas()
+    # the largest movement of either scenario, a missing delta counts as none
+    assert actual['COURSE'].tolist() == ['C1', 'C2']
+    assert list(actual.columns) == [*CELL_KEYS, 'V0', 'V1', 'V2', 'D0', 'P0', 'D2', 'P2']
@@ -0,0 +1,75 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from helpers.cost_report import FIXTURE, load_fixture, main, parse_tags, query_tag_text, report
+
+
+def expected(by: list) -> pd.DataFrame:
+    """ the report computed row by row from the fixture """
+    rows = []
+    for _, row in pd.read_csv(FIXTURE).iterrows():
+        try:
+            tag = json.loads(row['QUERY_TAG'])
+        except (TypeError, ValueError):
+            continue
+        if not isinstance(tag, dict) or tag.get('app') != 'hack-g1':
+            continue
+        rows.append({
+            **{column: tag.get(column.lower()) or '(none)' for column in by},
+            'FAILED': int(row['EXECUTION_STATUS'] != 'SUCCESS'),
+            'ELAPSED_S': row['TOTAL_ELAPSED_TIME'] / 1000,
+            'BYTES_SCANNED': row['BYTES_SCANNED'],
+        })
+    df = pd.DataFrame(rows)
+    return df.groupby(by).agg(
+        QUERIES=('FAILED', 'size'), FAILED=('FAILED', 'sum'), ELAPSED_S=('ELAPSED_S', 'sum'),
+        BYTES_SCANNED=('BYTES_SCANNED', 'sum'),
+    )
+
+
+def test_report_of_the_fixture():
+    by = ['PAGE', 'OPERATION']
+    result = report(parse_tags(load_fixture()), by).set_index(by)
+    want = expected(by).loc[result.index]
+    assert len(result) == len(expected(by))
+    np.testing.assert_array_equal(result['QUERIES'], want['QUERIES'])
+    np.testing.assert_array_equal(result['FAILED'], want['FAILED'])
+    np.testing.assert_allclose(result['ELAPSED_S'], want['ELAPSED_S'].round(3))
+    np.testing.assert_array_equal(result['BYTES_SCANNED'], want['BYTES_SCANNED'])
+    assert result['ELAPSED_S'].is_monotonic_decreasing
+    assert result['ELAPSED_SHARE'].sum() == pytest.approx(1.0, abs=0.01)
+
+
+def test_queries_of_other_apps_are_left_out():
+    history = load_fixture()
+    parsed = parse_tags(history)
+    assert 0 < len(parsed) < len(history)
+    assert all(json.loads(tag)['app'] == 'hack-g1' for tag in parsed['QUERY_TAG'])
+
+
+@pytest.mark.parametrize('by', [['PAGE'], ['PAGE', 'OPERATION'], ['OPERATION', 'SCENARIO_ID']])
+def test_report_of_chunks_matches_the_whole_history(by):
+    history = load_fixture()
+    chunks = (parse_tags(history.iloc[i:i + 10]) for i in range(0, len(history), 10))
+    pd.testing.assert_frame_equal(report(chunks, by), report(parse_tags(history), by))
+
+
+def test_query_tag_text_is_parsed_back():
+    history = pd.DataFrame({
+        'QUERY_TAG': [query_tag_text({'page': 'Dashboard', 'operation': 'cube'}), 'other tool', None],
+        'EXECUTION_STATUS': 'SUCCESS',
+        'TOTAL_ELAPSED_TIME': [1500, 10, 10],
+        'BYTES_SCANNED': [100, 1, 1],
+    })
+    result = report(parse_tags(history), ['PAGE', 'OPERATION'])
+    assert result[['PAGE', 'OPERATION', 'QUERIES', 'ELAPSED_S']].values.tolist() == [['Dashboard', 'cube', 1, 1.5]]
+
+
+def test_cli_reads_the_bundled_fixture(capsys):
+    main(['--fixture', '--by', 'PAGE'])
+    out = capsys.readouterr().out
+    assert out.splitlines()[0].split()[:3] == ['PAGE', 'QUERIES', 'FAILED']
+    assert '3_Scenario_Management' in out
@@ -0,0 +1,21 @@
+from models.dashboard_cube import refresh
+
+from conftest import FakeSession
+
+
+def test_refresh_skips_a_current_cube():
+    session = FakeSession(rows=[{'SIGNATURE': 'a|1', 'REFRESHED_AT': None}])
+    assert refresh(session, 'a|1') is False
+    assert session.verbs() == ['select']
+
+
+def test_refresh_rebuilds_the_cube_and_its_watermark_together():
+    session = FakeSession(rows=[{'SIGNATURE': 'a|1', 'REFRESHED_AT': None}])
+    assert refresh(session, 'b|2') is True
+    assert session.verbs() == ['select', 'begin', 'insert', 'merge', 'commit']
+    assert session.params[-2] == ['DATA_SOURCE.COMMENCING_ESTIMATES.DRAFT_LP_CE_ESTIMATES_2024', 'b|2']
+
+
+def test_first_refresh_builds_the_cube():
+    session = FakeSession()
+    assert refresh(session, 'a|1') is True
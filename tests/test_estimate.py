@@ -0,0 +1,139 @@
+import pandas as pd
+import pytest
+
+from models.batch import LocalBackend
+from models.estimate import BASE_COLUMNS, BASE_PERIOD, compile_sql, project
+
+from conftest import Warehouse
+
+OBSERVED = ['Session 1']
+SCENARIO = 'Plan (init)'
+
+
+def rows(counts: dict) -> pd.DataFrame:
+    """ one base period row per course, commencing study period -> count """
+    return pd.DataFrame([
+        {
+            'COURSE': 'C1', 'PERIOD': BASE_PERIOD, 'COMMENCING_STUDY_PERIOD': study_period,
+            'OWNING_FACULTY': 'Faculty of Arts', 'COURSE_LEVEL_NAME': 'Undergraduate',
+            'FEE_LIABILITY_GROUP': 'Domestic', 'COURSE_ENROLMENT_COUNT': count,
+        }
+        for study_period, count in counts.items()
+    ], columns=BASE_COLUMNS)
+
+
+def calibration(actuals: dict, base: dict):
+    actual_df = rows(actuals).assign(ACTUAL_NAME='2024.03')
+    scenario_df = rows(base).assign(SCENARIO=SCENARIO)
+    return LocalBackend(actual_df, scenario_df).calibration('2024.03', SCENARIO, OBSERVED)
+
+
+def carried(calibration) -> list:
+    base_df = calibration.base_df
+    return base_df.loc[base_df['COMMENCING_STUDY_PERIOD'] != 'Session 1', 'COURSE_ENROLMENT_COUNT'].tolist()
+
+
+def test_carried_rows_are_scaled_by_the_ratio():
+    result = calibration({'Session 1': 15}, {'Session 1': 10, 'Session 2': 7})
+    assert result.ratio == pytest.approx(1.5)
+    assert carried(result) == [11]
+
+
+def test_no_observed_base_rows_leave_the_carried_rows_as_they_are():
+    result = calibration({'Session 1': 15}, {'Session 2': 7})
+    assert result.ratio is None
+    assert carried(result) == [7]
+
+
+def test_zero_observed_total_leaves_the_carried_rows_as_they_are():
+    result = calibration({'Session 1': 15}, {'Session 1': 0, 'Session 2': 7})
+    assert result.ratio is None
+    assert carried(result) == [7]
+
+
+def test_no_actuals_leave_the_carried_rows_as_they_are():
+    result = calibration({}, {'Session 1': 10, 'Session 2': 7})
+    assert result.ratio is None
+    assert carried(result) == [7]
+
+
+def test_no_carried_rows():
+    result = calibration({'Session 1': 15}, {'Session 1': 0})
+    assert carried(result) == []
+    assert result.base_df['COURSE_ENROLMENT_COUNT'].tolist() == [15]
+
+
+PERIODS = ['2025', '2026', '2027']
+RULES = [
+    {'version': 2, 'owning_faculties': ['Faculty of Arts'], 'periods': ['2025', '2026'], 'increase_by': 0.1},
+    {'version': 2, 'courses': ['C2'], 'periods': ['2026'], 'increase_by': 0.25},
+    {'version': 2, 'courses': ['C3'], 'increase_by': None},
+]
+
+
+def cell(course, study_period, faculty, count, period=BASE_PERIOD) -> dict:
+    return {
+        'COURSE': course, 'PERIOD': period, 'COMMENCING_STUDY_PERIOD': study_period, 'OWNING_FACULTY': faculty,
+        'COURSE_LEVEL_NAME': 'Undergraduate', 'FEE_LIABILITY_GROUP': 'Domestic', 'COURSE_ENROLMENT_COUNT': count,
+    }
+
+
+BASE = pd.DataFrame([
+    cell('C1', 'Session 1', 'Faculty of Arts', 10),
+    cell('C3', 'Session 1', 'Macquarie Business School', 100),
+    cell('C1', 'Session 2', 'Faculty of Arts', 4),
+    cell('C2', 'Session 2', 'Faculty of Arts', 7),
+    cell('C3', 'Session 2', 'Macquarie Business School', 33),
+    # outside the base period
+    cell('C1', 'Session 2', 'Faculty of Arts', 50, period='2025'),
+])
+ACTUALS = {
+    # calibrated by 136 / 110
+    'ratio': pd.DataFrame([
+        cell('C1', 'Session 1', 'Faculty of Arts', 15), cell('C3', 'Session 1', 'Macquarie Business School', 121),
+    ]),
+    # no actuals, the carried rows as they are
+    'none': pd.DataFrame(columns=BASE_COLUMNS),
+}
+
+
+@pytest.fixture
+def warehouse():
+    pytest.importorskip('duckdb')
+    warehouse = Warehouse()
+    for period in [BASE_PERIOD, *PERIODS]:
+        warehouse.ref('period', period)
+    # a duplicate name, the projection takes the lowest id
+    warehouse.ref('period', '2025', id=99)
+    warehouse.add_scenario(1, 'Plan')
+    warehouse.add_scenario(2, 'Next')
+    return warehouse
+
+
+@pytest.mark.parametrize('actuals', ['ratio', 'none'])
+@pytest.mark.parametrize('observed', [['Session 1'], ['Session 3']])
+def test_compiled_projection_matches_project(warehouse, actuals, observed):
+    actual_df = ACTUALS[actuals]
+    warehouse.add_actuals('2024.03', actual_df)
+    warehouse.add_cells(1, BASE)
+
+    sql, params = compile_sql('2024.03', SCENARIO, observed, RULES, 0.03, PERIODS)
+    warehouse.execute(sql, [*params, 'Next'])
+
+    base = LocalBackend(actual_df.assign(ACTUAL_NAME='2024.03'), BASE.assign(SCENARIO=SCENARIO)).calibration(
+        '2024.03', SCENARIO, observed
+    ).base_df
+    expected = project(base[BASE_COLUMNS], RULES, 0.03, PERIODS).drop(columns='INCREASE_BY')
+    expected = expected.sort_values(list(expected.columns)).reset_index(drop=True)
+    pd.testing.assert_frame_equal(warehouse.cells(2, 'scenario_fact'), expected, check_dtype=False)
+
+    period_ids = warehouse.execute('select distinct period_id from scenario_fact where scenario_id = 2').fetchall()
+    assert 99 not in {id for id, in period_ids}
+
+
+def test_compiled_projection_compounds_per_period(warehouse):
+    warehouse.add_cells(1, BASE.iloc[[0]])
+    sql, params = compile_sql('2024.03', SCENARIO, ['Session 3'], RULES[:1], 0.03, PERIODS)
+    warehouse.execute(sql, [*params, 'Next'])
+    # ceil(10 * 1.1) = 11, ceil(11 * 1.1) = 13, then the 2026 rate carried forward: ceil(13 * 1.1) = 15
+    assert warehouse.cells(2, 'scenario_fact')['COURSE_ENROLMENT_COUNT'].tolist() == [10, 11, 13, 15]
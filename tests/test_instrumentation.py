@@ -0,0 +1,37 @@
+from helpers import instrumentation
+from helpers.instrumentation import QueryRecorder, attach
+
+
+class Connection:
+    def __init__(self):
+        self.listeners = []
+
+    def add_query_listener(self, listener):
+        self.listeners.append(listener)
+
+
+class ListeningSession:
+    def __init__(self):
+        self._conn = Connection()
+
+
+class Session:
+    """ a session whose connection has no query listeners """
+
+    def __init__(self):
+        self._conn = object()
+
+
+def test_attach_adds_one_listener_per_session(monkeypatch):
+    monkeypatch.setattr(instrumentation, '_recorders', {})
+    session = ListeningSession()
+    recorder = attach(session)
+    assert isinstance(recorder, QueryRecorder)
+    assert attach(session) is recorder
+    assert session._conn.listeners == [recorder]
+
+
+def test_attach_without_query_listeners_records_nothing(monkeypatch):
+    monkeypatch.setattr(instrumentation, '_recorders', {})
+    assert attach(Session()) is None
+    assert attach(Session()) is None
@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+
+from helpers.jobs import DONE, FAILED, Job, JobCancelled, JobRunner
+from helpers.transaction import transaction
+from models.estimate import generate_in_warehouse
+
+from conftest import FakeSession
+
+ARGS = ('Plan', 'notes', '2024.03', 'Base (init)', ['Session 1'], [], 0.03, ['2025', '2026'])
+
+
+def run(runner: JobRunner, fn, *args) -> Job:
+    job = runner.submit('generate', fn, *args)
+    job.future.result()
+    return job
+
+
+def test_generation_runs_in_one_transaction():
+    session = FakeSession()
+    job = run(JobRunner(1), generate_in_warehouse, session, *ARGS)
+    assert job.status == DONE
+    verbs = session.verbs()
+    assert verbs[0] == 'begin' and verbs[-1] == 'commit'
+    assert verbs.count('begin') == 1 and 'rollback' not in verbs
+    assert session.statements[1].startswith('insert into scenario ')
+
+
+def test_failed_generation_rolls_back_the_scenario():
+    session = FakeSession(fail_on='insert into scenario_rollup')
+    job = run(JobRunner(1), generate_in_warehouse, session, *ARGS)
+    assert job.status == FAILED
+    assert session.verbs()[-1] == 'rollback'
+    assert 'commit' not in session.verbs()
+
+
+def test_cancelled_generation_rolls_back_the_scenario():
+    session = FakeSession()
+    job = Job('generate')
+
+    def cancel_after_the_scenario(name, original=job.stage):
+        if name == 'projection':
+            job.cancel()
+        return original(name)
+
+    job.stage = cancel_after_the_scenario
+    with pytest.raises(JobCancelled):
+        generate_in_warehouse(session, *ARGS, job=job)
+    assert session.statements[1].startswith('insert into scenario ')
+    assert session.verbs()[-1] == 'rollback'
+
+
+def test_transactions_of_a_session_run_one_at_a_time():
+    session = FakeSession()
+    inside = threading.Event()
+    release = threading.Event()
+
+    def job():
+        with transaction(session):
+            inside.set()
+            release.wait(5)
+            session.sql('insert into job')
+
+    thread = threading.Thread(target=job)
+    thread.start()
+    inside.wait(5)
+    def page():
+        with transaction(session):
+            session.sql('update page')
+
+    page_thread = threading.Thread(target=page)
+    page_thread.start()
+    page_thread.join(0.2)
+    # the page waits for the job to commit before it begins
+    assert page_thread.is_alive()
+    release.set()
+    thread.join(5)
+    page_thread.join(5)
+    assert session.verbs() == ['begin', 'insert', 'commit', 'begin', 'update', 'commit']
+
+
+def test_foreground_job_finishes_in_the_calling_thread():
+    threads = []
+
+    def work(job=None):
+        threads.append(threading.current_thread())
+        return 'done'
+
+    job = JobRunner(1).submit('generate', work, background=False)
+    assert job.status == DONE and job.result == 'done'
+    assert threads == [threading.current_thread()]
+    assert job.future is None
+
+
+def test_jobs_share_the_active_session_in_the_foreground_only(monkeypatch):
+    from helpers import utils
+
+    # streamlit in snowflake: only the active session of the page
+    monkeypatch.setattr(utils, 'get_active_session', lambda: object())
+    assert not utils.can_open_session()
+    assert utils.open_session() is None
+
+    page_session = FakeSession()
+    sessions = []
+    job = JobRunner(1).submit(
+        'generate', utils.tagged(lambda session, job=None: sessions.append(session), page_session),
+        background=utils.can_open_session()
+    )
+    assert job.status == DONE
+    assert sessions == [page_session]
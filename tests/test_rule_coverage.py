@@ -0,0 +1,41 @@
+import pandas as pd
+
+from models.estimate import projection_periods
+from models.rule_coverage import CoverageIndex, _periods
+from models.rule_engine import RULE_PERIODS
+
+from conftest import FakeSession
+
+
+def cells() -> pd.DataFrame:
+    return pd.DataFrame({
+        'COURSE': ['C1', 'C2', 'C3'],
+        'COMMENCING_STUDY_PERIOD': ['Session 1', 'Session 1', 'Session 2'],
+        'OWNING_FACULTY': ['Faculty of Arts', 'Faculty of Arts', 'Macquarie Business School'],
+        'COURSE_LEVEL_NAME': ['Undergraduate', 'Postgraduate', 'Undergraduate'],
+        'FEE_LIABILITY_GROUP': ['Domestic', 'Domestic', 'International'],
+    })
+
+
+def test_coverage_spans_the_periods_of_a_long_horizon():
+    periods = projection_periods(horizon=20)
+    rules = {
+        'Arts': {'version': 2, 'owning_faculties': ['Faculty of Arts'], 'increase_by': 0.1},
+        'Late': {'version': 2, 'periods': ['2040', '2044'], 'increase_by': 0.2},
+    }
+    index = CoverageIndex(cells(), rules, periods)
+    assert index.size == 3 * 20
+    summary = index.summary().set_index('RULE_NAME')
+    assert summary.loc['Arts', 'AFFECTED'] == 2 * 20
+    assert summary.loc['Late', 'AFFECTED'] == 3 * 2
+    assert index.overlap().loc['Arts', 'Late'] == 2 * 2
+
+
+def test_periods_are_read_from_the_scenario():
+    session = FakeSession(rows=[{'PERIOD_NAME': str(year)} for year in range(2025, 2045)])
+    assert _periods(session, 'Plan (init)') == projection_periods(horizon=20)
+    assert 'p.period_name > ?' in session.statements[0]
+
+
+def test_periods_default_to_the_rule_periods():
+    assert _periods(FakeSession(), 'Empty (init)') == RULE_PERIODS
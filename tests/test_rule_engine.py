@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.legacy import legacy_project
+from models.estimate import project
+from models.rule_engine import RULE_DIMENSIONS, RULE_VERSION, migrate_rule
+
+PERIODS = ['2025', '2026', '2027']
+KEYS = ['COURSE', 'PERIOD', 'COMMENCING_STUDY_PERIOD', 'OWNING_FACULTY', 'COURSE_LEVEL_NAME', 'FEE_LIABILITY_GROUP']
+
+
+@pytest.fixture
+def base_df() -> pd.DataFrame:
+    rows = [
+        ('C1', 'Session 1', 'Faculty of Arts', 'Undergraduate', 'Domestic', 10),
+        ('C1', 'Session 2', 'Faculty of Arts', 'Undergraduate', 'Domestic', 4),
+        ('C1', 'Session 1', 'Faculty of Arts', 'Undergraduate', 'International', 7),
+        ('C2', 'Session 1', 'Faculty of Arts', 'Postgraduate', 'Domestic', 25),
+        ('C2', 'Session 2', 'Faculty of Arts', 'Postgraduate', 'International', 0),
+        ('C3', 'Session 1', 'Macquarie Business School', 'Undergraduate', 'Domestic', 120),
+        ('C3', 'Session 2', 'Macquarie Business School', 'Undergraduate', 'International', 33),
+        ('C4', 'Session 1', 'Macquarie Business School', 'Postgraduate', 'Domestic', 1),
+    ]
+    df = pd.DataFrame(rows, columns=[
+        'COURSE', 'COMMENCING_STUDY_PERIOD', 'OWNING_FACULTY', 'COURSE_LEVEL_NAME', 'FEE_LIABILITY_GROUP',
+        'COURSE_ENROLMENT_COUNT',
+    ])
+    df.insert(1, 'PERIOD', '2024')
+    return df
+
+
+def spelled_out(rule: dict, base_df: pd.DataFrame) -> dict:
+    """ the rule with every omitted list filled in, the form the merge path needs """
+    values = {**{column: sorted(base_df[column].unique()) for column in RULE_DIMENSIONS}, 'PERIOD': PERIODS}
+    return {**rule, **{key: rule.get(key, values[column]) for column, key in RULE_DIMENSIONS.items()}}
+
+
+def assert_same(expected: pd.DataFrame, actual: pd.DataFrame):
+    assert len(expected) == len(actual)
+    np.testing.assert_array_equal(expected['COURSE_ENROLMENT_COUNT'].to_numpy(), actual['COURSE_ENROLMENT_COUNT'].to_numpy())
+    np.testing.assert_allclose(expected['INCREASE_BY'].to_numpy(dtype=float), actual['INCREASE_BY'].to_numpy(dtype=float))
+    pd.testing.assert_frame_equal(expected[KEYS].reset_index(drop=True), actual[KEYS].reset_index(drop=True))
+
+
+def test_overlapping_rules_match_merge_path(base_df):
+    rules = [
+        spelled_out({'owning_faculties': ['Faculty of Arts'], 'periods': ['2025', '2026'], 'increase_by': 0.1}, base_df),
+        # overlaps the first rule on C1, later rules win
+        spelled_out({'courses': ['C1', 'C3'], 'periods': ['2026'], 'increase_by': -0.05}, base_df),
+        spelled_out({'fee_liability_groups': ['International'], 'periods': ['2027'], 'increase_by': 0.2}, base_df),
+        # a rule without a rate changes nothing
+        spelled_out({'courses': ['C2'], 'increase_by': None}, base_df),
+    ]
+    assert_same(legacy_project(base_df, rules, 0.03, PERIODS), project(base_df, rules, 0.03, PERIODS))
+
+
+def test_rules_without_a_dimension_list_match_every_value(base_df):
+    rules = [
+        {'version': 2, 'owning_faculties': ['Macquarie Business School'], 'increase_by': 0.08},
+        {'version': 2, 'course_level_names': ['Postgraduate'], 'periods': ['2026', '2027'], 'increase_by': 0.15},
+        {'version': 2, 'increase_by': 0.01, 'periods': ['2027']},
+    ]
+    expected = legacy_project(base_df, [spelled_out(rule, base_df) for rule in rules], 0.03, PERIODS)
+    assert_same(expected, project(base_df, rules, 0.03, PERIODS))
+
+
+def test_empty_list_of_a_version_1_rule_matches_nothing(base_df):
+    rules = [
+        spelled_out({'owning_faculties': ['Faculty of Arts'], 'increase_by': 0.1}, base_df),
+        {**spelled_out({'increase_by': 0.5}, base_df), 'courses': []},
+    ]
+    expected = legacy_project(base_df, rules, 0.03, PERIODS)
+    assert_same(expected, project(base_df, rules, 0.03, PERIODS))
+    assert_same(project(base_df, rules[:1], 0.03, PERIODS), project(base_df, rules, 0.03, PERIODS))
+
+
+@pytest.fixture
+def catalogue(base_df) -> dict:
+    return {**{column: set(base_df[column]) for column in RULE_DIMENSIONS}, 'PERIOD': set(PERIODS)}
+
+
+@pytest.fixture
+def course_faculty(base_df) -> dict:
+    return dict(zip(base_df['COURSE'], base_df['OWNING_FACULTY']))
+
+
+def test_migrate_rule_drops_the_lists_covering_the_catalogue(base_df, catalogue, course_faculty):
+    rule = {**spelled_out({'course_level_names': ['Postgraduate'], 'increase_by': 0.1}, base_df), 'rule_name': 'PG'}
+    migrated = migrate_rule(rule, catalogue, course_faculty)
+    # the lists of every value are dropped, the periods are kept
+    assert migrated == {
+        'rule_name': 'PG', 'increase_by': 0.1, 'version': RULE_VERSION,
+        'course_level_names': ['Postgraduate'], 'periods': PERIODS,
+    }
+    assert_same(project(base_df, [rule], 0.03, PERIODS), project(base_df, [migrated], 0.03, PERIODS))
+
+
+def test_migrate_rule_drops_the_courses_filled_in_from_the_faculties(base_df, catalogue, course_faculty):
+    rule = spelled_out({'owning_faculties': ['Faculty of Arts'], 'courses': ['C1', 'C2'], 'increase_by': 0.1}, base_df)
+    migrated = migrate_rule(rule, catalogue, course_faculty)
+    assert migrated['owning_faculties'] == ['Faculty of Arts']
+    assert 'courses' not in migrated
+    # a course picked out of its faculty is kept
+    rule['courses'] = ['C1']
+    assert migrate_rule(rule, catalogue, course_faculty)['courses'] == ['C1']
+
+
+def test_migrate_rule_keeps_a_missing_list_matching_nothing(base_df, catalogue, course_faculty):
+    rule = spelled_out({'increase_by': 0.5}, base_df)
+    del rule['fee_liability_groups']
+    migrated = migrate_rule(rule, catalogue, course_faculty)
+    assert migrated['fee_liability_groups'] == []
+    assert_same(project(base_df, [], 0.03, PERIODS), project(base_df, [migrated], 0.03, PERIODS))
+
+
+def test_migrate_rule_keeps_the_periods_of_the_horizon(base_df, catalogue, course_faculty):
+    rule = spelled_out({'increase_by': 0.1}, base_df)
+    migrated = migrate_rule(rule, {**catalogue, 'PERIOD': {*PERIODS, '2028'}}, course_faculty)
+    assert migrated['periods'] == PERIODS
+    assert_same(
+        project(base_df, [rule], 0.03, [*PERIODS, '2028']), project(base_df, [migrated], 0.03, [*PERIODS, '2028'])
+    )
+
+
+def test_migrate_rule_leaves_a_current_rule(catalogue, course_faculty):
+    rule = {'version': RULE_VERSION, 'courses': ['C1'], 'increase_by': 0.1}
+    assert migrate_rule(rule, catalogue, course_faculty) is rule
@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+from models import rule_migration
+
+from conftest import FakeSession
+
+RULE = {'courses': ['C1'], 'periods': ['2025'], 'increase_by': 0.1}
+
+
+@pytest.fixture
+def catalogue(monkeypatch):
+    monkeypatch.setattr(rule_migration, 'catalogue', lambda session: ({'COURSE': {'C1', 'C2'}}, {}))
+
+
+def test_migrate_rewrites_the_rules_in_one_transaction(catalogue):
+    session = FakeSession(rows=[{'ID': 1, 'RULE_CONTENT': json.dumps(RULE)}, {'ID': 2, 'RULE_CONTENT': '{}'}])
+    result = rule_migration.migrate(session)
+    assert result['migrated'] == 2
+    assert session.verbs() == ['select', 'begin', 'update', 'update', 'commit']
+
+
+def test_failed_migration_rolls_back(catalogue):
+    session = FakeSession(fail_on='update rule', rows=[{'ID': 1, 'RULE_CONTENT': json.dumps(RULE)}])
+    with pytest.raises(RuntimeError):
+        rule_migration.migrate(session)
+    assert session.verbs() == ['select', 'begin', 'update', 'rollback']
+
+
+def test_dry_run_writes_nothing(catalogue):
+    session = FakeSession(rows=[{'ID': 1, 'RULE_CONTENT': json.dumps(RULE)}])
+    assert rule_migration.migrate(session, dry_run=True)['migrated'] == 1
+    assert session.verbs() == ['select']
@@ -0,0 +1,152 @@
+import json
+
+import pandas as pd
+import pytest
+
+from helpers import changeset
+from helpers.refdata import RefData
+from helpers.utils import Utils
+from models import Scenario as scenario_module
+from models.Scenario import Scenario
+from models.estimate import BASE_COLUMNS
+
+from conftest import FakeSession
+
+
+@pytest.fixture
+def scenario():
+    scenario = Scenario()
+    scenario.id = 7
+    return scenario
+
+
+@pytest.fixture
+def invalidated(monkeypatch):
+    calls = []
+    monkeypatch.setattr(RefData, 'invalidate', lambda: calls.append('invalidate'))
+    return calls
+
+
+@pytest.mark.parametrize('added, expected', [(0, []), (2, ['invalidate'])])
+def test_apply_changes_invalidates_refdata_when_names_are_added(monkeypatch, scenario, invalidated, added, expected):
+    # every insert of ensure_sql() reports the rows it added
+    session = FakeSession(rows=[(added,)])
+    monkeypatch.setattr(Utils, 'get_session', lambda: session)
+    scenario.apply_changes()
+    assert session.verbs()[-1] == 'commit'
+    assert invalidated == expected
+
+
+def test_failed_save_leaves_refdata(monkeypatch, scenario, invalidated):
+    session = FakeSession(fail_on='merge into', rows=[(3,)])
+    monkeypatch.setattr(Utils, 'get_session', lambda: session)
+    with pytest.raises(RuntimeError):
+        scenario.apply_changes()
+    assert session.verbs()[-1] == 'rollback'
+    assert invalidated == []
+
+
+def cells(op: str, *counts) -> pd.DataFrame:
+    return pd.DataFrame({
+        changeset.OP_COLUMN: op,
+        'COURSE': 'B Arts',
+        'PERIOD': [str(2025 + i) for i in range(len(counts))],
+        'COMMENCING_STUDY_PERIOD': 'Session 1',
+        'OWNING_FACULTY': 'Faculty of Arts',
+        'COURSE_LEVEL_NAME': 'Undergraduate',
+        'FEE_LIABILITY_GROUP': 'Domestic',
+        'COURSE_ENROLMENT_COUNT': counts,
+    })
+
+
+@pytest.fixture
+def generated(monkeypatch, scenario, invalidated):
+    """ a generated scenario whose recompute moves the next period, the changes tables written recorded """
+    scenario.generation_params = json.dumps({'rules': [], 'default_increase': 0.03})
+    written = []
+    recomputed = cells(changeset.UPDATE, 0, 103)[BASE_COLUMNS].iloc[1:]
+    monkeypatch.setattr(scenario_module, '_write_changes', lambda df: written.append(df))
+    monkeypatch.setattr(Scenario, '_recomputed', lambda self, params, edits, rules, default: recomputed)
+    return written
+
+
+def test_save_merges_the_recomputed_periods_and_note_in_one_transaction(monkeypatch, scenario, generated):
+    session = FakeSession(rows=[(0,)])
+    monkeypatch.setattr(Utils, 'get_session', lambda: session)
+    staged = cells(changeset.UPDATE, 100)
+    scenario.apply_changes(recompute=staged, note='more arts', created_by='G1_ADMIN')
+
+    # the changes table is written before the transaction, writing a table commits
+    assert len(generated) == 1
+    assert generated[0][changeset.OP_COLUMN].tolist() == [changeset.UPDATE, changeset.UPDATE]
+    assert generated[0]['PERIOD'].tolist() == ['2025', '2026']
+    verbs = session.verbs()
+    assert verbs.count('begin') == 1 and verbs[-1] == 'commit'
+    body = session.statements[verbs.index('begin'):]
+    assert any(statement.startswith('merge into scenario_fact') for statement in body)
+    assert any(statement.startswith('insert into scenario_notes') for statement in body)
+
+
+def test_failed_note_rolls_back_the_merge(monkeypatch, scenario, generated):
+    session = FakeSession(fail_on='scenario_notes', rows=[(0,)])
+    monkeypatch.setattr(Utils, 'get_session', lambda: session)
+    with pytest.raises(RuntimeError):
+        scenario.apply_changes(recompute=cells(changeset.UPDATE, 100), note='more arts')
+    verbs = session.verbs()
+    assert 'commit' not in verbs and verbs[-1] == 'rollback'
+    assert any(statement.startswith('merge into') for statement in session.statements)
+
+
+def test_note_alone_merges_nothing(monkeypatch, scenario, invalidated):
+    session = FakeSession(rows=[(0,)])
+    monkeypatch.setattr(Utils, 'get_session', lambda: session)
+    scenario.apply_changes(merge_changes=False, note='checked')
+    assert session.verbs() == ['begin', 'insert', 'commit']
+
+
+def test_new_version_recomputes_on_its_parent_before_the_transaction(monkeypatch, scenario, generated):
+    session = FakeSession(rows=[{'ID': 8}])
+    monkeypatch.setattr(Utils, 'get_session', lambda: session)
+    monkeypatch.setattr(Scenario, 'find', staticmethod(lambda id: scenario))
+    monkeypatch.setattr(Scenario, '_merge_changes', staticmethod(lambda session, id: 0))
+    Scenario.create_version(7, 'v2', 'notes', merge_changes=True, recompute=cells(changeset.UPDATE, 100))
+    assert len(generated) == 1
+    assert session.verbs()[0] == 'begin' and session.verbs()[-1] == 'commit'
+
+
+def test_recompute_reads_the_edits_as_merged(monkeypatch, scenario):
+    # the rows read still hold the count before the edit, which is merged later with the recomputed periods
+    params = {'rules': [], 'default_increase': 0.03, 'periods': ['2025', '2026'], 'base_period': '2024'}
+    monkeypatch.setattr(Utils, 'get_session', lambda: FakeSession())
+    monkeypatch.setattr(RefData, 'lookups', lambda: {})
+    before = cells(changeset.UPDATE, 100, 103)[BASE_COLUMNS]
+    monkeypatch.setattr(scenario_module.scenario_store, 'read_frame', lambda *args, **kwargs: before)
+    changes = scenario._recomputed(params, cells(changeset.UPDATE, 200), [], 0.03)
+    assert changes['PERIOD'].tolist() == ['2026']
+    assert changes['COURSE_ENROLMENT_COUNT'].tolist() == [206]
+
+
+def test_merge_shape(monkeypatch, scenario, invalidated):
+    session = FakeSession(rows=[(0,)])
+    monkeypatch.setattr(Utils, 'get_session', lambda: session)
+    scenario.apply_changes()
+    ensures = [s for s in session.statements if s.startswith('insert into ref_')]
+    assert len(ensures) == 6
+    [merge] = [s for s in session.statements if s.startswith('merge into')]
+    assert merge.startswith('merge into scenario_fact as sd using (select t.op, course_code.id as course_id,')
+    assert 'from tmp_scenario_changes as t' in merge
+    # every dimension matched on its id, a null matching a null
+    assert ('as t on sd.scenario_id = ? and equal_null(sd.course_id, t.course_id) and equal_null(sd.period_id, '
+            't.period_id) and equal_null(sd.commencing_study_period_id, t.commencing_study_period_id) and '
+            'equal_null(sd.owning_faculty_id, t.owning_faculty_id) and equal_null(sd.course_level_id, '
+            't.course_level_id) and equal_null(sd.fee_liability_group_id, t.fee_liability_group_id) ') in merge
+    # deletes tombstone the overlay row, or insert one hiding the parent's cell
+    assert merge.endswith(
+        "when matched and t.op = 'D' then update set is_deleted = 'Y' "
+        "when matched then update set course_enrolment_count = t.course_enrolment_count, is_deleted = 'N' "
+        "when not matched then insert (scenario_id, course_id, period_id, commencing_study_period_id, "
+        "owning_faculty_id, course_level_id, fee_liability_group_id, course_enrolment_count, is_deleted) "
+        "values (?, t.course_id, t.period_id, t.commencing_study_period_id, t.owning_faculty_id, t.course_level_id, "
+        "t.fee_liability_group_id, t.course_enrolment_count, iff(t.op = 'D', 'Y', 'N'))"
+    )
+    assert session.params[session.statements.index(merge)] == [7, 7]
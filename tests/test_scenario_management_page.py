@@ -0,0 +1,91 @@
+import ast
+import contextlib
+import os
+
+import pytest
+
+PAGE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'pages', '3_Scenario_Management.py')
+
+
+def page_functions(path: str, *names: str) -> dict:
+    """ the named functions of a page with its imports, without running the page itself """
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    tree.body = [
+        node for node in tree.body
+        if isinstance(node, (ast.Import, ast.ImportFrom))
+        or isinstance(node, ast.FunctionDef) and node.name in names
+    ]
+    namespace = {}
+    exec(compile(tree, path, 'exec'), namespace)
+    return {name: namespace[name] for name in names}
+
+
+class GeneratedScenario:
+    id = 7
+
+    def __init__(self):
+        self.recomputed = None
+
+    def params(self) -> dict:
+        return {
+            'base_scenario': 'Base (init)',
+            'actual_name': '2024.03',
+            'default_increase': 0.03,
+            'rules': [
+                {'version': 2, 'rule_name': 'Arts growth', 'owning_faculties': ['Faculty of Arts'], 'increase_by': 0.1},
+                {'version': 2, 'increase_by': None},
+            ],
+        }
+
+    def recompute(self, rules: list = None, default_increase: float = None) -> int:
+        self.recomputed = rules, default_increase
+        return 0
+
+
+@pytest.fixture
+def generation_rules():
+    return page_functions(PAGE, 'generation_rules')['generation_rules']
+
+
+def test_generation_rules_renders_with_the_pinned_streamlit(generation_rules):
+    # raised TypeError: Cannot set Arrow.disabled to ['RULE_NAME'] under Streamlit 1.22
+    generation_rules(GeneratedScenario())
+
+
+def test_recompute_takes_the_edited_rates(generation_rules, monkeypatch):
+    import streamlit as st
+    from helpers.utils import Utils
+    from models.compare import Compare
+
+    shown = {}
+
+    def data_editor(data, **kwargs):
+        shown['data'] = data
+        # a rate changed, and a rule name typed over
+        return data.assign(INCREASE_BY=[0.2, 0.05], RULE_NAME=['typed over', 'Rule 2'])
+
+    monkeypatch.setattr(st, 'experimental_data_editor', data_editor)
+    monkeypatch.setattr(st, 'button', lambda *args, **kwargs: True)
+    monkeypatch.setattr(Utils, 'query_tag', lambda *args, **kwargs: contextlib.nullcontext())
+    monkeypatch.setattr(Compare, 'invalidate', lambda: None)
+    scenario = GeneratedScenario()
+    generation_rules(scenario)
+
+    assert shown['data']['RULE_NAME'].tolist() == ['Arts growth', 'Rule 2']
+    rules, default_increase = scenario.recomputed
+    assert [rule['increase_by'] for rule in rules] == [0.2, 0.05]
+    assert rules[0]['rule_name'] == 'Arts growth'
+    assert default_increase == 0.03
+
+
+def test_generation_rules_skips_scenarios_not_generated(generation_rules, monkeypatch):
+    import streamlit as st
+
+    monkeypatch.setattr(st, 'experimental_data_editor', pytest.fail)
+
+    class Imported:
+        def params(self):
+            return None
+
+    generation_rules(Imported())
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from models import scenario_store
+from models.scenario_store import decode, lookup, read_decoded, read_frame
+
+LOOKUPS = {
+    'course': lookup([1, 2, 3], ['B Arts', 'B Science', 'B Arts']),
+    'period': lookup([10, 11], ['2025', '2026']),
+}
+
+
+def chunks_of(df: pd.DataFrame, size: int) -> list:
+    return [df.iloc[i:i + size].reset_index(drop=True) for i in range(0, len(df), size)]
+
+
+@pytest.fixture
+def codes_df():
+    return pd.DataFrame({
+        'ID': np.arange(6),
+        'COURSE_ID': [1, 2, 3, np.nan, 2, 9],
+        'PERIOD_ID': [10, 11, 10, 11, np.nan, 10],
+        'COURSE_ENROLMENT_COUNT': [5.0, 6, 7, 8, 9, 10],
+    })
+
+
+@pytest.mark.parametrize('size', [1, 4, 6])
+def test_read_decoded_matches_decode(codes_df, size):
+    expected = decode(codes_df, LOOKUPS)
+    actual = read_decoded(chunks_of(codes_df, size), LOOKUPS)
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_read_decoded_columns_in_order(codes_df):
+    columns = ['PERIOD', 'ID', 'COURSE']
+    actual = read_decoded(chunks_of(codes_df, 4), LOOKUPS, columns)
+    assert list(actual.columns) == columns
+    assert actual['COURSE'].tolist()[:3] == ['B Arts', 'B Science', 'B Arts']
+
+
+def test_read_decoded_reloads_unknown_ids(codes_df):
+    # the first chunk decodes with the given lookups, the unknown id 4 reloads them
+    codes_df.loc[5, 'COURSE_ID'] = 4
+    reloaded = {**LOOKUPS, 'course': lookup([4, 1, 2, 3], ['A Law', 'B Arts', 'B Science', 'B Arts'])}
+    calls = []
+
+    def load():
+        calls.append('load')
+        return reloaded
+
+    actual = read_decoded(chunks_of(codes_df, 4), LOOKUPS, load=load)
+    assert calls == ['load']
+    assert actual['COURSE'].tolist() == ['B Arts', 'B Science', 'B Arts', np.nan, 'B Science', 'A Law']
+
+
+def test_read_decoded_empty():
+    assert read_decoded([], LOOKUPS, ['ID', 'COURSE']).columns.tolist() == ['ID', 'COURSE']
+
+
+class BatchSession:
+    """ a session whose every query returns the chunks """
+
+    def __init__(self, chunks: list):
+        self.chunks = chunks
+
+    def sql(self, sql: str, params: list = None):
+        return self
+
+    def to_pandas_batches(self):
+        return iter(self.chunks)
+
+
+@pytest.fixture
+def stale(monkeypatch):
+    calls = []
+    monkeypatch.setattr(scenario_store, '_stale_listeners', [lambda: calls.append('stale')])
+    monkeypatch.setattr(scenario_store, 'load_lookups', lambda session: {
+        **LOOKUPS, 'course': lookup([1, 2, 3, 9], ['B Arts', 'B Science', 'B Arts', 'A Law'])
+    })
+    return calls
+
+
+def test_read_frame_tells_the_cache_of_stale_lookups(codes_df, stale):
+    df = read_frame(BatchSession(chunks_of(codes_df, 4)), 'select', lookups=LOOKUPS)
+    assert stale == ['stale']
+    assert df['COURSE'].iloc[5] == 'A Law'
+
+
+def test_read_frame_loading_its_own_lookups_is_not_stale(codes_df, stale):
+    read_frame(BatchSession(chunks_of(codes_df, 4)), 'select')
+    assert stale == []
+
+
+def test_refdata_invalidates_on_stale_lookups():
+    from helpers.refdata import RefData
+
+    assert RefData.invalidate in scenario_store._stale_listeners
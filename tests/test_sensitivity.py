@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from models.estimate import project
+from models.sensitivity import SWEEP_GROUPS, parameter_grid, sweep
+
+PERIODS = ['2025', '2026', '2027']
+RULES = [
+    {'version': 2, 'rule_name': 'arts', 'owning_faculties': ['Faculty of Arts'], 'periods': ['2025', '2026'],
+     'increase_by': 0.1},
+    {'version': 2, 'rule_name': 'international', 'fee_liability_groups': ['International'], 'periods': ['2027'],
+     'increase_by': 0.2},
+    {'version': 2, 'rule_name': 'unrated', 'courses': ['C3'], 'increase_by': None},
+]
+
+
+@pytest.fixture
+def base_df() -> pd.DataFrame:
+    rows = [
+        ('C1', 'Session 1', 'Faculty of Arts', 'Domestic', 10),
+        ('C1', 'Session 2', 'Faculty of Arts', 'International', 7),
+        ('C2', 'Session 1', 'Faculty of Arts', 'Domestic', 25),
+        ('C3', 'Session 1', 'Macquarie Business School', 'Domestic', 120),
+        ('C3', 'Session 2', 'Macquarie Business School', 'International', 33),
+    ]
+    df = pd.DataFrame(rows, columns=[
+        'COURSE', 'COMMENCING_STUDY_PERIOD', 'OWNING_FACULTY', 'FEE_LIABILITY_GROUP', 'COURSE_ENROLMENT_COUNT',
+    ])
+    return df.assign(PERIOD='2024', COURSE_LEVEL_NAME='Undergraduate')
+
+
+def project_totals(base_df: pd.DataFrame, rules: list, default_increase: float) -> np.ndarray:
+    """ groups x periods totals of project(), the base period first """
+    projected = project(base_df, rules, default_increase, PERIODS)
+    return projected.pivot_table(
+        index=SWEEP_GROUPS, columns='PERIOD', values='COURSE_ENROLMENT_COUNT', aggfunc='sum'
+    )[['2024', *PERIODS]].to_numpy()
+
+
+@pytest.mark.parametrize('swept', [-1, 0, 1])
+def test_one_point_grid_matches_project(base_df, swept):
+    rate = 0.03 if swept == -1 else RULES[swept]['increase_by']
+    result = sweep(base_df, RULES, PERIODS, parameter_grid(RULES, 0.03, [rate], swept))
+    np.testing.assert_array_equal(result.totals[0], project_totals(base_df, RULES, 0.03))
+    # a single parameter set is every quantile
+    fan = result.fan(by_group=False)
+    assert fan['Q05'].tolist() == fan['Q95'].tolist() == result.totals[0].sum(axis=0).tolist()
+
+
+def test_every_point_of_a_grid_matches_project(base_df):
+    result = sweep(base_df, RULES, PERIODS, parameter_grid(RULES, 0.03, [0.05, 0.15], 0))
+    for i, rate in enumerate([0.05, 0.15]):
+        rules = [{**RULES[0], 'increase_by': rate}, *RULES[1:]]
+        np.testing.assert_array_equal(result.totals[i], project_totals(base_df, rules, 0.03))
+
+
+def test_sweeping_a_rule_without_a_rate_is_refused():
+    with pytest.raises(ValueError, match='unrated'):
+        parameter_grid(RULES, 0.03, [0.1, 0.2], 2)
@@ -0,0 +1,59 @@
+import pandas as pd
+import pytest
+
+from conftest import Warehouse
+
+
+def cells(*rows) -> pd.DataFrame:
+    """ (course, count, is_deleted) cells of 2025 """
+    return pd.DataFrame([
+        {
+            'COURSE': course, 'PERIOD': '2025', 'COMMENCING_STUDY_PERIOD': 'Session 1',
+            'OWNING_FACULTY': 'Faculty of Arts', 'COURSE_LEVEL_NAME': 'Undergraduate',
+            'FEE_LIABILITY_GROUP': 'Domestic', 'COURSE_ENROLMENT_COUNT': count, 'IS_DELETED': is_deleted,
+        }
+        for course, count, is_deleted in rows
+    ])
+
+
+@pytest.fixture
+def warehouse():
+    pytest.importorskip('duckdb')
+    warehouse = Warehouse()
+    # init <- v2 <- v3
+    warehouse.add_scenario(1, 'Plan')
+    warehouse.add_scenario(2, 'Plan', 'v2', parent_id=1)
+    warehouse.add_scenario(3, 'Plan', 'v3', parent_id=2)
+    warehouse.add_cells(1, cells(('C1', 10, 'N'), ('C2', 20, 'N'), ('C3', 30, 'N'), ('C4', 40, 'N')))
+    return warehouse
+
+
+def resolved(warehouse: Warehouse, scenario_id: int) -> dict:
+    df = warehouse.cells(scenario_id)
+    return dict(zip(df['COURSE'], df['COURSE_ENROLMENT_COUNT']))
+
+
+def test_version_without_rows_resolves_to_its_parent(warehouse):
+    assert resolved(warehouse, 2) == {'C1': 10, 'C2': 20, 'C3': 30, 'C4': 40}
+
+
+def test_tombstone_of_a_child_hides_the_cell_of_its_parent(warehouse):
+    warehouse.add_cells(2, cells(('C2', 20, 'Y'), ('C3', 33, 'N')))
+    assert resolved(warehouse, 2) == {'C1': 10, 'C3': 33, 'C4': 40}
+    # the parent keeps its cells
+    assert resolved(warehouse, 1) == {'C1': 10, 'C2': 20, 'C3': 30, 'C4': 40}
+
+
+def test_grandchild_resolves_through_both_ancestors(warehouse):
+    warehouse.add_cells(2, cells(('C2', 20, 'Y'), ('C3', 33, 'N'), ('C5', 5, 'N')))
+    # the nearest row wins: C3 over both ancestors, C2 added back over the tombstone, C4 deleted here
+    warehouse.add_cells(3, cells(('C2', 22, 'N'), ('C3', 35, 'N'), ('C4', 40, 'Y')))
+    assert resolved(warehouse, 3) == {'C1': 10, 'C2': 22, 'C3': 35, 'C5': 5}
+    assert resolved(warehouse, 2) == {'C1': 10, 'C3': 33, 'C4': 40, 'C5': 5}
+
+
+def test_null_dimension_is_a_cell_of_its_own(warehouse):
+    warehouse.add_cells(1, cells((None, 7, 'N')))
+    warehouse.add_cells(2, cells((None, 9, 'N')))
+    df = warehouse.cells(2)
+    assert df.loc[df['COURSE'].isna(), 'COURSE_ENROLMENT_COUNT'].tolist() == [9]